@@ -0,0 +1,159 @@
+"""
+Load test del servizio con micro-batching (isola_classificazione_distilbert/inference_server.py) su CPU.
+
+Per ogni configurazione del server (`--max-batch-size`, `--max-wait-ms`) avvia il servizio in un
+processo separato con un DistilBERT a pesi casuali (vedi tiny_models.py), poi per ogni livello di
+concorrenza apre `concurrency` client che inviano bug sintetici uno alla volta, ciascuno appena
+ricevuta la risposta precedente, per `--duration` secondi. Riporta throughput (bug/s), latenza
+lato client p50/p95/p99 e dimensione media dei batch letta da /metrics.
+`--max-batch-size 1` è il server senza batching, da usare come riferimento.
+
+Uso:
+    python benchmarks/bench_inference_server.py --max-batch-size 1 32 --concurrency 1 4 16 64 \
+        --json inference_server.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ISLAND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'isola_classificazione_distilbert')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from synthetic_bugs import generate_examples  # noqa: E402
+
+FIELDS = ['source', 'product', 'short_desc', 'priority', 'bug_severity']
+
+
+def _serve(port, model_size, threads, max_batch_size, max_wait_ms):
+    import torch
+
+    sys.path.insert(0, ISLAND_DIR)
+    from inference_server import model_predictor, serve
+    from tiny_models import build_tokenizer, distilbert_classifier
+
+    if threads:
+        torch.set_num_threads(threads)
+    tokenizer = build_tokenizer(tempfile.mkdtemp())
+    model = distilbert_classifier(tokenizer, model_size)
+    serve(model_predictor(model, tokenizer), port=port, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(session, url, server, timeout=120):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and server.is_alive():
+        try:
+            async with session.get(url + '/health') as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("il server non ha risposto a /health")
+
+
+async def run_level(session, url, bugs, concurrency, duration):
+    """Client a ciclo chiuso: ognuno invia un bug, attende la risposta e invia il successivo."""
+    latencies = []
+    stop = time.perf_counter() + duration
+
+    async def client(offset):
+        i = offset
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            async with session.post(url + '/predict', json=bugs[i % len(bugs)]) as response:
+                await response.read()
+                response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+            i += concurrency
+
+    async with session.get(url + '/metrics') as response:
+        before = await response.json()
+    start = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    async with session.get(url + '/metrics') as response:
+        after = await response.json()
+
+    batches = after['batches'] - before['batches']
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': p50,
+        'p95_ms': p95,
+        'p99_ms': p99,
+        'avg_batch_size': (after['items'] - before['items']) / batches if batches else None,
+    }
+
+
+async def load_test(url, server, bugs, levels, duration, warmup):
+    import aiohttp
+
+    # Nessun limite di connessioni: la concorrenza è decisa solo dal numero di client
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        await wait_ready(session, url, server)
+        await run_level(session, url, bugs, max(levels), warmup)
+        return [await run_level(session, url, bugs, level, duration) for level in levels]
+
+
+def run_config(args, bugs, max_batch_size):
+    port = free_port()
+    server = multiprocessing.get_context('spawn').Process(
+        target=_serve, args=(port, args.model_size, args.threads, max_batch_size, args.max_wait_ms), daemon=True)
+    server.start()
+    try:
+        return asyncio.run(load_test(f'http://127.0.0.1:{port}', server, bugs, args.concurrency, args.duration,
+                                     args.warmup))
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-batch-size', type=int, nargs='+', default=[1, 32],
+                        help="Configurazioni del server da confrontare (1 = senza batching)")
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help="Attesa massima prima di un batch incompleto")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64], help="Client concorrenti")
+    parser.add_argument('--duration', type=float, default=10.0, help="Secondi per livello di concorrenza")
+    parser.add_argument('--warmup', type=float, default=2.0, help="Secondi di riscaldamento per configurazione")
+    parser.add_argument('--model-size', choices=['base', 'tiny'], default='base', help="Dimensioni del DistilBERT")
+    parser.add_argument('--threads', type=int, default=None, help="torch.set_num_threads nel server")
+    parser.add_argument('--rows', type=int, default=2000, help="Bug sintetici distinti inviati a rotazione")
+    parser.add_argument('--json', help="File in cui salvare i risultati")
+    args = parser.parse_args()
+
+    bugs = generate_examples(args.rows)[FIELDS].to_dict(orient='records')
+    results = {'args': vars(args), 'results': {}}
+    for max_batch_size in args.max_batch_size:
+        print(f"\nmax_batch_size={max_batch_size}, max_wait_ms={args.max_wait_ms}")
+        print(f"{'client':>7} {'richieste':>10} {'bug/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'batch':>6}")
+        levels = run_config(args, bugs, max_batch_size)
+        for r in levels:
+            batch = f"{r['avg_batch_size']:.1f}" if r['avg_batch_size'] else '-'
+            print(f"{r['concurrency']:>7} {r['requests']:>10} {r['throughput']:>8.1f} {r['p50_ms']:>8.1f} "
+                  f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {batch:>6}")
+        results['results'][max_batch_size] = levels
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Throughput su CPU del classificatore DistilBERT con e senza batching per lunghezza.
+
+Confronta, su testi `concatenate_fields` sintetici e un DistilBERT con pesi casuali
+(dimensioni di `distilbert-base-uncased`, vedi tiny_models.py):
+- inferenza: batch da 8 con padding a 512 (tokenize_function di eval.ipynb), batch da 8 con
+  padding per batch nell'ordine del dataset (evaluate_bert_model), batch ordinati per
+  lunghezza a budget di token con DataCollatorWithPadding;
+- training: lo stesso numero di step (`--train-steps`) con `Trainer` e batch da 8 con padding
+  a 512 (ft.ipynb con `length_batching = False`) e con `LengthGroupedTrainer` (batch da 8
+  raggruppati per lunghezza, padding dinamico), partendo dagli stessi pesi.
+
+Uso:
+    python benchmarks/bench_length_batching.py --rows 2000 --max-tokens 4096 --json length_batching.json
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'isola_classificazione_distilbert'))
+
+from token_batches import token_budget_batches  # noqa: E402
+from synthetic_bugs import concatenate_fields, generate_examples  # noqa: E402
+from tiny_models import build_tokenizer, distilbert_classifier  # noqa: E402
+from datasets import Dataset  # noqa: E402
+from transformers import DataCollatorWithPadding, Trainer, TrainingArguments  # noqa: E402
+from length_batching import LengthGroupedTrainer, TokenBudgetBatchSampler, add_lengths  # noqa: E402
+
+
+def fixed_batches(n, batch_size):
+    return [list(range(i, min(i + batch_size, n))) for i in range(0, n, batch_size)]
+
+
+def run_inference(model, collator, features, batches, padding_length=None, limit=None):
+    """Esegue l'inferenza sui batch indicati; restituisce (esempi, secondi, token con padding)."""
+    samples, tokens = 0, 0
+    start = time.perf_counter()
+    for batch in batches[:limit]:
+        inputs = collator([features[i] for i in batch]) if padding_length is None else \
+            collator.tokenizer.pad([features[i] for i in batch], padding='max_length', max_length=padding_length,
+                                   return_tensors='pt')
+        with torch.no_grad():
+            model(input_ids=inputs['input_ids'], attention_mask=inputs['attention_mask'])
+        samples += len(batch)
+        tokens += inputs['input_ids'].numel()
+    return samples, time.perf_counter() - start, tokens
+
+
+def run_training(model, tokenizer, features, labels, batch_size, max_steps, max_tokens=None):
+    """
+    `max_steps` step di training con il Trainer di ft.ipynb: `Trainer` con padding a 512 se
+    `max_tokens` è None, altrimenti `LengthGroupedTrainer`. Restituisce (esempi, secondi, token con padding).
+    """
+    dataset = Dataset.from_dict({'input_ids': [f['input_ids'] for f in features],
+                                 'attention_mask': [f['attention_mask'] for f in features],
+                                 'label': labels.tolist()})
+    args = TrainingArguments(output_dir=tempfile.mkdtemp(prefix='bench_length_batching_'), learning_rate=2e-5,
+                             per_device_train_batch_size=batch_size, max_steps=max_steps, lr_scheduler_type="cosine",
+                             weight_decay=0.01, save_strategy="no", logging_strategy="no", report_to=[],
+                             disable_tqdm=True, use_cpu=True, dataloader_pin_memory=False)
+    if max_tokens is None:
+        dataset = dataset.map(lambda examples: tokenizer.pad(examples, padding='max_length', max_length=512), batched=True)
+        trainer = Trainer(model=model, args=args, train_dataset=dataset.with_format("torch"))
+        tokens = max_steps * batch_size * 512
+    else:
+        dataset = dataset.map(add_lengths, batched=True)
+        trainer = LengthGroupedTrainer(model=model, args=args, train_dataset=dataset.with_format("torch"),
+                                       data_collator=DataCollatorWithPadding(tokenizer), max_tokens=max_tokens)
+        # Token con padding dei batch della prima epoca, nell'ordine del sampler
+        sampler = TokenBudgetBatchSampler(dataset['length'], max_tokens, batch_size, shuffle=True, seed=args.seed)
+        lengths = np.asarray(dataset['length'])
+        tokens = sum(int(lengths[batch].max()) * len(batch) for batch in list(sampler)[:max_steps])
+    metrics = trainer.train().metrics
+    model.eval()
+    return max_steps * batch_size, metrics['train_runtime'], tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000, help="Esempi valutati")
+    parser.add_argument('--batch-size', type=int, default=8, help="Batch della configurazione attuale")
+    parser.add_argument('--max-tokens', type=int, default=4096, help="Budget di token per batch")
+    parser.add_argument('--size', choices=['base', 'tiny'], default='base', help="Dimensioni del DistilBERT")
+    parser.add_argument('--train-steps', type=int, default=10,
+                        help="Step di training per variante (il training completo su CPU è troppo lento)")
+    parser.add_argument('--threads', type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument('--json', help="File in cui salvare i risultati")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    df = generate_examples(args.rows)
+    texts = [concatenate_fields(row) for row in df.to_dict('records')]
+    labels = df['label'].to_numpy()
+
+    tokenizer = build_tokenizer(tempfile.mkdtemp(prefix='bench_tokenizer_'))
+    model = distilbert_classifier(tokenizer, args.size)
+    collator = DataCollatorWithPadding(tokenizer)
+    encoded = tokenizer(texts, truncation=True, max_length=512)
+    features = [{'input_ids': ids, 'attention_mask': mask} for ids, mask in zip(encoded['input_ids'], encoded['attention_mask'])]
+    lengths = np.array([len(ids) for ids in encoded['input_ids']])
+    print(f"Esempi: {len(texts)}, token per esempio: media {lengths.mean():.1f}, p95 {np.percentile(lengths, 95):.0f}, "
+          f"massimo {lengths.max()}")
+
+    budget = token_budget_batches(lengths, args.max_tokens)
+    fixed = fixed_batches(len(texts), args.batch_size)
+
+    results = []
+    print(f"\n{'Fase':<11}{'Configurazione':<36}{'Esempi/s':>10}{'Token (padding)':>17}{'Batch':>7}")
+
+    def report(phase, name, samples, seconds, tokens, batches):
+        result = {'phase': phase, 'config': name, 'samples': samples, 'seconds': seconds,
+                  'samples_per_s': samples / seconds, 'padded_tokens': tokens, 'batches': batches}
+        results.append(result)
+        print(f"{phase:<11}{name:<36}{result['samples_per_s']:>10.1f}{tokens:>17}{batches:>7}")
+
+    for name, batches, padding_length in [(f'batch {args.batch_size}, padding a 512', fixed, 512),
+                                          (f'batch {args.batch_size}, padding per batch', fixed, None),
+                                          (f'budget {args.max_tokens} token, ordinati', budget, None)]:
+        report('inferenza', name, *run_inference(model, collator, features, batches, padding_length), len(batches))
+
+    # Training: stessi step, stessi esempi per step e stessi pesi iniziali nelle due varianti
+    for name, max_tokens in [(f'Trainer, batch {args.batch_size}, padding a 512', None),
+                             (f'LengthGroupedTrainer, batch {args.batch_size}', args.max_tokens)]:
+        samples, seconds, tokens = run_training(copy.deepcopy(model), tokenizer, features, labels, args.batch_size,
+                                                args.train_steps, max_tokens)
+        report('training', name, samples, seconds, tokens, args.train_steps)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': args.rows, 'size': args.size, 'threads': torch.get_num_threads(),
+                       'mean_tokens': float(lengths.mean()), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Generazione su CPU dell'isola LLM: un prompt alla volta (come il vecchio evaluate_model di
+eval_model.ipynb) contro i batch di llm_evaluation.py, ordinati per lunghezza e paddati a sinistra.
+
+Usa un modello causale stile Llama con pesi casuali (tiny_models.causal_lm) e decodifica greedy,
+così si può anche verificare che i batch non cambino le risposte: con il padding a sinistra i token
+generati devono coincidere con quelli della generazione singola (a meno di differenze numeriche
+minime), con il padding a destra no. Misura anche il punteggio con un solo forward sui logit di
+'0' e '1' (`scoring="logits"`), confrontato con lo stesso punteggio calcolato un prompt alla volta.
+
+Uso:
+    python benchmarks/bench_llm_generation.py --rows 256 --batch-size 16 --json llm_generation.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'isola_esperimento_llm'))
+
+from synthetic_bugs import format_prompt, generate_examples  # noqa: E402  (aggiunge dataset_completo al path)
+from tiny_models import causal_lm  # noqa: E402
+from llm_evaluation import generate_batch, label_token_ids, prompt_batches, score_batch  # noqa: E402
+
+
+def run(model, tokenizer, encoded, batches, generation_kwargs):
+    """Genera le risposte batch per batch; restituisce (risposte nell'ordine dei prompt, secondi, token con padding)."""
+    responses, tokens = [None] * len(encoded), 0
+    start = time.perf_counter()
+    for indices in batches:
+        for i, text in zip(indices, generate_batch(model, tokenizer, [encoded[i] for i in indices], **generation_kwargs)):
+            responses[i] = text
+        tokens += len(indices) * max(len(encoded[i]) for i in indices)
+    return responses, time.perf_counter() - start, tokens
+
+
+def run_right_padded(model, tokenizer, encoded, batches, generation_kwargs):
+    """Come `run`, ma con padding a destra: i nuovi token seguono il padding dei prompt più corti."""
+    responses, tokens = [None] * len(encoded), 0
+    start = time.perf_counter()
+    for indices in batches:
+        inputs = tokenizer.pad({'input_ids': [encoded[i] for i in indices]}, padding=True, padding_side='right',
+                               return_tensors='pt')
+        with torch.no_grad():
+            outputs = model.generate(**inputs, pad_token_id=tokenizer.pad_token_id, **generation_kwargs)
+        texts = tokenizer.batch_decode(outputs[:, inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+        for i, text in zip(indices, texts):
+            responses[i] = text
+        tokens += inputs['input_ids'].numel()
+    return responses, time.perf_counter() - start, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=256, help="Prompt valutati")
+    parser.add_argument('--batch-size', type=int, default=16, help="Prompt per batch")
+    parser.add_argument('--max-tokens', type=int, default=None, help="Budget di token per batch (opzionale)")
+    parser.add_argument('--max-new-tokens', type=int, default=2, help="Token generati per prompt")
+    parser.add_argument('--size', choices=['tiny', 'small'], default='small', help="Dimensioni del modello")
+    parser.add_argument('--threads', type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument('--json', help="File in cui salvare i risultati")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model, tokenizer = causal_lm(args.size)
+    df = generate_examples(args.rows, comment_words=0)
+    prompts = [format_prompt(row) for row in df.to_dict('records')]
+    encoded = tokenizer(prompts, truncation=True, max_length=2048)['input_ids']
+    lengths = np.array([len(ids) for ids in encoded])
+    print(f"Prompt: {len(prompts)}, token per prompt: media {lengths.mean():.1f}, min {lengths.min()}, max {lengths.max()}")
+
+    generation_kwargs = {'max_new_tokens': args.max_new_tokens, 'do_sample': False}
+    serial = [[i] for i in range(len(encoded))]
+    batched = prompt_batches(lengths, args.batch_size, args.max_tokens, args.max_new_tokens)
+    unsorted = [list(range(i, min(i + args.batch_size, len(encoded)))) for i in range(0, len(encoded), args.batch_size)]
+
+    results = []
+    reference = None
+    print(f"\n{'Configurazione':<44}{'Prompt/s':>10}{'Token (padding)':>17}{'Batch':>7}{'Risposte diverse':>18}")
+    for name, batches, func in [('un prompt alla volta', serial, run),
+                                (f'batch {args.batch_size}, ordine del dataset, padding a destra', unsorted, run_right_padded),
+                                (f'batch {args.batch_size}, ordine del dataset', unsorted, run),
+                                (f'batch {args.batch_size}, ordinati per lunghezza', batched, run)]:
+        responses, seconds, tokens = func(model, tokenizer, encoded, batches, generation_kwargs)
+        reference = reference or responses
+        mismatches = sum(a != b for a, b in zip(responses, reference))
+        results.append({'config': name, 'seconds': seconds, 'prompts_per_s': len(encoded) / seconds,
+                        'padded_tokens': tokens, 'batches': len(batches), 'mismatches': mismatches})
+        print(f"{name:<44}{len(encoded) / seconds:>10.1f}{tokens:>17}{len(batches):>7}{mismatches:>18}")
+
+    # Punteggio sui logit: un forward per batch, nessun passo di decodifica
+    label_ids = label_token_ids(tokenizer)
+    scoring_batches = prompt_batches(lengths, args.batch_size, args.max_tokens, max_new_tokens=0)
+    start = time.perf_counter()
+    scores = np.empty(len(encoded))
+    for indices in scoring_batches:
+        scores[indices] = score_batch(model, tokenizer, [encoded[i] for i in indices], label_ids)
+    seconds = time.perf_counter() - start
+    single = np.concatenate([score_batch(model, tokenizer, [ids], label_ids) for ids in encoded[:32]])
+    difference = float(np.abs(single - scores[:32]).max())
+    name = f'logit 0/1, batch {args.batch_size}, un forward'
+    results.append({'config': name, 'seconds': seconds, 'prompts_per_s': len(encoded) / seconds,
+                    'batches': len(scoring_batches), 'max_score_difference': difference})
+    print(f"{name:<44}{len(encoded) / seconds:>10.1f}{'':>17}{len(scoring_batches):>7}{'-':>18}")
+    print(f"\nPunteggi in batch contro un prompt alla volta: differenza massima {difference:.1e}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': args.rows, 'size': args.size, 'threads': torch.get_num_threads(),
+                       'mean_tokens': float(lengths.mean()), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
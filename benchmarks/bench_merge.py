@@ -0,0 +1,139 @@
+"""
+Benchmark di mergeCsv.process_and_merge_datasets (a blocchi) contro l'implementazione precedente,
+che caricava e concatenava in memoria tutte le fonti.
+
+Per ogni scala (1x, 10x, 100x le righe di base) genera le tabelle `<Fonte>_data` sintetiche ed
+esegue ogni variante in un processo nuovo, misurando tempo e picco di memoria residente.
+
+Uso:
+    python benchmarks/bench_merge.py --rows 5000 --scales 1 10 100 --json merge_results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from dataset_io import read_table, resolve_table  # noqa: E402
+from extractData import peak_rss_mb  # noqa: E402
+from mergeCsv import process_and_merge_datasets  # noqa: E402
+from synthetic_bugs import write_data_tables  # noqa: E402
+
+
+# Implementazione precedente, riportata invariata come riferimento
+def legacy_clean_text(text):
+    if isinstance(text, str):
+        text = re.sub(r'\s+', ' ', text).strip()
+        return text if text else np.nan
+    return np.nan
+
+
+def legacy_handle_missing_values(df):
+    df = df.copy()
+    numeric_columns = df.select_dtypes(include=[np.number]).columns
+    text_columns = df.select_dtypes(include=['object']).columns
+    for col in numeric_columns:
+        if col == 'days_resolution':
+            df[col].fillna(df[col].quantile(0.75), inplace=True)
+        else:
+            df[col].fillna(0, inplace=True)
+    for col in text_columns:
+        df[col].fillna('Unknown', inplace=True)
+    df.drop_duplicates(inplace=True)
+    return df
+
+
+def legacy_process_and_merge(input_dir, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    cleaned_dfs = []
+    for file in [f for f in os.listdir(input_dir) if f.endswith('_data.csv')]:
+        df = pd.read_csv(os.path.join(input_dir, file))
+        for col in ['short_desc', 'comments', 'product', 'priority']:
+            if col in df.columns:
+                df[col] = df[col].apply(legacy_clean_text)
+        df = legacy_handle_missing_values(df)
+        df['days_resolution'] = pd.to_numeric(df['days_resolution'], errors='coerce')
+        df.dropna(subset=['days_resolution'], inplace=True)
+        df['source'] = file.replace('_data.csv', '')
+        cleaned_dfs.append(df)
+    merged_df = pd.concat(cleaned_dfs, ignore_index=True)
+    global_75th_percentile = merged_df['days_resolution'].quantile(0.75)
+    final_dfs = []
+    for df in cleaned_dfs:
+        df['label'] = (df['days_resolution'] > global_75th_percentile).astype(int)
+        df.to_csv(os.path.join(output_dir, f"{df['source'].iloc[0]}_processed_labeled.csv"), index=False)
+        final_dfs.append(df)
+    pd.concat(final_dfs, ignore_index=True).to_csv(os.path.join(output_dir, "merged_processed_labeled.csv"), index=False)
+
+
+VARIANTS = {
+    'legacy (csv)': ('csv', lambda i, o: legacy_process_and_merge(i, o)),
+    'chunked (csv)': ('csv', lambda i, o: process_and_merge_datasets(i, o, fmt='csv')),
+    'chunked (parquet)': ('parquet', lambda i, o: process_and_merge_datasets(i, o, fmt='parquet')),
+    'chunked (parquet, sketch)': ('parquet', lambda i, o: process_and_merge_datasets(i, o, fmt='parquet', quantile_mode='sketch')),
+}
+
+
+def _run_variant(name, input_dir, output_dir):
+    """Esegue una variante nel processo corrente (nuovo) e ne misura tempo e memoria."""
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    VARIANTS[name][1](input_dir, output_dir)
+    seconds = time.perf_counter() - start
+    peak = peak_rss_mb()
+    labels = read_table(resolve_table(output_dir, 'merged_processed_labeled'), columns=['label'])['label']
+    return {'seconds': seconds, 'peak_rss_mb': peak, 'delta_rss_mb': peak - baseline,
+            'rows': int(len(labels)), 'positives': int(labels.sum())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000, help="Righe totali alla scala 1x")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--variants', nargs='+', default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument('--json', help="File in cui salvare i risultati")
+    args = parser.parse_args()
+
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    workdir = tempfile.mkdtemp(prefix='bench_merge_')
+    try:
+        for scale in args.scales:
+            rows = args.rows * scale
+            inputs = {}
+            for fmt in sorted({VARIANTS[v][0] for v in args.variants}):
+                inputs[fmt] = os.path.join(workdir, f'input_{scale}_{fmt}')
+                # Anche la generazione gira in un processo separato: su Linux il picco di RSS
+                # (ru_maxrss) del padre viene ereditato dai processi figli
+                with ctx.Pool(1) as pool:
+                    pool.apply(write_data_tables, (inputs[fmt], rows), {'fmt': fmt})
+            for name in args.variants:
+                output_dir = os.path.join(workdir, 'output')
+                shutil.rmtree(output_dir, ignore_errors=True)
+                with ctx.Pool(1) as pool:
+                    result = pool.apply(_run_variant, (name, inputs[VARIANTS[name][0]], output_dir))
+                result.update({'variant': name, 'scale': scale, 'input_rows': rows})
+                results.append(result)
+                print(f"{scale:>4}x {name:<28}{result['seconds']:>9.2f} s{result['peak_rss_mb']:>10.1f} MB picco"
+                      f"{result['delta_rss_mb']:>10.1f} MB delta   righe={result['rows']} label=1: {result['positives']}")
+            for path in inputs.values():
+                shutil.rmtree(path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark dell'indice MinHash/LSH dei quasi duplicati (dataset_completo/near_duplicates.py).
+
+Per ogni scala indicizza `short_desc` sintetici e cerca un blocco di testi in cui metà sono copie
+di testi indicizzati con una parola sostituita, poi misura:
+- il tempo di costruzione dell'indice (firme + inserimento a blocchi),
+- il tempo di ricerca di un blocco di testi (metà quasi duplicati, metà nuovi),
+- richiamo e precisione sui quasi duplicati inseriti, memoria residente di picco.
+
+La similarità stimata da MinHash ha una varianza di circa s(1 - s) / num_perm: le coppie con
+similarità vicina alla soglia finiscono da una parte o dall'altra in modo casuale. Per questo il
+richiamo è calcolato sulle coppie con Jaccard reale >= soglia + margine e la precisione conta
+come errori solo le coppie restituite con Jaccard reale < soglia - margine.
+
+Ogni scala gira in un processo nuovo per misurare il picco di memoria.
+
+Uso:
+    python benchmarks/bench_near_duplicates.py --rows 10000 100000 1000000 --json near_dup_results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from extractData import peak_rss_mb  # noqa: E402
+from near_duplicates import NearDuplicateIndex  # noqa: E402
+
+# Vocabolario ampio, così le collisioni casuali tra testi indipendenti sono rare
+VOCABULARY = np.array([f"w{i}" for i in range(50000)])
+
+
+def generate_texts(n, rng, words=(6, 20)):
+    """Genera `n` testi indipendenti di lunghezza casuale (in parole)."""
+    return [' '.join(rng.choice(VOCABULARY, size=int(rng.integers(*words)))) for _ in range(n)]
+
+
+def perturb(text, rng):
+    """Quasi duplicato di `text`: una parola sostituita."""
+    words = text.split()
+    words[int(rng.integers(len(words)))] = str(rng.choice(VOCABULARY))
+    return ' '.join(words)
+
+
+def jaccard(a, b):
+    """Similarità di Jaccard esatta tra gli insiemi di bigrammi di parole (come l'indice)."""
+    a, b = a.split(), b.split()
+    a, b = set(zip(a, a[1:])) or {tuple(a)}, set(zip(b, b[1:])) or {tuple(b)}
+    return len(a & b) / len(a | b)
+
+
+def _run_scale(rows, queries, chunk_size, threshold, num_perm, margin, seed):
+    """Costruisce l'indice su `rows` testi e interroga `queries` testi, nel processo corrente."""
+    rng = np.random.default_rng(seed)
+    texts = generate_texts(rows, rng)
+
+    # Query: metà copie modificate di testi indicizzati, metà testi nuovi
+    planted = rng.integers(rows, size=queries // 2)
+    query_texts = [perturb(texts[j], rng) for j in planted] + generate_texts(queries - len(planted), rng)
+
+    index = NearDuplicateIndex(threshold=threshold, num_perm=num_perm)
+    baseline = peak_rss_mb()
+    signing = 0.0
+    start = time.perf_counter()
+    for offset in range(0, rows, chunk_size):
+        t = time.perf_counter()
+        signatures, valid = index.signatures(texts[offset:offset + chunk_size])
+        signing += time.perf_counter() - t
+        index.add(signatures[valid], offset + np.flatnonzero(valid))
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    signatures, _ = index.signatures(query_texts)
+    query, matches, similarity = index.query(signatures)
+    query_seconds = time.perf_counter() - start
+
+    found = {(int(q), int(m)) for q, m in zip(query, matches)}
+    expected = [(i, int(j)) for i, j in enumerate(planted) if jaccard(query_texts[i], texts[j]) >= threshold + margin]
+    true_pairs = sum(jaccard(query_texts[q], texts[m]) >= threshold - margin for q, m in found)
+
+    return {
+        'rows': rows, 'queries': queries, 'bands': index.bands, 'rows_per_band': index.rows,
+        'build_seconds': build, 'signature_seconds': signing, 'build_rows_per_s': rows / build,
+        'query_seconds': query_seconds, 'query_rows_per_s': queries / query_seconds,
+        'expected_pairs': len(expected),
+        'recall': float(np.mean([pair in found for pair in expected])) if expected else float('nan'),
+        'precision': true_pairs / max(len(found), 1),
+        'peak_rss_mb': peak_rss_mb(), 'delta_rss_mb': peak_rss_mb() - baseline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000], help="Testi indicizzati")
+    parser.add_argument('--queries', type=int, default=10000, help="Testi cercati nell'indice")
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--num-perm', type=int, default=64)
+    parser.add_argument('--margin', type=float, default=0.05, help="Margine attorno alla soglia per richiamo e precisione")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help="File in cui salvare i risultati")
+    args = parser.parse_args()
+
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{'Righe':>10}{'Costruzione (s)':>17}{'Righe/s':>11}{'Ricerca (s)':>13}{'Query/s':>10}"
+          f"{'Richiamo':>10}{'Precisione':>12}{'Picco RSS (MB)':>16}")
+    for rows in args.rows:
+        with ctx.Pool(1) as pool:
+            result = pool.apply(_run_scale, (rows, args.queries, args.chunk_size, args.threshold, args.num_perm,
+                                             args.margin, args.seed))
+        results.append(result)
+        print(f"{rows:>10}{result['build_seconds']:>17.2f}{result['build_rows_per_s']:>11.0f}"
+              f"{result['query_seconds']:>13.2f}{result['query_rows_per_s']:>10.0f}"
+              f"{result['recall']:>10.3f}{result['precision']:>12.3f}{result['peak_rss_mb']:>16.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
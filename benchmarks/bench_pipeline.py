@@ -0,0 +1,228 @@
+"""
+Benchmark end-to-end su CPU della pipeline dei dati e dei modelli, su bug report sintetici.
+
+Per ogni numero di righe (da 10k a 10M) genera i dump `<Fonte>_original.json` con
+synthetic_bugs.py (numero e lunghezza dei commenti configurabili) ed esegue in sequenza:
+- `json_to_csv`: conversione dei dump nelle tabelle `<Fonte>_data`;
+- `process_and_merge_datasets`: pulizia, etichette e dataset unificato;
+- `create_balanced_datasets`: manifest degli split bilanciati;
+- `tokenization`: tokenizzazione (tokenizer fast WordPiece) del testo `concatenate_fields` di tutto il
+  dataset unificato, letto a blocchi, più i commenti con `--tokenize-comments`;
+- `inference`: classificazione del test set con un DistilBERT ridotto (tiny_models.py), a batch per
+  lunghezza entro un budget di token.
+
+Ogni fase gira in un processo nuovo, così il picco di memoria residente è solo suo; durante la fase
+CPU e RSS sono campionati in background (system_profiler.py). I risultati (tempo, righe/s, picco e
+incremento di RSS, CPU media, più latenze per batch dell'inferenza) sono salvati in JSON insieme al
+commit corrente; con `--compare` vengono confrontati con quelli di un'esecuzione precedente.
+
+Uso:
+    python benchmarks/bench_pipeline.py --rows 10000 100000 1000000 --json pipeline.json
+    python benchmarks/bench_pipeline.py --rows 10000 100000 --compare pipeline.json
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from dataset_io import iter_table_chunks, load_split, output_paths, resolve_table  # noqa: E402
+from extractData import files as SOURCES, json_to_csv, peak_rss_mb  # noqa: E402
+from mergeCsv import process_and_merge_datasets  # noqa: E402
+from split_into_balanced_datasets import create_balanced_datasets  # noqa: E402
+from synthetic_bugs import concatenate_fields, write_json_dumps  # noqa: E402
+from system_profiler import BatchProfiler, SystemSampler  # noqa: E402
+
+STAGES = ('json_to_csv', 'process_and_merge_datasets', 'create_balanced_datasets', 'tokenization', 'inference')
+
+# Librerie importate prima di avviare il cronometro (il loro import non è un costo della fase)
+STAGE_IMPORTS = {'tokenization': ('transformers',), 'inference': ('torch', 'transformers')}
+
+
+def stage_json_to_csv(workdir, args):
+    output_dir = os.path.join(workdir, 'csv_output_from_json')
+    os.makedirs(output_dir, exist_ok=True)
+    rows = 0
+    for source in SOURCES:
+        rows += json_to_csv(os.path.join(workdir, 'Dataset', source + '_original.json'),
+                            output_paths(output_dir, source + '_data', args['fmt']))
+    return {'rows': rows}
+
+
+def stage_process_and_merge_datasets(workdir, args):
+    process_and_merge_datasets(os.path.join(workdir, 'csv_output_from_json'),
+                               os.path.join(workdir, 'processed_labeled_datasets'), fmt=args['fmt'])
+    merged = resolve_table(os.path.join(workdir, 'processed_labeled_datasets'), 'merged_processed_labeled')
+    return {'rows': sum(len(chunk) for chunk in iter_table_chunks(merged, 100000, columns=['label']))}
+
+
+def stage_create_balanced_datasets(workdir, args):
+    # create_balanced_datasets scrive in ./balanced_datasets
+    os.chdir(workdir)
+    splits = create_balanced_datasets(input_dir='processed_labeled_datasets', sizes=args['sizes'])
+    return {'rows': int(sum(len(ids) for ids in splits.values())),
+            'splits': {name: int(len(ids)) for name, ids in splits.items()}}
+
+
+def stage_tokenization(workdir, args):
+    from tiny_models import build_tokenizer
+
+    tokenizer = build_tokenizer(os.path.join(workdir, 'tokenizer'))
+    merged = resolve_table(os.path.join(workdir, 'processed_labeled_datasets'), 'merged_processed_labeled')
+    columns = ['source', 'product', 'short_desc', 'priority', 'bug_severity'] + \
+        (['comments'] if args['tokenize_comments'] else [])
+    rows, tokens = 0, 0
+    for chunk in iter_table_chunks(merged, 10000, columns=columns):
+        texts = [concatenate_fields(row) for row in chunk.to_dict('records')]
+        tokens += sum(len(ids) for ids in tokenizer(texts, truncation=True, max_length=512)['input_ids'])
+        if args['tokenize_comments']:
+            comments = chunk['comments'].astype(str).tolist()
+            tokens += sum(len(ids) for ids in tokenizer(comments, truncation=True, max_length=512)['input_ids'])
+        rows += len(chunk)
+    return {'rows': rows, 'tokens': tokens, 'tokens_per_s': None}
+
+
+def stage_inference(workdir, args):
+    import torch
+    from tiny_models import build_tokenizer, distilbert_classifier
+    from token_batches import token_budget_batches
+
+    torch.set_num_threads(args['threads'] or torch.get_num_threads())
+    balanced_dir = os.path.join(workdir, 'balanced_datasets')
+    df = load_split('test', balanced_dir, columns=['source', 'product', 'short_desc', 'priority', 'bug_severity',
+                                                   'label']).head(args['inference_rows'])
+    tokenizer = build_tokenizer(os.path.join(workdir, 'tokenizer'))
+    model = distilbert_classifier(tokenizer, 'tiny')
+    encoded = tokenizer([concatenate_fields(row) for row in df.to_dict('records')], truncation=True, max_length=512)
+    batches = token_budget_batches([len(ids) for ids in encoded['input_ids']], args['max_tokens'])
+    with BatchProfiler('cpu', interval=0.05) as profiler:
+        for indices in batches:
+            with profiler.batch(len(indices)):
+                inputs = tokenizer.pad({'input_ids': [encoded['input_ids'][i] for i in indices]}, return_tensors='pt')
+                with torch.no_grad():
+                    model(**inputs)
+    summary = profiler.summary()
+    # rows_per_s della fase include caricamento dello split e costruzione del modello; qui solo i forward
+    return {'rows': len(df), 'batches': summary['batches'], 'forward_rows_per_s': summary['samples_per_s'],
+            'p50_batch_s': summary['p50_time'],
+            'p95_batch_s': summary['p95_time'], 'p99_batch_s': summary['p99_time']}
+
+
+def _run_stage(stage, workdir, args):
+    """Esegue una fase nel processo corrente (nuovo), misurando tempo, memoria e CPU."""
+    for module in STAGE_IMPORTS.get(stage, ()):
+        importlib.import_module(module)
+    baseline = peak_rss_mb()
+    with SystemSampler(interval=0.1) as sampler:
+        start = time.perf_counter()
+        result = globals()[f'stage_{stage}'](workdir, args)
+        seconds = time.perf_counter() - start
+    samples = sampler.frame()
+    peak = peak_rss_mb()
+    result.update({'seconds': seconds, 'rows_per_s': result['rows'] / seconds if seconds > 0 else None,
+                   'peak_rss_mb': peak, 'delta_rss_mb': peak - baseline if peak is not None else None,
+                   'cpu_mean': float(samples['cpu'].mean()) if len(samples) else None})
+    if 'tokens' in result:
+        result['tokens_per_s'] = result['tokens'] / seconds if seconds > 0 else None
+    return result
+
+
+def git_commit():
+    """Commit corrente del repository (None fuori da git)."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """Rapporto dei tempi rispetto a un'esecuzione precedente, per (righe, fase)."""
+    before = {(r['input_rows'], r['stage']): r for r in previous['results']}
+    print(f"\nConfronto con {previous.get('commit')} ({previous.get('date')}): tempo attuale / precedente")
+    for r in results:
+        old = before.get((r['input_rows'], r['stage']))
+        if old is None:
+            continue
+        ratio = r['seconds'] / old['seconds'] if old['seconds'] else float('nan')
+        flag = '  ⚠️ più lento' if ratio > 1.2 else ''
+        print(f"{r['input_rows']:>10} {r['stage']:<28}{old['seconds']:>9.2f} s -> {r['seconds']:>9.2f} s"
+              f"  x{ratio:.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                        help="Righe totali dei dump sintetici (una esecuzione per valore, 10k-10M)")
+    parser.add_argument('--comments', type=float, default=3, help="Commenti medi per bug")
+    parser.add_argument('--comment-words', type=int, default=40, help="Parole medie per commento")
+    parser.add_argument('--layout', choices=['lines', 'array'], default='lines', help="Formato dei dump JSON")
+    parser.add_argument('--fmt', choices=['parquet', 'csv'], default='parquet', help="Formato delle tabelle")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 5000, 10000],
+                        help="Dimensioni dei training set bilanciati")
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES,
+                        help="Fasi misurate (le precedenti vengono comunque eseguite)")
+    parser.add_argument('--tokenize-comments', action='store_true', help="Tokenizza anche i commenti")
+    parser.add_argument('--inference-rows', type=int, default=2000, help="Righe del test set classificate")
+    parser.add_argument('--max-tokens', type=int, default=4096, help="Budget di token per batch di inferenza")
+    parser.add_argument('--threads', type=int, default=None, help="torch.set_num_threads per l'inferenza")
+    parser.add_argument('--workdir', help="Cartella di lavoro (default: temporanea, rimossa alla fine)")
+    parser.add_argument('--json', help="File in cui salvare i risultati")
+    parser.add_argument('--compare', help="Risultati JSON di un'esecuzione precedente da confrontare")
+    args = parser.parse_args()
+
+    stage_args = {'fmt': args.fmt, 'sizes': args.sizes, 'tokenize_comments': args.tokenize_comments,
+                  'inference_rows': args.inference_rows, 'max_tokens': args.max_tokens, 'threads': args.threads}
+    last_stage = max(STAGES.index(stage) for stage in args.stages)
+    ctx = multiprocessing.get_context('spawn')
+    root = args.workdir or tempfile.mkdtemp(prefix='bench_pipeline_')
+    results = []
+    print(f"{'Righe':>10} {'Fase':<28}{'Tempo':>10}{'Righe/s':>12}{'Picco RSS':>12}{'Delta RSS':>12}{'CPU':>7}")
+    try:
+        for rows in args.rows:
+            workdir = os.path.join(root, f'rows_{rows}')
+            shutil.rmtree(workdir, ignore_errors=True)
+            start = time.perf_counter()
+            write_json_dumps(os.path.join(workdir, 'Dataset'), rows, layout=args.layout, comments=args.comments,
+                             comment_words=args.comment_words)
+            json_mb = sum(os.path.getsize(os.path.join(workdir, 'Dataset', f)) for f in os.listdir(
+                os.path.join(workdir, 'Dataset'))) / 2 ** 20
+            print(f"{rows:>10} {'(generazione dei dump)':<28}{time.perf_counter() - start:>9.2f}s   {json_mb:.1f} MB di JSON")
+            for stage in STAGES[:last_stage + 1]:
+                with ctx.Pool(1) as pool:
+                    result = pool.apply(_run_stage, (stage, workdir, stage_args))
+                if stage not in args.stages:
+                    continue
+                result.update({'stage': stage, 'input_rows': rows, 'json_mb': json_mb})
+                results.append(result)
+                rss = f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else 'n/d'
+                delta = f"{result['delta_rss_mb']:.0f} MB" if result['delta_rss_mb'] is not None else 'n/d'
+                print(f"{rows:>10} {stage:<28}{result['seconds']:>9.2f}s{result['rows_per_s']:>12.0f}{rss:>12}"
+                      f"{delta:>12}{result['cpu_mean'] or 0:>6.0f}%")
+            if not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {'commit': git_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+              'cpu_count': os.cpu_count(), 'config': {k: v for k, v in vars(args).items() if k not in ('json', 'compare')},
+              'results': results}
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=float)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Cache del prefisso comune dei prompt dell'isola LLM (PrefixCache di llm_evaluation.py) su CPU.
+
+Tutti i prompt di eval_model.ipynb iniziano con lo stesso blocco di istruzioni: con la cache il
+prefill elabora solo i token specifici di ogni bug. Per la generazione (2 token, greedy) e per il
+punteggio sui logit misura token di prefill, prompt/s e latenza media per batch con e senza cache,
+e verifica che i risultati non cambino. Usa il modello causale con pesi casuali di tiny_models.py.
+
+Uso:
+    python benchmarks/bench_prefix_cache.py --rows 256 --batch-size 8 --json prefix_cache.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'isola_esperimento_llm'))
+
+from synthetic_bugs import format_prompt, generate_examples  # noqa: E402  (aggiunge dataset_completo al path)
+from tiny_models import causal_lm  # noqa: E402
+from llm_evaluation import PrefixCache, generate_batch, label_token_ids, prompt_batches, score_batch  # noqa: E402
+
+
+def timed(batches, step):
+    """Esegue `step(indices)` per ogni batch; restituisce (risultati nell'ordine dei prompt, secondi per batch)."""
+    results, times = {}, []
+    for indices in batches:
+        start = time.perf_counter()
+        for i, value in zip(indices, step(indices)):
+            results[i] = value
+        times.append(time.perf_counter() - start)
+    return [results[i] for i in sorted(results)], np.array(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=256, help="Prompt valutati")
+    parser.add_argument('--batch-size', type=int, default=8, help="Prompt per batch")
+    parser.add_argument('--max-new-tokens', type=int, default=2, help="Token generati per prompt")
+    parser.add_argument('--size', choices=['tiny', 'small'], default='small', help="Dimensioni del modello")
+    parser.add_argument('--threads', type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument('--json', help="File in cui salvare i risultati")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model, tokenizer = causal_lm(args.size)
+    df = generate_examples(args.rows, comment_words=0)
+    encoded = tokenizer([format_prompt(row) for row in df.to_dict('records')], truncation=True, max_length=2048)['input_ids']
+    lengths = np.array([len(ids) for ids in encoded])
+
+    start = time.perf_counter()
+    prefix_cache = PrefixCache(model, tokenizer, encoded, encoded=True)
+    setup = time.perf_counter() - start
+    total = int(lengths.sum())
+    cached = total - prefix_cache.length * len(encoded)
+    print(f"Prompt: {len(encoded)}, token per prompt: media {lengths.mean():.1f}; prefisso comune: "
+          f"{prefix_cache.length} token (calcolato una volta in {setup * 1000:.0f} ms)")
+    print(f"Token di prefill: {total} senza cache, {cached} con cache (-{1 - cached / total:.1%})")
+
+    label_ids = label_token_ids(tokenizer)
+    generation_kwargs = {'max_new_tokens': args.max_new_tokens, 'do_sample': False}
+    modes = {
+        'punteggio logit 0/1': (0, lambda idx, cache: score_batch(model, tokenizer, [encoded[i] for i in idx], label_ids, cache)),
+        f'generazione {args.max_new_tokens} token': (args.max_new_tokens, lambda idx, cache: generate_batch(
+            model, tokenizer, [encoded[i] for i in idx], cache, **generation_kwargs)),
+    }
+    results = []
+    print(f"\n{'Modalità':<24}{'Cache':<8}{'Prompt/s':>10}{'ms/batch':>10}{'Risultati diversi':>19}")
+    for name, (max_new_tokens, step) in modes.items():
+        batches = prompt_batches(lengths, args.batch_size, max_new_tokens=max_new_tokens)
+        reference = None
+        for use_cache in (False, True):
+            outputs, times = timed(batches, lambda idx: step(idx, prefix_cache if use_cache else None))
+            if reference is None:
+                reference, different = outputs, 0
+            elif isinstance(outputs[0], str):
+                different = sum(a != b for a, b in zip(outputs, reference))
+            else:
+                different = int(np.sum(np.abs(np.array(outputs) - np.array(reference)) > 1e-3))
+            result = {'mode': name, 'prefix_cache': use_cache, 'prompts_per_s': len(encoded) / times.sum(),
+                      'mean_batch_ms': times.mean() * 1000, 'prefill_tokens': cached if use_cache else total,
+                      'different_results': different}
+            results.append(result)
+            print(f"{name:<24}{'sì' if use_cache else 'no':<8}{result['prompts_per_s']:>10.1f}"
+                  f"{result['mean_batch_ms']:>10.1f}{different:>19}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': args.rows, 'size': args.size, 'threads': torch.get_num_threads(),
+                       'mean_tokens': float(lengths.mean()), 'prefix_tokens': prefix_cache.length,
+                       'prefill_tokens': total, 'prefill_tokens_cached': cached, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
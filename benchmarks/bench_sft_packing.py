@@ -0,0 +1,138 @@
+"""
+Fine-tuning su CPU dell'isola LLM con e senza packing delle sequenze (sft_packing.py).
+
+Confronta un'epoca di training (forward + backward + passo dell'ottimizzatore) sui prompt di
+fine_tuning.ipynb con etichetta:
+- configurazione attuale: batch da 4 esempi con padding fino al più lungo del batch
+  (DataCollatorForLanguageModeling, il collator di SFTTrainer);
+- packing: blocchi di 4 x max_seq_length token (max_seq_length ricavato dalle lunghezze reali),
+  un blocco per batch, maschera di attenzione confinata a ogni esempio.
+Prima del confronto verifica che logit e loss di ogni esempio impacchettato coincidano con quelli
+dell'esempio da solo. Usa il modello causale con pesi casuali di tiny_models.py.
+
+Uso:
+    python benchmarks/bench_sft_packing.py --rows 256 --json sft_packing.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'isola_esperimento_llm'))
+
+from synthetic_bugs import format_prompt, generate_examples  # noqa: E402  (aggiunge dataset_completo al path)
+from tiny_models import causal_lm  # noqa: E402
+from sft_packing import PackedCollator, auto_max_seq_length, pack_dataset, packing_summary  # noqa: E402
+from datasets import Dataset  # noqa: E402
+from transformers import DataCollatorForLanguageModeling  # noqa: E402
+
+
+def token_losses(logits, labels):
+    """Loss (somma) e numero di token target, con lo stesso shift dei modelli causali."""
+    logits, labels = logits[:, :-1].reshape(-1, logits.shape[-1]), labels[:, 1:].reshape(-1)
+    return F.cross_entropy(logits, labels, ignore_index=-100, reduction='sum'), int((labels != -100).sum())
+
+
+def check_packing(model, collator, packed, sequences, ignore_token_id):
+    """Differenza massima dei logit e della loss tra il primo blocco e i suoi esempi presi da soli."""
+    batch = collator([packed[0]])
+    with torch.no_grad():
+        logits = model(**{k: v for k, v in batch.items() if k != 'labels'}).logits[0]
+        packed_loss, packed_targets = token_losses(logits[None], batch['labels'])
+        block = batch['input_ids'][0].tolist()
+        difference, loss, targets, start = 0.0, 0.0, 0, 0
+        for ids in sequences:
+            if block[start:start + len(ids)] != list(ids):
+                continue
+            alone = model(input_ids=torch.tensor([ids])).logits[0]
+            difference = max(difference, float((alone - logits[start:start + len(ids)]).abs().max()))
+            labels = torch.tensor([ids]).masked_fill(torch.tensor([ids]) == ignore_token_id, -100)
+            example_loss, example_targets = token_losses(alone[None], labels)
+            loss, targets = loss + float(example_loss), targets + example_targets
+            start += len(ids)
+            if start >= batch['position_ids'].shape[1]:
+                break
+    return difference, abs(float(packed_loss) - loss), packed_targets == targets
+
+
+def train_epoch(model, batches):
+    """Un'epoca sui batch indicati (il primo batch, non misurato, inizializza l'ottimizzatore)."""
+    model.train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=5e-5)
+    start = None
+    for batch in [batches[0]] + batches:
+        loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        if start is None:
+            start = time.perf_counter()
+    model.eval()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=256, help="Esempi di training")
+    parser.add_argument('--batch-size', type=int, default=4, help="per_device_train_batch_size attuale")
+    parser.add_argument('--size', choices=['tiny', 'small'], default='small', help="Dimensioni del modello")
+    parser.add_argument('--threads', type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument('--json', help="File in cui salvare i risultati")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model, tokenizer = causal_lm(args.size)
+    df = generate_examples(args.rows, comment_words=0)
+    texts = [format_prompt(row, label=row['label']) + tokenizer.eos_token for row in df.to_dict('records')]
+    dataset = Dataset.from_dict({'input_ids': tokenizer(texts)['input_ids']})
+    lengths = np.array([len(ids) for ids in dataset['input_ids']])
+    real_tokens = int(lengths.sum())
+
+    max_seq_length = auto_max_seq_length(lengths)
+    pack_length = args.batch_size * max_seq_length
+    packed = pack_dataset(dataset, pack_length, ignore_token_id=tokenizer.pad_token_id)
+    summary = packing_summary(dataset, packed, pack_length)
+    print(f"Esempi: {len(dataset)}, token: media {lengths.mean():.1f}, max {lengths.max()} -> max_seq_length "
+          f"{max_seq_length}; blocchi da {pack_length} token: {summary['blocks']} "
+          f"({summary['examples_per_block']:.1f} esempi per blocco, riempimento {summary['fill']:.1%})")
+
+    packed_collator = PackedCollator(tokenizer.pad_token_id)
+    logit_difference, loss_difference, same_targets = check_packing(
+        model, packed_collator, packed, dataset['input_ids'], tokenizer.pad_token_id)
+    print(f"Blocco impacchettato contro esempi da soli: logit diff. max {logit_difference:.1e}, "
+          f"loss diff. {loss_difference:.1e}, stessi token target: {same_targets}")
+
+    lm_collator = DataCollatorForLanguageModeling(tokenizer, mlm=False)
+    order = np.random.default_rng(42).permutation(len(dataset))
+    unpacked = [lm_collator([{'input_ids': dataset[int(i)]['input_ids']} for i in order[j:j + args.batch_size]])
+                for j in range(0, len(order), args.batch_size)]
+    blocks = [packed_collator([packed[i]]) for i in range(len(packed))]
+
+    results = []
+    print(f"\n{'Configurazione':<40}{'Step':>6}{'Token (padding)':>17}{'Token utili/s':>15}{'s/epoca':>10}")
+    for name, batches in [(f'batch {args.batch_size}, padding al più lungo', unpacked),
+                          (f'packing, blocchi da {pack_length}', blocks)]:
+        model, _ = causal_lm(args.size)
+        seconds = train_epoch(model, batches)
+        padded = sum(b['input_ids'].numel() for b in batches)
+        result = {'config': name, 'steps': len(batches), 'padded_tokens': padded, 'seconds_per_epoch': seconds,
+                  'tokens_per_s': real_tokens / seconds}
+        results.append(result)
+        print(f"{name:<40}{len(batches):>6}{padded:>17}{result['tokens_per_s']:>15.1f}{seconds:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': args.rows, 'size': args.size, 'threads': torch.get_num_threads(),
+                       'mean_tokens': float(lengths.mean()), 'max_seq_length': max_seq_length, 'packing': summary,
+                       'logit_difference': logit_difference, 'loss_difference': loss_difference,
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Generatore di bug report sintetici con lo stesso schema dei dump `Dataset/<Fonte>_original.json`.
+Serve ai benchmark per misurare come scalano le fasi della pipeline senza i dati reali.
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from dataset_io import ChunkedTableWriter, table_path  # noqa: E402
+from extractData import extract_attributes, files as SOURCES, records_to_frame  # noqa: E402
+
+VOCABULARY = np.array((
+    "crash freeze hang error exception null pointer segfault leak memory slow performance ui button "
+    "menu dialog window toolbar font render print save load file import export open close editor "
+    "plugin build compile link test regression update install package dependency kernel driver "
+    "network proxy login password session cache index search query database table chart style "
+    "layout scroll resize drag drop click keyboard shortcut locale translation unicode encoding"
+).split())
+PRODUCTS = np.array(['core', 'ui', 'platform', 'kernel', 'writer', 'calc', 'web', 'tools', ''])
+PRIORITIES = np.array(['P1', 'P2', 'P3', 'P4', 'P5', ''])
+SEVERITIES = np.array(['blocker', 'critical', 'major', 'normal', 'minor', 'trivial', 'enhancement'])
+
+
+def _sentence(rng, words):
+    # Stessa sequenza di `rng.choice(VOCABULARY, size=...)`, senza il suo costo fisso per chiamata
+    return ' '.join(VOCABULARY[rng.integers(0, len(VOCABULARY), size=max(1, words))])
+
+
+def generate_bugs(n, rng=None, comments=3, comment_words=40, duplicate_rate=0.01, missing_rate=0.02):
+    """
+    Genera `n` bug report nel formato `{"bug": {...}}` dei dump originali.
+
+    :param n: Numero di bug da generare.
+    :param rng: Generatore numpy (default: seme fisso, risultati riproducibili).
+    :param comments: Numero medio di commenti (`long_desc`) per bug.
+    :param comment_words: Numero medio di parole per commento.
+    :param duplicate_rate: Frazione di bug che ripetono esattamente il precedente.
+    :param missing_rate: Frazione di bug senza `days_resolution`.
+    """
+    rng = rng if rng is not None else np.random.default_rng(42)
+    previous = None
+    for _ in range(n):
+        if previous is not None and rng.random() < duplicate_rate:
+            yield previous
+            continue
+        days = '' if rng.random() < missing_rate else int(rng.lognormal(3.0, 1.5))
+        bug = {
+            'short_desc': _sentence(rng, rng.integers(3, 12)) + ('  ' if rng.random() < 0.1 else ''),
+            'product': str(rng.choice(PRODUCTS)),
+            'priority': str(rng.choice(PRIORITIES)),
+            'bug_severity': str(rng.choice(SEVERITIES)),
+            'days_resolution': days,
+            'long_desc': [
+                {'thetext': _sentence(rng, rng.poisson(comment_words))}
+                for _ in range(rng.poisson(comments))
+            ],
+        }
+        previous = {'bug': bug}
+        yield previous
+
+
+def write_data_tables(output_dir, rows, sources=SOURCES, fmt='parquet', chunk_size=50000, seed=42, **kwargs):
+    """
+    Scrive le tabelle `<Fonte>_data` (output di extractData.py) con `rows` righe in totale.
+
+    :return: Dizionario fonte -> percorso della tabella.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    per_source = max(1, rows // len(sources))
+    paths = {}
+    for source in sources:
+        path = table_path(output_dir, source + '_data', fmt)
+        with ChunkedTableWriter(path) as writer:
+            chunk = []
+            for entry in generate_bugs(per_source, rng, **kwargs):
+                chunk.append(extract_attributes(entry))
+                if len(chunk) >= chunk_size:
+                    writer.write(records_to_frame(chunk))
+                    chunk = []
+            if chunk:
+                writer.write(records_to_frame(chunk))
+        paths[source] = path
+    return paths
+
+
+def _write_json_dump(path, n, seed, layout, kwargs):
+    import json
+
+    rng = np.random.default_rng(seed)
+    separator = '\n' if layout == 'lines' else ',\n'
+    with open(path, 'w') as f:
+        if layout == 'array':
+            f.write('[\n')
+        for i, entry in enumerate(generate_bugs(n, rng, **kwargs)):
+            f.write((separator if i else '') + json.dumps(entry))
+        f.write('\n]\n' if layout == 'array' else '\n')
+    return path
+
+
+def write_json_dumps(output_dir, rows, sources=SOURCES, layout='lines', seed=42, workers=None, **kwargs):
+    """
+    Scrive i dump `<Fonte>_original.json` (input di extractData.py) con `rows` bug in totale.
+    Ogni fonte ha un proprio seme, quindi il contenuto non dipende dal numero di processi.
+
+    :param layout: `lines` (un oggetto JSON per riga) o `array` (un unico array JSON).
+    :param workers: Processi usati, una fonte per processo (default: numero di CPU).
+    :param kwargs: Parametri di `generate_bugs` (es. `comments`, `comment_words`).
+    :return: Dizionario fonte -> percorso del file.
+    """
+    from multiprocessing import Pool
+
+    os.makedirs(output_dir, exist_ok=True)
+    per_source = max(1, rows // len(sources))
+    tasks = [(os.path.join(output_dir, source + '_original.json'), per_source, [seed, i], layout, kwargs)
+             for i, source in enumerate(sources)]
+    workers = workers or min(len(tasks), os.cpu_count() or 1)
+    if workers == 1:
+        paths = [_write_json_dump(*task) for task in tasks]
+    else:
+        with Pool(workers) as pool:
+            paths = pool.starmap(_write_json_dump, tasks)
+    return dict(zip(sources, paths))
+
+
+def generate_examples(n, seed=42, **kwargs):
+    """
+    Righe già processate (schema di `merged_processed_labeled`, senza `days_resolution`) per i
+    benchmark di tokenizzazione, training e inferenza.
+
+    :return: DataFrame con source, product, short_desc, priority, bug_severity, comments e label.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    sources = rng.choice(np.array(SOURCES), size=n)
+    rows = []
+    for source, entry in zip(sources, generate_bugs(n, rng, **kwargs)):
+        row = extract_attributes(entry)
+        row['source'] = str(source)
+        rows.append(row)
+    df = pd.DataFrame(rows).replace('', 'Unknown')
+    df['label'] = rng.integers(0, 2, size=n)
+    return df[['source', 'product', 'short_desc', 'priority', 'bug_severity', 'comments', 'label']]
+
+
+def concatenate_fields(example):
+    """Stesso testo del campo `text` dei notebook DistilBERT (source, product, short_desc, priority, severity)."""
+    fields = [example['source'], example['product'], example['short_desc'], example['priority'], example['bug_severity']]
+    return ' '.join(str(field) for field in fields if field)
+
+
+# Prompt di eval_model.ipynb / fine_tuning.ipynb (variante Llama), per i benchmark dell'isola LLM
+LLM_PROMPT_TEMPLATE = (
+    "### Instruction:\n"
+    "You are an expert software developer and bug triaging specialist. Your task is to predict whether a bug "
+    "will be resolved in LESS than 50 DAYS or MORE than 50 DAYS based on the provided bug details.\n\n"
+    "- Output '0' if the bug will be resolved in LESS than 50 DAYS.\n"
+    "- Output '1' if the bug will be resolved in MORE than 50 DAYS.\n\n"
+    "Your response MUST be strictly either '0' or '1'. Do NOT include any additional text, explanations, "
+    "formatting, symbols, or extra characters in your response.\n\n"
+    "### Input:\n"
+    "Source: {source}\n"
+    "Product: {product}"
+    "Short Description: {short_desc}\n"
+    "Priority: {priority}\n"
+    "Severity: {bug_severity}\n"
+    "### Example Responses:\n"
+    "Input: Source: KDE | Product: Payment System | Short Description: Critical security vulnerability found in "
+    "authentication system | Priority: P1 | Severity: Critical\n"
+    "Output: 0\n\n"
+    "Input: Source: OpenOffice | Product: UI Module | Short Description: UI glitch affecting low-impact visual "
+    "elements in settings panel | Priority: P3 | Severity: Minor\n"
+    "Output: 1\n\n"
+    "### Output: {label}\n"
+)
+
+
+def format_prompt(example, label=""):
+    """Prompt di valutazione (senza etichetta) come `formatting_prompts` di eval_model.ipynb."""
+    return LLM_PROMPT_TEMPLATE.format(source=example['source'], product=example['product'],
+                                      short_desc=example['short_desc'], priority=example['priority'],
+                                      bug_severity=example['bug_severity'], label=label)
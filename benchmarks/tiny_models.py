@@ -0,0 +1,84 @@
+"""
+Tokenizer e modelli locali, inizializzati a caso, per misurare su CPU il costo di tokenizzazione,
+training e inferenza senza scaricare pesi da Hugging Face.
+
+- `build_tokenizer`: tokenizer WordPiece (stile BERT) sul vocabolario dei bug sintetici.
+- `distilbert_classifier`: DistilBERT per la classificazione, nelle dimensioni di
+  `distilbert-base-uncased` (`size='base'`) o ridotto (`size='tiny'`).
+- `causal_lm`: modello causale stile Llama con il suo tokenizer, per l'isola LLM.
+"""
+import os
+import string
+
+from synthetic_bugs import PRIORITIES, PRODUCTS, SEVERITIES, SOURCES, VOCABULARY
+
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+
+
+def _vocabulary():
+    words = sorted({*VOCABULARY, *PRODUCTS, *PRIORITIES, *SEVERITIES, *SOURCES} - {''})
+    chars = list(string.ascii_lowercase + string.digits + string.punctuation)
+    return words + chars + ['##' + c for c in string.ascii_lowercase + string.digits]
+
+
+def build_tokenizer(workdir):
+    """Tokenizer WordPiece minuscolo (come `distilbert-base-uncased`) salvato in `workdir`."""
+    from transformers import DistilBertTokenizerFast
+
+    os.makedirs(workdir, exist_ok=True)
+    vocab_file = os.path.join(workdir, 'vocab.txt')
+    with open(vocab_file, 'w') as f:
+        f.write('\n'.join(SPECIAL_TOKENS + [w.lower() for w in _vocabulary()]) + '\n')
+    return DistilBertTokenizerFast(vocab_file, do_lower_case=True)
+
+
+def distilbert_classifier(tokenizer, size='base', seed=0):
+    """DistilBERT a 2 classi con pesi casuali (il costo di calcolo non dipende dai pesi)."""
+    import torch
+    from transformers import DistilBertConfig, DistilBertForSequenceClassification
+
+    dims = {'base': dict(dim=768, hidden_dim=3072, n_layers=6, n_heads=12),
+            'tiny': dict(dim=64, hidden_dim=128, n_layers=2, n_heads=2)}[size]
+    torch.manual_seed(seed)
+    config = DistilBertConfig(vocab_size=len(tokenizer), max_position_embeddings=512, num_labels=2,
+                              id2label={0: "fast", 1: "slow"}, label2id={"fast": 0, "slow": 1},
+                              pad_token_id=tokenizer.pad_token_id, **dims)
+    return DistilBertForSequenceClassification(config).eval()
+
+
+CAUSAL_SPECIAL_TOKENS = ['<pad>', '<unk>', '<s>', '</s>']
+
+
+def causal_tokenizer():
+    """Tokenizer a parole (minuscolo) con `<s>` all'inizio di ogni testo, come i tokenizer Llama."""
+    from tokenizers import Tokenizer, normalizers, pre_tokenizers, processors
+    from tokenizers.models import WordLevel
+    from transformers import PreTrainedTokenizerFast
+
+    words = list(dict.fromkeys(CAUSAL_SPECIAL_TOKENS + [w.lower() for w in _vocabulary()]))
+    backend = Tokenizer(WordLevel({w: i for i, w in enumerate(words)}, unk_token='<unk>'))
+    backend.normalizer = normalizers.Lowercase()
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    backend.post_processor = processors.TemplateProcessing(single='<s> $A', special_tokens=[('<s>', words.index('<s>'))])
+    return PreTrainedTokenizerFast(tokenizer_object=backend, bos_token='<s>', eos_token='</s>',
+                                   unk_token='<unk>', pad_token='<pad>')
+
+
+def causal_lm(size='tiny', seed=0):
+    """
+    Modello causale stile Llama con pesi casuali e il suo tokenizer.
+
+    :param size: `'tiny'` (verifiche veloci) o `'small'` (tempi più vicini a un modello reale).
+    :return: Modello e tokenizer.
+    """
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    tokenizer = causal_tokenizer()
+    dims = {'tiny': dict(hidden_size=64, intermediate_size=128, num_hidden_layers=2, num_attention_heads=2),
+            'small': dict(hidden_size=512, intermediate_size=1408, num_hidden_layers=6, num_attention_heads=8)}[size]
+    torch.manual_seed(seed)
+    config = LlamaConfig(vocab_size=len(tokenizer), max_position_embeddings=4096,
+                         bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+                         pad_token_id=tokenizer.pad_token_id, **dims)
+    return LlamaForCausalLM(config).eval(), tokenizer
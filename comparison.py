@@ -1,145 +1,141 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+"""
+Confronto dei risultati di tutti i modelli al variare della dimensione del training set.
+
+Cerca nelle cartelle delle isole (isola_classificazione_distilbert, isola_esperimento_llm) tutte le
+cartelle di risultati `<modello>_fine_tuned_on_<n>` e `<modello>_not_fine_tuned` (dimensione 0),
+anche annidate (es. `meta-llama/Llama-3.2-1B-Instruct_fine_tuned_on_2000`), e unisce in una sola
+passata metrics.csv, avg_system_metrics.csv e training_comparison.csv in una tabella con una riga
+per (isola, modello, dimensione): `comparisons/all_models_summary.csv`.
+
+Per ogni modello vengono salvati in `comparisons/<modello>/` il riepilogo, i grafici di trend
+(performance, risorse), la heatmap e le regressioni delle metriche di performance; i grafici tra
+modelli vanno in `comparisons/`. I grafici sono generati in parallelo in un pool di processi e
+quelli i cui dati di input non sono cambiati dall'esecuzione precedente (impronta salvata in
+`comparisons/.comparison_state.json`) vengono saltati.
+
+Uso:
+    python comparison.py                          # tutti i modelli
+    python comparison.py --models distilbert      # solo i modelli che contengono "distilbert"
+    python comparison.py --force --workers 4      # rigenera tutti i grafici
+"""
+import argparse
+import hashlib
+import json
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import scipy.stats as stats
 
-def analyze_regression(df, metrics, output_dir):
-    """
-    Applica la regressione lineare alle metriche rispetto alla dimensione del dataset.
+import matplotlib
+matplotlib.use("Agg")  # esecuzione non interattiva (anche nei processi del pool)
+import matplotlib.pyplot as plt  # noqa: E402
+import pandas as pd  # noqa: E402
+import scipy.stats as stats  # noqa: E402
+import seaborn as sns  # noqa: E402
+
+ISLANDS = ("isola_classificazione_distilbert", "isola_esperimento_llm")
+RESULT_FILES = ("metrics.csv", "avg_system_metrics.csv", "training_comparison.csv")
+PERFORMANCE_METRICS = ['accuracy', 'precision', 'recall', 'f1']
+RESOURCE_METRICS = ['cpu', 'ram', 'gpu', 'time']
+STATE_FILE = ".comparison_state.json"
+
+_RESULT_DIR = re.compile(r"^(?P<model>.+?)_(?:fine_tuned_on_(?P<size>\d+)|not_fine_tuned)$")
 
-    :param df: DataFrame contenente i dati aggregati.
-    :param metrics: Lista delle metriche da analizzare.
-    :param output_dir: Cartella di output per salvare i grafici.
+
+def discover_results(roots=ISLANDS):
     """
-    output_dir = Path(output_dir)
-    output_dir.mkdir(parents=True, exist_ok=True)
+    Trova le cartelle dei risultati di valutazione.
 
-    for metric in metrics:
-        if metric in df.columns:
-            x = df['Dataset Size']
-            y = df[metric]
-
-            # Calcolo della regressione lineare
-            slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
-
-            print(f"\n🔹 Regressione per {metric}:")
-            print(f"   Pendenza (slope): {slope:.4f}")
-            print(f"   Intercetta: {intercept:.4f}")
-            print(f"   R-quadro (correlazione): {r_value**2:.4f}")
-            print(f"   p-value: {p_value:.4f} (Significativo se < 0.05)")
-
-            # Grafico della regressione
-            plt.figure(figsize=(8, 5))
-            plt.scatter(x, y, label="Dati osservati", color="blue")
-            plt.plot(x, intercept + slope*x, color="red", linestyle="--", label="Regressione Lineare")
-            plt.xlabel("Dataset Size")
-            plt.ylabel(metric)
-            plt.title(f"Regressione Lineare: {metric} vs Dataset Size")
-            plt.legend()
-            plt.grid(True, linestyle="--", alpha=0.6)
-            plt.savefig(output_dir / f"regression_{metric}.png", dpi=300)
-            plt.close()
-def plot_metrics_trend(results_files, system_files, training_results_files, output_dir="metrics_trend_results"):
+    :param roots: Cartelle in cui cercare (di solito le isole).
+    :return: Lista di dizionari con isola, modello (percorso relativo all'isola, es.
+        `meta-llama/Llama-3.2-1B-Instruct`), dimensione del training set (0 = non fine-tunato) e cartella.
     """
-    Analizza e visualizza le metriche di performance, risorse e training per diversi dataset sizes.
-    
-    :param results_files: Dizionario con i percorsi dei file delle metriche di performance.
-    :param system_files: Dizionario con i percorsi dei file delle metriche di sistema.
-    :param training_results_files: Dizionario con i percorsi dei file delle metriche di training.
-    :param output_dir: Cartella di output per salvare i risultati.
-    :return: DataFrame con i risultati aggregati.
+    entries = []
+    for root in roots:
+        for dirpath, dirnames, _ in os.walk(root):
+            for name in sorted(dirnames):
+                match = _RESULT_DIR.match(name)
+                if not match or not os.path.exists(os.path.join(dirpath, name, "metrics.csv")):
+                    continue
+                prefix = os.path.relpath(dirpath, root)
+                model = match["model"] if prefix == "." else f"{prefix}/{match['model']}".replace(os.sep, "/")
+                entries.append({"island": os.path.basename(os.path.normpath(root)), "model": model,
+                                "Dataset Size": int(match["size"] or 0), "path": os.path.join(dirpath, name)})
+            # Non si scende nelle cartelle dei risultati né nei checkpoint/modelli salvati
+            dirnames[:] = [d for d in dirnames if not _RESULT_DIR.match(d) and not d.startswith((".", "__"))
+                           and not d.startswith("checkpoint-") and not d.startswith("fine_tuned_model_")]
+    return sorted(entries, key=lambda e: (e["island"], e["model"], e["Dataset Size"]))
+
+
+def load_results(entries):
     """
-    # Crea la cartella di output se non esiste
-    output_dir = Path(output_dir)
-    output_dir.mkdir(parents=True, exist_ok=True)
-
-    # Lista per memorizzare i risultati aggregati
-    trend_data = []
-
-    # Itera su ogni dataset size
-    for size in results_files.keys():
-        metric_file = results_files[size]
-        system_file = system_files.get(size)
-        training_file = training_results_files.get(size)
-
-        # Verifica se tutti i file esistono
-        if not all(os.path.exists(f) for f in [metric_file, system_file, training_file]):
-            print(f"⚠️ File mancanti per Dataset Size {size}:")
-            for file, path in zip(["Metriche", "Sistema", "Training"], [metric_file, system_file, training_file]):
-                if not os.path.exists(path):
-                    print(f"   ❌ {file}: {path} non trovato.")
-            continue
-
-        # Carica i file CSV
-        df_metrics = pd.read_csv(metric_file)
-        df_system = pd.read_csv(system_file)
-        df_training = pd.read_csv(training_file)
-
-        # Debug: stampa le prime righe dei DataFrame
-        print(f"\n📥 Dataset Size {size}:")
-        print(f"Metriche:\n{df_metrics.head()}")
-        print(f"Metriche di sistema:\n{df_system.head()}")
-        print(f"Metriche di training:\n{df_training.head()}")
-
-        # Combina i DataFrame
-        df_combined = pd.concat([df_metrics, df_system, df_training], axis=1)
-        df_combined['Dataset Size'] = size  # Aggiungi la colonna Dataset Size
-        trend_data.append(df_combined)
-
-    # Se non ci sono dati, termina la funzione
-    if not trend_data:
-        print("❌ Nessun file trovato, impossibile generare il trend.")
+    Tabella con una riga per cartella di risultati: isola, modello, dimensione, metriche di
+    performance, metriche di sistema e (se presenti) metriche di training.
+    """
+    rows = []
+    for entry in entries:
+        row = {"island": entry["island"], "model": entry["model"], "Dataset Size": entry["Dataset Size"]}
+        for file in RESULT_FILES:
+            path = os.path.join(entry["path"], file)
+            if os.path.exists(path):
+                values = pd.read_csv(path).iloc[0].to_dict()
+                values.pop("Dataset Size", None)
+                row.update(values)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def fingerprint(df, *extra):
+    """Impronta dei dati (e dei parametri) di un grafico."""
+    digest = hashlib.sha256(df.to_csv(index=False).encode())
+    for value in extra:
+        digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+def regression(df, metric):
+    """Regressione lineare di `metric` rispetto alla dimensione del dataset (None con meno di 2 punti)."""
+    data = df[['Dataset Size', metric]].dropna()
+    if len(data) < 2 or data['Dataset Size'].nunique() < 2:
         return None
-
-    # Crea il DataFrame finale
-    trend_df = pd.concat(trend_data, ignore_index=True)
-
-    # Salva il DataFrame in un file CSV
-    trend_df.to_csv(output_dir / 'metrics_trend_summary.csv', index=False)
-
-    # **Plot delle metriche di performance**
-    performance_metrics = ['accuracy', 'precision', 'recall', 'f1']
-    plot_trend(trend_df, performance_metrics, 'Performance Metric Trend by Dataset Size', 'Score', output_dir / 'performance_metrics_trend.png')
-
-    # **Plot delle risorse hardware**
-    resource_metrics = ['cpu', 'ram', 'gpu', 'time']
-    plot_trend(trend_df, resource_metrics, 'Resource Usage Trend by Dataset Size', 'Usage', output_dir / 'resource_usage_trend.png')
-
-    # **Heatmap combinata**
-    plt.figure(figsize=(12, 6))
-    sns.heatmap(trend_df.set_index('Dataset Size').T, annot=True, cmap='coolwarm', fmt='.4f')
-    plt.title('Overall Metric Heatmap')
-    plt.tight_layout()
-    plt.savefig(output_dir / 'combined_metrics_heatmap.png', dpi=300)
+    result = stats.linregress(data['Dataset Size'], data[metric])
+    return {"metric": metric, "slope": result.slope, "intercept": result.intercept,
+            "r2": result.rvalue ** 2, "p_value": result.pvalue, "points": len(data)}
+
+
+def plot_regression(df, metric, output_path):
+    """Grafico dei valori osservati di `metric` e della retta di regressione."""
+    result = regression(df, metric)
+    x, y = df['Dataset Size'], df[metric]
+    plt.figure(figsize=(8, 5))
+    plt.scatter(x, y, label="Dati osservati", color="blue")
+    if result is not None:
+        plt.plot(x, result['intercept'] + result['slope'] * x, color="red", linestyle="--", label="Regressione Lineare")
+    plt.xlabel("Dataset Size")
+    plt.ylabel(metric)
+    plt.title(f"Regressione Lineare: {metric} vs Dataset Size")
+    plt.legend()
+    plt.grid(True, linestyle="--", alpha=0.6)
+    plt.savefig(output_path, dpi=300)
     plt.close()
 
-    print("\nTrend visualization saved in:", output_dir)
-    print("\nSummary:")
-    print(trend_df)
-
-    #  Analizziamo la regressione sulle metriche di performance
-    performance_metrics = ['accuracy', 'precision', 'recall', 'f1']
-    analyze_regression(trend_df, performance_metrics, output_dir)
 
-    return trend_df
-
-
-def plot_trend(df, metrics, title, ylabel, output_path):
+def plot_trend(df, metrics, title, ylabel, output_path, hue=None):
     """
     Crea un grafico a linee per le metriche specificate.
-    
+
     :param df: DataFrame contenente i dati.
     :param metrics: Lista delle metriche da plottare.
     :param title: Titolo del grafico.
     :param ylabel: Etichetta dell'asse Y.
     :param output_path: Percorso di salvataggio del grafico.
+    :param hue: Colonna che distingue più linee per la stessa metrica (es. `model`).
     """
     plt.figure(figsize=(12, 6))
     for metric in metrics:
         if metric in df.columns:
-            sns.lineplot(data=df, x='Dataset Size', y=metric, marker='o', label=metric.capitalize())
+            label = {'label': metric.capitalize()} if hue is None else {}
+            sns.lineplot(data=df, x='Dataset Size', y=metric, hue=hue, marker='o', **label)
     plt.title(title)
     plt.xlabel('Dataset Size')
     plt.ylabel(ylabel)
@@ -150,67 +146,129 @@ def plot_trend(df, metrics, title, ylabel, output_path):
     plt.close()
 
 
-# Esempio di utilizzo
-dictionary_path = {
-    1: {"path": "isola_esperimento_llm/meta-llama/", "model": "Llama-3.1-8B-Instruct"},
-    2: {"path": "isola_classificazione_distilbert/", "model": "distilbert-base-uncased"},
-    3: {"path": "isola_esperimento_llm/mistralai", "model": "Mistral-7B-Instruct-v0.3"},
-    4: {"path": "isola_esperimento_llm/meta-llama", "model": "meta-llama/Llama-3.2-1B-Instruct"},
-}
-
-# Mostra il menu all'utente
-print("\n📌 Seleziona un modello disponibile:")
-for key, info in dictionary_path.items():
-    print(f"{key}: {info['model']} ({info['path']})")
-
-# Input dell'utente con validazione
-while True:
-    try:
-        selected_key = int(input("\n🔹 Inserisci il numero del modello: "))
-        if selected_key in dictionary_path:
-            break
-        else:
-            print("❌ Scelta non valida! Scegli un numero corretto.")
-    except ValueError:
-        print("⚠️ Inserisci un numero valido.")
-
-# Recupera percorso e modello selezionato
-selected_info = dictionary_path[selected_key]
-partial_path = selected_info["path"]
-model = selected_info["model"]
-
-# Output della selezione
-print(f"\n✅ Hai selezionato: {model}")
-print(f"📂 Percorso parziale di selezione dei risultati: {partial_path}")
-
-results_files = {
-    0: os.path.join(partial_path, f"{model}_not_fine_tuned", "metrics.csv"),
-    1000: os.path.join(partial_path, f"{model}_fine_tuned_on_1000", "metrics.csv"),
-    2000: os.path.join(partial_path, f"{model}_fine_tuned_on_2000", "metrics.csv"),
-    5000: os.path.join(partial_path, f"{model}_fine_tuned_on_5000", "metrics.csv"),
-    9000: os.path.join(partial_path, f"{model}_fine_tuned_on_9000", "metrics.csv"),
-}
-
-system_files = {
-    0: os.path.join(partial_path, f"{model}_not_fine_tuned", "avg_system_metrics.csv"),
-    1000: os.path.join(partial_path, f"{model}_fine_tuned_on_1000", "avg_system_metrics.csv"),
-    2000: os.path.join(partial_path, f"{model}_fine_tuned_on_2000", "avg_system_metrics.csv"),
-    5000: os.path.join(partial_path, f"{model}_fine_tuned_on_5000", "avg_system_metrics.csv"),
-    9000: os.path.join(partial_path, f"{model}_fine_tuned_on_9000", "avg_system_metrics.csv"),
-}
-
-training_results_file = {
-    0: os.path.join(partial_path, f"{model}_not_fine_tuned", "training_comparison.csv"),
-    1000: os.path.join(partial_path, f"{model}_fine_tuned_on_1000", "training_comparison.csv"),
-    2000: os.path.join(partial_path, f"{model}_fine_tuned_on_2000", "training_comparison.csv"),
-    5000: os.path.join(partial_path, f"{model}_fine_tuned_on_5000", "training_comparison.csv"),
-    9000: os.path.join(partial_path, f"{model}_fine_tuned_on_9000", "training_comparison.csv"),
-}
-
-# Creazione cartella e salvataggio risultati
-output_path = os.path.join("comparisons", model)
-trend_summary = plot_metrics_trend(results_files, system_files, training_results_file, output_dir=output_path)
-
+def plot_heatmap(df, output_path):
+    """Heatmap di tutte le metriche numeriche per dimensione del dataset."""
+    numeric = df.set_index('Dataset Size').select_dtypes('number').dropna(axis=1, how='all')
+    plt.figure(figsize=(12, max(6, 0.3 * numeric.shape[1])))
+    sns.heatmap(numeric.T, annot=True, cmap='coolwarm', fmt='.4f')
+    plt.title('Overall Metric Heatmap')
+    plt.tight_layout()
+    plt.savefig(output_path, dpi=300)
+    plt.close()
 
 
+# Funzioni di disegno eseguibili nel pool (per nome, così i lavori sono serializzabili)
+PLOTS = {"trend": plot_trend, "heatmap": plot_heatmap, "regression": plot_regression}
+
+
+def render(job):
+    """Disegna un grafico (eseguita in un processo del pool)."""
+    kind, df, kwargs, output_path = job
+    PLOTS[kind](df, output_path=output_path, **kwargs)
+    return str(output_path)
+
+
+def plot_jobs(summary, output_dir):
+    """Grafici da generare: per modello (trend, heatmap, regressioni) e tra modelli."""
+    jobs = []
+    for model, df in summary.groupby('model', sort=True):
+        df = df.sort_values('Dataset Size').drop(columns=['island', 'model']).dropna(axis=1, how='all')
+        model_dir = output_dir / model
+        performance = ['Dataset Size'] + [m for m in PERFORMANCE_METRICS if m in df.columns]
+        resources = ['Dataset Size'] + [m for m in RESOURCE_METRICS if m in df.columns]
+        jobs.append(("trend", df[performance], dict(metrics=PERFORMANCE_METRICS, ylabel='Score',
+                                                    title='Performance Metric Trend by Dataset Size'),
+                     model_dir / 'performance_metrics_trend.png'))
+        jobs.append(("trend", df[resources], dict(metrics=RESOURCE_METRICS, ylabel='Usage',
+                                                  title='Resource Usage Trend by Dataset Size'),
+                     model_dir / 'resource_usage_trend.png'))
+        jobs.append(("heatmap", df, {}, model_dir / 'combined_metrics_heatmap.png'))
+        for metric in PERFORMANCE_METRICS:
+            if metric in df.columns and regression(df, metric) is not None:
+                jobs.append(("regression", df[['Dataset Size', metric]], dict(metric=metric),
+                             model_dir / f"regression_{metric}.png"))
+    if summary['model'].nunique() > 1:
+        for metric in PERFORMANCE_METRICS + ['time']:
+            if metric in summary.columns:
+                data = summary[['model', 'Dataset Size', metric]].sort_values(['model', 'Dataset Size'])
+                jobs.append(("trend", data, dict(metrics=[metric], title=f'{metric} by Dataset Size (all models)',
+                                                 ylabel=metric, hue='model'), output_dir / f'all_models_{metric}.png'))
+    return jobs
+
+
+def build_comparison(roots=ISLANDS, output_dir="comparisons", models=None, workers=None, force=False, plots=True):
+    """
+    Raccoglie i risultati di tutti i modelli e genera riepiloghi e grafici.
+
+    :param roots: Cartelle in cui cercare i risultati.
+    :param output_dir: Cartella dei confronti.
+    :param models: Sottostringhe dei nomi dei modelli da includere (default: tutti).
+    :param workers: Processi per i grafici (default: numero di CPU).
+    :param force: Se True rigenera anche i grafici con dati invariati.
+    :param plots: Se False salva solo le tabelle.
+    :return: DataFrame con una riga per (isola, modello, dimensione).
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    entries = discover_results(roots)
+    if models:
+        entries = [e for e in entries if any(m in e["model"] for m in models)]
+    if not entries:
+        print("❌ Nessuna cartella di risultati trovata.")
+        return None
 
+    summary = load_results(entries)
+    summary.to_csv(output_dir / 'all_models_summary.csv', index=False)
+    regressions = []
+    for model, df in summary.groupby('model', sort=True):
+        model_dir = output_dir / model
+        model_dir.mkdir(parents=True, exist_ok=True)
+        df.sort_values('Dataset Size').to_csv(model_dir / 'metrics_trend_summary.csv', index=False)
+        for metric in PERFORMANCE_METRICS:
+            result = regression(df, metric) if metric in df.columns else None
+            if result is not None:
+                regressions.append({"model": model, **result})
+    regressions = pd.DataFrame(regressions)
+    regressions.to_csv(output_dir / 'regression_summary.csv', index=False)
+    print(f"📊 {len(summary)} risultati di {summary['model'].nunique()} modelli -> {output_dir / 'all_models_summary.csv'}")
+
+    if plots:
+        state_path = output_dir / STATE_FILE
+        state = json.loads(state_path.read_text()) if state_path.exists() and not force else {}
+        jobs, skipped = [], 0
+        for job in plot_jobs(summary, output_dir):
+            key = str(job[3])
+            digest = fingerprint(job[1], job[0], sorted(job[2].items()))
+            if state.get(key) == digest and job[3].exists():
+                skipped += 1
+                continue
+            job[3].parent.mkdir(parents=True, exist_ok=True)
+            jobs.append((job, key, digest))
+        if jobs:
+            with ProcessPoolExecutor(max_workers=workers or min(len(jobs), os.cpu_count() or 1)) as pool:
+                for (_, key, digest), _ in zip(jobs, pool.map(render, [job for job, _, _ in jobs])):
+                    state[key] = digest
+        state_path.write_text(json.dumps(state, indent=1, sort_keys=True))
+        print(f"🖼️ Grafici: {len(jobs)} generati, {skipped} invariati (saltati)")
+
+    if len(regressions):
+        print("\nRegressione delle metriche di performance sulla dimensione del dataset:")
+        print(regressions.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--roots', nargs='+', default=list(ISLANDS), help="Cartelle in cui cercare i risultati")
+    parser.add_argument('--output-dir', default="comparisons", help="Cartella dei confronti")
+    parser.add_argument('--models', nargs='+', help="Solo i modelli il cui nome contiene una di queste stringhe")
+    parser.add_argument('--workers', type=int, default=None, help="Processi per i grafici")
+    parser.add_argument('--force', action='store_true', help="Rigenera anche i grafici con dati invariati")
+    parser.add_argument('--no-plots', action='store_true', help="Salva solo le tabelle")
+    args = parser.parse_args()
+
+    build_comparison(args.roots, args.output_dir, args.models, args.workers, args.force, not args.no_plots)
+
+
+if __name__ == "__main__":
+    main()
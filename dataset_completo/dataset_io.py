@@ -0,0 +1,322 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Formato intermedio colonnare e tipizzato usato tra le fasi della pipeline.
+# Il CSV resta disponibile come formato di esportazione.
+FORMATS = {'parquet': '.parquet', 'csv': '.csv'}
+DEFAULT_FORMAT = 'parquet'
+
+# Colonne a bassa cardinalità salvate come categoriche (dizionario Arrow in Parquet)
+CATEGORICAL_COLUMNS = ['source', 'product', 'priority', 'bug_severity']
+
+# Manifest degli split bilanciati: id di riga sul dataset unificato invece di copie dei dati
+MANIFEST_FILE = 'balanced_manifest.npz'
+
+
+def table_path(directory, name, fmt=DEFAULT_FORMAT):
+    """
+    Costruisce il percorso di una tabella a partire dal nome senza estensione.
+
+    Args:
+        directory (str): Cartella della tabella.
+        name (str): Nome del file senza estensione (es. `merged_processed_labeled`).
+        fmt (str): Formato (`parquet` o `csv`).
+
+    Returns:
+        str: Percorso completo del file.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato non supportato: {fmt}. Valori ammessi: {list(FORMATS)}")
+    return os.path.join(directory, name + FORMATS[fmt])
+
+
+def table_format(path):
+    """Ricava il formato di un file dalla sua estensione."""
+    for fmt, ext in FORMATS.items():
+        if path.endswith(ext):
+            return fmt
+    raise ValueError(f"Estensione non riconosciuta per il file {path}")
+
+
+def resolve_table(directory, name):
+    """
+    Restituisce il percorso di una tabella esistente, preferendo il formato colonnare al CSV.
+
+    Raises:
+        FileNotFoundError: Se la tabella non esiste in nessun formato.
+    """
+    for fmt in FORMATS:
+        path = table_path(directory, name, fmt)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"Nessuna tabella '{name}' trovata in '{directory}'.")
+
+
+def list_tables(directory, suffix):
+    """
+    Elenca le tabelle di una cartella il cui nome termina con `suffix`, una per nome.
+    Se la stessa tabella esiste in più formati viene scelto quello colonnare.
+
+    Returns:
+        dict: Nome (senza estensione) -> percorso.
+    """
+    tables = {}
+    for fmt, ext in reversed(list(FORMATS.items())):
+        for file in sorted(os.listdir(directory)):
+            if file.endswith(suffix + ext):
+                tables[file[:-len(ext)]] = os.path.join(directory, file)
+    return dict(sorted(tables.items()))
+
+
+def to_arrow(df):
+    """
+    Converte un DataFrame in tabella Arrow con tipi stabili:
+    le colonne categoriche diventano dizionari di stringhe, le altre colonne testuali stringhe.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    df = df.copy()
+    for col in df.columns:
+        if col in CATEGORICAL_COLUMNS or df[col].dtype == object:
+            df[col] = df[col].astype('string')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for col in CATEGORICAL_COLUMNS:
+        if col in table.column_names:
+            index = table.schema.get_field_index(col)
+            table = table.set_column(index, col, pc.dictionary_encode(table.column(index)))
+    return table
+
+
+def write_table(df, path):
+    """Salva un DataFrame nel formato indicato dall'estensione di `path`."""
+    if table_format(path) == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(to_arrow(df), path)
+    else:
+        df.to_csv(path, index=False)
+
+
+def read_table(path, columns=None):
+    """
+    Legge una tabella (Parquet o CSV) caricando solo le colonne richieste.
+
+    Args:
+        path (str): Percorso del file.
+        columns (list): Colonne da leggere (default: tutte).
+
+    Returns:
+        pd.DataFrame: Tabella con le colonne categoriche di tipo `category`.
+    """
+    if table_format(path) == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    header = pd.read_csv(path, nrows=0).columns
+    dtype = {col: 'category' for col in CATEGORICAL_COLUMNS if col in header}
+    return pd.read_csv(path, usecols=columns, dtype=dtype)
+
+
+def iter_table_chunks(path, chunk_size, columns=None):
+    """
+    Legge una tabella a blocchi di al più `chunk_size` righe.
+
+    Args:
+        path (str): Percorso del file (Parquet o CSV).
+        chunk_size (int): Numero massimo di righe per blocco.
+        columns (list): Colonne da leggere (default: tutte).
+
+    Yields:
+        pd.DataFrame: Un blocco della tabella.
+    """
+    if table_format(path) == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        header = pd.read_csv(path, nrows=0).columns
+        dtype = {col: 'category' for col in CATEGORICAL_COLUMNS if col in header}
+        yield from pd.read_csv(path, usecols=columns, dtype=dtype, chunksize=chunk_size)
+
+
+class ChunkedTableWriter:
+    """
+    Scrive una tabella a blocchi senza tenerla interamente in memoria.
+    In Parquet ogni blocco diventa un row group; lo schema è fissato dal primo blocco.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fmt = table_format(path)
+        self.rows = 0
+        self._writer = None
+
+    def write(self, df):
+        if df.empty:
+            return
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            table = to_arrow(df)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                table = table.cast(self._writer.schema)
+            self._writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode='w' if self.rows == 0 else 'a', header=(self.rows == 0), index=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def output_paths(directory, name, fmt=DEFAULT_FORMAT, export_csv=False):
+    """
+    Percorsi di output di una tabella: il formato principale più, se richiesto, l'esportazione CSV.
+    """
+    paths = [table_path(directory, name, fmt)]
+    if export_csv and fmt != 'csv':
+        paths.append(table_path(directory, name, 'csv'))
+    return paths
+
+
+def write_manifest(directory, splits, source_table, seed):
+    """
+    Salva gli split come array di id di riga (posizioni) nella tabella `source_table`.
+
+    Args:
+        directory (str): Cartella in cui salvare il manifest.
+        splits (dict): Nome dello split (es. `train_1000`) -> array di id di riga.
+        source_table (str): Percorso della tabella a cui si riferiscono gli id.
+        seed (int): Seme usato per il campionamento.
+
+    Returns:
+        str: Percorso del manifest.
+    """
+    meta = {
+        'source_table': os.path.relpath(source_table, directory),
+        'source_rows': _num_rows(source_table),
+        'source_bytes': os.path.getsize(source_table),
+        'seed': seed,
+        'splits': list(splits),
+    }
+    path = os.path.join(directory, MANIFEST_FILE)
+    arrays = {name: np.asarray(ids, dtype=np.uint32) for name, ids in splits.items()}
+    np.savez(path, _meta=np.array(json.dumps(meta)), **arrays)
+    return path
+
+
+def read_manifest(directory):
+    """
+    Legge il manifest degli split.
+
+    Returns:
+        tuple: (metadati, archivio npz con un array di id di riga per split, letto su richiesta).
+    """
+    archive = np.load(os.path.join(directory, MANIFEST_FILE))
+    return json.loads(str(archive['_meta'])), archive
+
+
+def _num_rows(path):
+    if table_format(path) == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return sum(len(chunk) for chunk in iter_table_chunks(path, 100000, columns=[0]))
+
+
+def load_split(split, balanced_dir='balanced_datasets', columns=None):
+    """
+    Materializza uno split a partire dal manifest, leggendo solo le colonne richieste.
+
+    Args:
+        split (str): Nome dello split (`train_<n>`, `validation` o `test`).
+        balanced_dir (str): Cartella del manifest.
+        columns (list): Colonne da caricare (default: tutte).
+
+    Returns:
+        pd.DataFrame: Righe dello split, nell'ordine del manifest.
+
+    Raises:
+        ValueError: Se il dataset unificato è cambiato dopo la creazione del manifest.
+    """
+    meta, archive = read_manifest(balanced_dir)
+    if split not in meta['splits']:
+        raise KeyError(f"Split '{split}' non presente nel manifest. Disponibili: {meta['splits']}")
+    return load_rows(archive[split], balanced_dir, columns)
+
+
+def load_rows(ids, balanced_dir='balanced_datasets', columns=None):
+    """
+    Legge righe del dataset unificato a cui si riferisce il manifest, dati i loro id.
+
+    Args:
+        ids (array-like): Id di riga (posizioni nel dataset unificato).
+        balanced_dir (str): Cartella del manifest.
+        columns (list): Colonne da caricare (default: tutte).
+
+    Returns:
+        pd.DataFrame: Righe nell'ordine di `ids`.
+
+    Raises:
+        ValueError: Se il dataset unificato è cambiato dopo la creazione del manifest.
+    """
+    meta, _ = read_manifest(balanced_dir)
+    source_table = os.path.join(balanced_dir, meta['source_table'])
+    if os.path.getsize(source_table) != meta['source_bytes']:
+        raise ValueError(f"{source_table} è cambiato dopo la creazione del manifest: rigenerare gli split.")
+    ids = np.asarray(ids, dtype=np.int64)
+
+    if table_format(source_table) == 'parquet':
+        import pyarrow.parquet as pq
+        # Le righe vengono selezionate in Arrow, prima della conversione in pandas
+        return pq.read_table(source_table, columns=columns).take(ids).to_pandas()
+    return read_table(source_table, columns=columns).iloc[ids].reset_index(drop=True)
+
+
+def _to_hf(df):
+    from datasets import Dataset
+
+    # datasets non gestisce i dizionari Arrow: le categoriche tornano stringhe
+    for col in df.select_dtypes('category').columns:
+        df[col] = df[col].astype(object).where(df[col].notna(), None)
+    return Dataset.from_pandas(df, preserve_index=False)
+
+
+def load_hf_splits(splits, balanced_dir='balanced_datasets', columns=None):
+    """
+    Carica gli split bilanciati dal manifest come `datasets.DatasetDict`.
+
+    Args:
+        splits (dict): Nome nel DatasetDict -> nome dello split nel manifest
+            (es. `{"train": "train_1000", "val": "validation"}`).
+        balanced_dir (str): Cartella del manifest.
+        columns (list): Colonne da caricare (default: tutte).
+    """
+    from datasets import DatasetDict
+
+    return DatasetDict({name: _to_hf(load_split(split, balanced_dir, columns)) for name, split in splits.items()})
+
+
+def load_hf_dataset(data_files, columns=None):
+    """
+    Carica una o più tabelle come `datasets.DatasetDict`, leggendo solo le colonne richieste.
+    Usata dai notebook al posto di `load_dataset("csv", ...)` per non analizzare `comments`.
+
+    Args:
+        data_files (dict): Nome dello split -> percorso della tabella.
+        columns (list): Colonne da caricare (default: tutte).
+
+    Returns:
+        DatasetDict: Uno split per ogni voce di `data_files`.
+    """
+    from datasets import DatasetDict
+
+    return DatasetDict({split: _to_hf(read_table(path, columns=columns)) for split, path in data_files.items()})
@@ -1,6 +1,28 @@
 import json
 import pandas as pd
 import os
+import re
+import time
+from multiprocessing import Pool
+from dataset_io import DEFAULT_FORMAT, ChunkedTableWriter, output_paths
+
+try:
+    import resource  # Disponibile solo su sistemi Unix
+except ImportError:
+    resource = None
+
+# Numero di righe accumulate in memoria prima di essere scritte su disco
+CHUNK_SIZE = 50000
+
+# Dimensione minima (in caratteri) di ogni lettura dal file JSON
+READ_SIZE = 1 << 20
+
+# Dimensione massima (in caratteri) letta per decodificare il primo valore di un file che non è
+# un array: oltre questa soglia il file viene trattato come un JSON per riga, così un primo record
+# malformato non porta a caricare tutto il file in memoria
+MAX_FIRST_VALUE = 64 << 20
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
 
 # Funzione per estrarre attributi specifici da un oggetto JSON
 # e inserirli in formato tabellare.
@@ -23,62 +45,260 @@ def extract_attributes(entry):
     
     return attributes
 
-# Funzione per leggere un file JSON, supportando sia file con un singolo oggetto
-# JSON che file con più JSON separati per riga.
-def read_json_file(file_path):
+
+class _JsonStream:
+    """
+    Lettore incrementale di valori JSON da un file di testo.
+    Mantiene in memoria solo la porzione di file non ancora decodificata.
+    """
+
+    def __init__(self, file, read_size=READ_SIZE):
+        self.file = file
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # Scarta la parte già consumata e legge almeno quanto è ancora in buffer,
+        # così i tentativi di decodifica di un valore molto grande restano lineari
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        chunk = self.file.read(max(self.read_size, len(self.buffer)))
+        if not chunk:
+            self.eof = True
+        self.buffer += chunk
+
+    def peek(self):
+        """Restituisce il prossimo carattere non vuoto ('' a fine file)."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ''
+            self._fill()
+
+    def advance(self, n=1):
+        self.pos += n
+
+    def decode(self, max_size=None):
+        """
+        Decodifica il prossimo valore JSON, leggendo altro testo se il buffer non basta.
+        Con `max_size` rinuncia (JSONDecodeError) quando il testo in buffer supera quella dimensione.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                self.pos = end
+                return value
+            except json.JSONDecodeError:
+                if self.eof or (max_size is not None and len(self.buffer) - self.pos >= max_size):
+                    raise
+                self._fill()
+
+    def lines(self):
+        """Itera sulle righe rimanenti, a partire dalla posizione corrente."""
+        rest = self.buffer[self.pos:].split('\n')
+        self.buffer, self.pos = '', 0
+        yield from rest[:-1]
+        tail = rest[-1]
+        for line in self.file:
+            yield tail + line
+            tail = ''
+        if tail:
+            yield tail
+
+
+# Funzione per leggere un file JSON in streaming, supportando sia file con un singolo
+# oggetto JSON (o un array di oggetti) che file con più JSON separati per riga.
+def iter_json_file(file_path, read_size=READ_SIZE, max_first_value=MAX_FIRST_VALUE):
+    """
+    Restituisce uno alla volta gli oggetti JSON contenuti nel file, senza caricarlo
+    interamente in memoria. L'occupazione di memoria è limitata al singolo bug report.
+    """
     with open(file_path, 'r') as file:
+        stream = _JsonStream(file, read_size)
+        first = stream.peek()
+        if not first:
+            return
+
+        if first == '[':
+            # Array JSON: decodifica un elemento alla volta
+            stream.advance()
+            if stream.peek() == ']':
+                return
+            while True:
+                yield stream.decode()
+                separator = stream.peek()
+                if separator == ',':
+                    stream.advance()
+                elif separator == ']':
+                    return
+                else:
+                    raise ValueError(f"Separatore inatteso {separator!r} nell'array JSON.")
+
+        # Oggetto singolo (anche su più righe) oppure un JSON per riga
         try:
-            # Tentativo di caricare il file come un unico JSON
-            data = json.load(file)
-            if isinstance(data, dict):
-                return [data]  # Wrap single object in a list
-            elif isinstance(data, list):
-                return data
+            yield stream.decode(max_first_value)
         except json.JSONDecodeError:
-            file.seek(0)  # Reset del puntatore del file per la lettura linea per linea
-            data = []
-            for line in file:
-                try:
-                    json_obj = json.loads(line.strip())
-                    data.append(json_obj)
-                except json.JSONDecodeError:
-                    print(f"Warning: Skipping invalid JSON line: {line.strip()}")
-    return data
-
-
-# Funzione per convertire un file JSON in CSV.
-def json_to_csv(json_file, csv_file):
+            # Il primo valore non è valido: si procede riga per riga dall'inizio del file
+            file.seek(0)
+            stream = _JsonStream(file, read_size)
+
+        for line in stream.lines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Warning: Skipping invalid JSON line: {line}")
+
+
+def records_to_frame(records):
+    """Crea il DataFrame di un blocco di righe estratte con `extract_attributes`."""
+    # Creazione del DataFrame, con i NaN sostituiti da stringhe vuote
+    df = pd.DataFrame(records).fillna('')
+    # Tipo numerico stabile tra i blocchi: sempre float64, anche se un blocco contiene solo interi,
+    # perché lo schema Parquet è fissato dal primo blocco (i valori mancanti restano vuoti nel CSV)
+    df['days_resolution'] = pd.to_numeric(df['days_resolution'], errors='coerce').astype('float64')
+    return df
+
+
+# Funzione per convertire un file JSON in una o più tabelle (Parquet e/o CSV).
+def json_to_csv(json_file, output_files, chunk_size=CHUNK_SIZE):
+    """
+    Converte un file JSON scrivendo l'output a blocchi di `chunk_size` righe.
+    Il formato di ciascun file di output è dedotto dall'estensione (`.parquet` o `.csv`).
+
+    Returns:
+        int: Numero di righe scritte.
+    """
     if not os.path.exists(json_file):
         raise FileNotFoundError(f"Il file {json_file} non esiste.")
+    if isinstance(output_files, str):
+        output_files = [output_files]
+
+    # Si scrive su file temporanei per non lasciare output parziali in caso di errore
+    tmp_files = [path + '.tmp' + os.path.splitext(path)[1] for path in output_files]
+    writers = [ChunkedTableWriter(path) for path in tmp_files]
+    rows, chunk = 0, []
+
+    def flush():
+        df = records_to_frame(chunk)
+        for writer in writers:
+            writer.write(df)
+        return len(chunk)
+
+    try:
+        # Estrazione degli attributi desiderati
+        for entry in iter_json_file(json_file):
+            chunk.append(extract_attributes(entry))
+            if len(chunk) >= chunk_size:
+                rows += flush()
+                chunk = []
+        if chunk:
+            rows += flush()
+    except BaseException:
+        for writer, path in zip(writers, tmp_files):
+            writer.close()
+            if os.path.exists(path):
+                os.remove(path)
+        raise
 
-    # Lettura del file JSON
-    data = read_json_file(json_file)
+    for writer in writers:
+        writer.close()
 
-    if not data:
+    if rows == 0:
         raise ValueError("Nessun oggetto JSON valido trovato nel file.")
 
-    # Estrazione degli attributi desiderati
-    extracted_data = [extract_attributes(entry) for entry in data]
+    for tmp_file, path in zip(tmp_files, output_files):
+        os.replace(tmp_file, path)
+        print(f"File '{path}' creato con successo.")
+    return rows
+
+
+def peak_rss_mb():
+    """Picco di memoria residente del processo corrente in MB (None se non disponibile)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KB, macOS byte
+    return peak / (1024 * 1024) if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+def convert_source(source, input_dir='Dataset', output_dir='csv_output_from_json', chunk_size=CHUNK_SIZE,
+                   fmt=DEFAULT_FORMAT, export_csv=False):
+    """
+    Converte il JSON di una singola fonte e restituisce le statistiche dell'esecuzione.
+    Pensata per girare in un processo dedicato, così il picco di RSS è quello della fonte.
+    """
+    json_file = os.path.join(input_dir, source + '_original.json')  # Percorso del file JSON
+    output_files = output_paths(output_dir, source + '_data', fmt, export_csv)  # Percorsi dei file in output
+    stats = {'source': source, 'rows': 0, 'seconds': 0.0, 'rows_per_s': 0.0, 'peak_rss_mb': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        stats['rows'] = json_to_csv(json_file, output_files, chunk_size)
+    except Exception as e:
+        stats['error'] = str(e)
+        print(f"Errore durante la conversione di {json_file}: {str(e)}")
+    stats['seconds'] = time.perf_counter() - start
+    if stats['seconds'] > 0:
+        stats['rows_per_s'] = stats['rows'] / stats['seconds']
+    stats['peak_rss_mb'] = peak_rss_mb()
+    return stats
+
+
+def _convert_source_args(args):
+    return convert_source(*args)
+
 
-    # Creazione del DataFrame
-    df = pd.DataFrame(extracted_data)
+def extract_all(files, input_dir='Dataset', output_dir='csv_output_from_json', workers=None, chunk_size=CHUNK_SIZE,
+                fmt=DEFAULT_FORMAT, export_csv=False, raise_on_error=False):
+    """
+    Converte in parallelo i JSON di tutte le fonti, un processo per fonte.
 
-    # Sostituzione dei valori NaN con stringhe vuote
-    df = df.fillna('')
+    Args:
+        files (list): Nomi delle fonti da convertire.
+        input_dir (str): Cartella contenente i file `<fonte>_original.json`.
+        output_dir (str): Cartella in cui scrivere i file `<fonte>_data.<formato>`.
+        workers (int): Numero di processi (default: numero di CPU, al massimo una per fonte).
+        chunk_size (int): Righe per blocco di scrittura.
+        fmt (str): Formato di output (`parquet` o `csv`).
+        export_csv (bool): Se True salva anche una copia CSV.
+        raise_on_error (bool): Se True, dopo il riepilogo solleva un RuntimeError se la conversione
+            di almeno una fonte è fallita (usato dalla pipeline, che altrimenti registrerebbe
+            in cache un output parziale).
 
-    # Scrittura su file CSV
-    df.to_csv(csv_file, index=False)
+    Returns:
+        list: Statistiche per fonte (righe, righe/s, picco di RSS).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or min(len(files), os.cpu_count() or 1)
+    tasks = [(source, input_dir, output_dir, chunk_size, fmt, export_csv) for source in files]
+
+    # maxtasksperchild=1: ogni fonte in un processo nuovo, per misurarne il picco di memoria
+    with Pool(processes=workers, maxtasksperchild=1) as pool:
+        report = pool.map(_convert_source_args, tasks, chunksize=1)
+
+    print(f"\n{'Fonte':<14}{'Righe':>10}{'Tempo (s)':>12}{'Righe/s':>12}{'Picco RSS (MB)':>16}")
+    for stats in report:
+        rss = f"{stats['peak_rss_mb']:.1f}" if stats['peak_rss_mb'] is not None else 'n/d'
+        status = '' if stats['error'] is None else '  ERRORE'
+        print(f"{stats['source']:<14}{stats['rows']:>10}{stats['seconds']:>12.2f}{stats['rows_per_s']:>12.0f}{rss:>16}{status}")
+
+    failed = [stats['source'] for stats in report if stats['error'] is not None]
+    if failed and raise_on_error:
+        raise RuntimeError(f"Conversione fallita per: {', '.join(failed)}")
+    return report
 
-    print(f"File CSV '{csv_file}' creato con successo.")
 
 # Elenco dei file da processare
 files = ['Eclipse','FreeDesktop','Gentoo','KDE','LibreOffice','LiveCode','NetBeans','Novell','OpenOffice','OpenXchange','W3C']
 
-# Elaborazione dei file JSON e conversione in CSV 
-for file in files:
-    json_file = 'Dataset/'+ file +'_original.json'  # Percorso del file JSON
-    csv_file = 'csv_output_from_json/'+file + '_data.csv'  # Percorso del file CSV in output
-    try:
-        json_to_csv(json_file, csv_file)
-    except Exception as e:
-        print(f"Errore durante la conversione di {json_file}: {str(e)}")
\ No newline at end of file
+if __name__ == "__main__":
+    # Elaborazione dei file JSON e conversione in CSV
+    extract_all(files)
@@ -1,127 +1,243 @@
 import pandas as pd
 import numpy as np
-import re
 import os
+import tempfile
+from dataset_io import (DEFAULT_FORMAT, ChunkedTableWriter, iter_table_chunks, list_tables,
+                        output_paths, table_path)
+from near_duplicates import NearDuplicateFilter, document_text
+from quantile_sketch import make_estimator
 
-def clean_text(text):
+# Numero di righe elaborate per blocco
+CHUNK_SIZE = 100000
+
+# Colonne testuali da normalizzare e colonne testuali da completare con 'Unknown'
+CLEAN_COLUMNS = ['short_desc', 'comments', 'product', 'priority']
+TEXT_COLUMNS = ['short_desc', 'product', 'priority', 'bug_severity', 'comments']
+
+
+def clean_text_column(series):
+    """
+    Pulisce una colonna di testo rimuovendo spazi extra, in un'unica passata sulla colonna.
+    `' '.join(text.split())` equivale a `re.sub(r'\s+', ' ', text).strip()` (stessa definizione
+    Unicode di spazio) ma evita una chiamata al motore delle espressioni regolari per cella.
+
+    Args:
+        series (pd.Series): Colonna da pulire.
+
+    Returns:
+        pd.Series: Colonna pulita, con NaN per i valori vuoti o non testuali.
+    """
+    cleaned = [' '.join(text.split()) if isinstance(text, str) else np.nan for text in series]
+    cleaned = pd.Series(cleaned, index=series.index, dtype=object)
+    return cleaned.mask(cleaned == '')
+
+
+def blank_to_nan(series):
     """
-    Pulisce il testo rimuovendo spazi extra e normalizzando i caratteri speciali.
-    
+    Sostituisce con NaN le stringhe vuote o di soli spazi, lasciando invariati gli altri valori.
+    Nel CSV un campo vuoto è già letto come NaN, nel Parquet resta `''`: così le colonne
+    testuali non normalizzate (es. `bug_severity`) diventano "Unknown" con entrambi i formati.
+
     Args:
-        text (str): Testo da pulire.
-    
+        series (pd.Series): Colonna testuale.
+
     Returns:
-        str o np.nan: Testo pulito o NaN se vuoto.
+        pd.Series: Colonna con NaN al posto dei valori vuoti.
     """
-    if isinstance(text, str):
-        text = re.sub(r'\s+', ' ', text).strip()  # Rimuove spazi extra
-        return text if text else np.nan
-    return np.nan
+    values = series.astype(object)
+    blank = np.fromiter((isinstance(v, str) and not v.strip() for v in values), dtype=bool, count=len(values))
+    return values.mask(blank)
+
 
-def handle_missing_values(df):
+def handle_missing_values(df, days_fill_value):
     """
     Gestisce i valori mancanti in modo conservativo:
-    - Riempe `days_resolution` con il 75° percentile del dataset.
+    - Riempe `days_resolution` con il 75° percentile della fonte (`days_fill_value`).
     - Sostituisce altri valori numerici mancanti con 0.
     - Riempe colonne testuali con "Unknown".
-    - Rimuove duplicati.
 
     Args:
-        df (pd.DataFrame): DataFrame da elaborare.
-    
+        df (pd.DataFrame): Blocco di righe da elaborare.
+        days_fill_value (float): Valore per i `days_resolution` mancanti (None per non riempirli).
+
     Returns:
-        pd.DataFrame: DataFrame con valori mancanti gestiti.
+        pd.DataFrame: Blocco con valori mancanti gestiti.
     """
     df = df.copy()
-    
-    # Identifica colonne numeriche e testuali
-    numeric_columns = df.select_dtypes(include=[np.number]).columns
-    text_columns = df.select_dtypes(include=['object']).columns
-    
-    # Sostituisce i valori mancanti nelle colonne numeriche
-    for col in numeric_columns:
-        if col == 'days_resolution':
-            df[col].fillna(df[col].quantile(0.75), inplace=True)  # Usa il 75° percentile
+    for col in df.columns:
+        if col in TEXT_COLUMNS or not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype(object).fillna('Unknown')
+        elif col == 'days_resolution':
+            if days_fill_value is not None:
+                df[col] = df[col].fillna(days_fill_value)  # Usa il 75° percentile
         else:
-            df[col].fillna(0, inplace=True)  # Usa 0 per altre colonne numeriche
-    
-    # Sostituisce valori mancanti nelle colonne testuali con 'Unknown'
-    for col in text_columns:
-        df[col].fillna('Unknown', inplace=True)
-    
-    # Rimuove righe duplicate
-    df.drop_duplicates(inplace=True)
-    
+            df[col] = df[col].fillna(0)  # Usa 0 per altre colonne numeriche
     return df
 
-def process_and_merge_datasets(input_dir='csv_output_from_json', output_dir='processed_labeled_datasets'):
+
+class RowDeduplicator:
+    """
+    Rimuove le righe duplicate su uno stream di blocchi.
+    Conserva solo un hash a 64 bit per riga già vista (array ordinato), non le righe stesse.
+    """
+
+    def __init__(self):
+        self._seen = np.empty(0, dtype=np.uint64)
+
+    def __call__(self, df):
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        unique, first = np.unique(hashes, return_index=True)
+        pos = np.searchsorted(self._seen, unique)
+        found = np.zeros(len(unique), dtype=bool)
+        inside = pos < len(self._seen)
+        found[inside] = self._seen[pos[inside]] == unique[inside]
+        self._seen = np.sort(np.concatenate([self._seen, unique[~found]]), kind='stable')
+        # Mantiene la prima occorrenza di ogni riga, nell'ordine originale
+        return df.iloc[np.sort(first[~found])]
+
+
+def source_fill_value(path, chunk_size, quantile_mode):
+    """
+    Prima passata su una fonte, sulla sola colonna `days_resolution`:
+    calcola il 75° percentile usato per riempire i valori mancanti.
+    Restituisce None se la colonna non è numerica (come per una colonna testuale, non viene riempita).
+    """
+    estimator = make_estimator(quantile_mode)
+    for chunk in iter_table_chunks(path, chunk_size, columns=['days_resolution']):
+        if not pd.api.types.is_numeric_dtype(chunk['days_resolution']):
+            return None
+        estimator.update(chunk['days_resolution'].to_numpy())
+    return estimator.quantile(0.75)
+
+
+def clean_source(path, source_name, staging_file, estimator, chunk_size, quantile_mode, near_filter=None):
+    """
+    Pulisce una fonte a blocchi e la scrive nel file di appoggio, aggiornando lo stimatore globale.
+    Se `near_filter` è indicato rimuove anche i quasi duplicati (condiviso tra le fonti).
+
+    L'operazione è atomica rispetto allo stato condiviso: i valori della fonte entrano nello
+    stimatore globale solo a elaborazione completata e, in caso di errore, le righe della fonte
+    già indicizzate vengono rimosse da `near_filter` prima di propagare l'eccezione.
+
+    Returns:
+        int: Numero di righe valide.
+    """
+    fill_value = source_fill_value(path, chunk_size, quantile_mode)
+    deduplicate = RowDeduplicator()
+    source_estimator = make_estimator(quantile_mode)
+    near_state = near_filter.checkpoint() if near_filter is not None else None
+    try:
+        with ChunkedTableWriter(staging_file) as writer:
+            for df in iter_table_chunks(path, chunk_size):
+                # Pulisce le colonne di testo
+                for col in CLEAN_COLUMNS:
+                    if col in df.columns:
+                        df[col] = clean_text_column(df[col])
+                for col in TEXT_COLUMNS:
+                    if col in df.columns and col not in CLEAN_COLUMNS:
+                        df[col] = blank_to_nan(df[col])
+
+                # Testo per i quasi duplicati, prima che i valori mancanti diventino "Unknown"
+                if near_filter is not None:
+                    near_text = document_text(df, near_filter.columns)
+
+                # Gestisce i valori mancanti e rimuove le righe duplicate della fonte
+                df = deduplicate(handle_missing_values(df, fill_value))
+
+                # Converte `days_resolution` in numerico e rimuove righe non valide
+                df['days_resolution'] = pd.to_numeric(df['days_resolution'], errors='coerce')
+                df = df.dropna(subset=['days_resolution'])
+
+                # Rimuove i quasi duplicati delle righe già conservate (di questa o di altre fonti)
+                if near_filter is not None:
+                    df = near_filter(df, near_text)
+
+                # Aggiunge il nome della fonte
+                df['source'] = source_name
+
+                source_estimator.update(df['days_resolution'].to_numpy())
+                writer.write(df)
+    except BaseException:
+        if near_filter is not None:
+            near_filter.rollback(near_state)
+        raise
+    estimator.merge(source_estimator)
+    return writer.rows
+
+
+def process_and_merge_datasets(input_dir='csv_output_from_json', output_dir='processed_labeled_datasets',
+                               fmt=DEFAULT_FORMAT, export_csv=False, chunk_size=CHUNK_SIZE,
+                               quantile_mode='exact', per_source_outputs=True, near_dedup=False,
+                               near_dup_columns=('short_desc',), near_dup_threshold=0.8):
     """
-    Processa e unisce i dataset:
+    Processa e unisce i dataset a blocchi, senza tenere l'intero corpus in memoria:
     - Pulisce i dati e gestisce i valori mancanti.
+    - Se richiesto rimuove i quasi duplicati tra tutte le fonti (MinHash/LSH, vedi `near_duplicates`).
     - Converte `days_resolution` in numerico e rimuove righe con valori non validi.
     - Assegna etichette (`label`) basate sul 75° percentile globale.
     - Salva i dataset processati e il dataset unificato.
 
+    La prima passata pulisce ogni fonte in un file di appoggio e alimenta lo stimatore del
+    percentile globale; la seconda assegna le etichette e scrive in streaming gli output.
+
     Args:
-        input_dir (str): Cartella contenente i file CSV di input.
+        input_dir (str): Cartella contenente i file `<fonte>_data` (Parquet o CSV) di input.
         output_dir (str): Cartella in cui salvare i file processati.
+        fmt (str): Formato dei file di output (`parquet` o `csv`).
+        export_csv (bool): Se True salva anche una copia CSV di ogni output.
+        chunk_size (int): Numero di righe per blocco.
+        quantile_mode (str): `exact` (identico a pandas) o `sketch` (memoria costante, vedi `QuantileSketch`).
+        per_source_outputs (bool): Se False salva solo il dataset unificato.
+        near_dedup (bool): Se True rimuove anche i quasi duplicati, non solo le righe identiche.
+        near_dup_columns (tuple): Colonne confrontate (es. `('short_desc', 'comments')`).
+        near_dup_threshold (float): Similarità di Jaccard minima tra due quasi duplicati.
     """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)  # Crea la cartella di output se non esiste
-    
-    files = [f for f in os.listdir(input_dir) if f.endswith('_data.csv')]
-    cleaned_dfs = []  # Lista per i dataset puliti
-    
-    print("Elaborazione dei dataset in corso...")
-    for file in files:
-        source_name = file.replace('_data.csv', '')  # Estrae il nome della fonte dal file
-        try:
-            # Carica il file CSV
-            df = pd.read_csv(os.path.join(input_dir, file))
-            
-            # Pulisce le colonne di testo
-            for col in ['short_desc', 'comments', 'product', 'priority']:
-                if col in df.columns:
-                    df[col] = df[col].apply(clean_text)
-            
-            # Gestisce i valori mancanti
-            df = handle_missing_values(df)
-            
-            # Converte `days_resolution` in numerico e rimuove righe non valide
-            df['days_resolution'] = pd.to_numeric(df['days_resolution'], errors='coerce')
-            df.dropna(subset=['days_resolution'], inplace=True)
-            
-            # Aggiunge il nome della fonte
-            df['source'] = source_name
-            
-            cleaned_dfs.append(df)
-        
-        except Exception as e:
-            print(f"Errore durante l'elaborazione di {source_name}: {str(e)}")
-    
-    # Se non ci sono dataset validi, termina l'esecuzione
-    if not cleaned_dfs:
-        print("Nessun dataset valido trovato. Uscita.")
-        return
-    
-    # Unisce i dataset e calcola il 75° percentile globale
-    print("Unione dei dataset e calcolo del 75° percentile globale...")
-    merged_df = pd.concat(cleaned_dfs, ignore_index=True)
-    global_75th_percentile = merged_df['days_resolution'].quantile(0.75)
-    
-    # Assegna etichette ai dataset singoli e li salva
-    final_dfs = []
-    for df in cleaned_dfs:
-        df['label'] = (df['days_resolution'] > global_75th_percentile).astype(int)
-        output_file = os.path.join(output_dir, f"{df['source'].iloc[0]}_processed_labeled.csv")
-        df.to_csv(output_file, index=False)
-        final_dfs.append(df)
-    
-    # Unisce e salva il dataset finale
-    final_merged_df = pd.concat(final_dfs, ignore_index=True)
-    merged_output = os.path.join(output_dir, "merged_processed_labeled.csv")
-    final_merged_df.to_csv(merged_output, index=False)
-    
+
+    tables = list_tables(input_dir, '_data')
+    estimator = make_estimator(quantile_mode)
+    near_filter = NearDuplicateFilter(near_dup_columns, threshold=near_dup_threshold) if near_dedup else None
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as staging_dir:
+        staged = {}  # Fonte -> file di appoggio con i dati puliti
+
+        print("Elaborazione dei dataset in corso...")
+        for name, path in tables.items():
+            source_name = name[:-len('_data')]  # Estrae il nome della fonte dal file
+            staging_file = table_path(staging_dir, source_name, fmt)
+            try:
+                if clean_source(path, source_name, staging_file, estimator, chunk_size, quantile_mode, near_filter):
+                    staged[source_name] = staging_file
+            except Exception as e:
+                print(f"Errore durante l'elaborazione di {source_name}: {str(e)}")
+
+        # Se non ci sono dataset validi, termina l'esecuzione
+        if not staged:
+            print("Nessun dataset valido trovato. Uscita.")
+            return
+
+        if near_filter is not None:
+            print(f"Quasi duplicati rimossi: {near_filter.removed}")
+
+        print("Calcolo del 75° percentile globale...")
+        global_75th_percentile = estimator.quantile(0.75)
+
+        # Assegna etichette ai dataset singoli e li salva insieme al dataset unificato
+        merged_writers = [ChunkedTableWriter(p) for p in output_paths(output_dir, "merged_processed_labeled", fmt, export_csv)]
+        for source_name, staging_file in staged.items():
+            source_writers = []
+            if per_source_outputs:
+                source_writers = [ChunkedTableWriter(p) for p in output_paths(output_dir, f"{source_name}_processed_labeled", fmt, export_csv)]
+            for df in iter_table_chunks(staging_file, chunk_size):
+                df['label'] = (df['days_resolution'] > global_75th_percentile).astype(int)
+                for writer in source_writers + merged_writers:
+                    writer.write(df)
+            for writer in source_writers:
+                writer.close()
+        for writer in merged_writers:
+            writer.close()
+
     print("Elaborazione completata. Dataset unificato salvato.")
 
 if __name__ == "__main__":
@@ -0,0 +1,302 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Costanti del finalizzatore splitmix64, usato come famiglia di funzioni hash per MinHash
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_WORD = re.compile(r'\w+')
+
+
+def _mix(x):
+    """Mescola i bit di un array uint64 (aritmetica modulo 2^64)."""
+    with np.errstate(over='ignore'):
+        x = x ^ (x >> np.uint64(30))
+        x = x * _MIX_1
+        x = x ^ (x >> np.uint64(27))
+        x = x * _MIX_2
+        return x ^ (x >> np.uint64(31))
+
+
+def optimal_bands(threshold, num_perm, false_negative_weight=0.8):
+    """
+    Sceglie bande e righe per banda (bands * rows = num_perm) che minimizzano la somma pesata
+    di falsi positivi e falsi negativi attesi per la soglia di Jaccard data.
+    La probabilità che due documenti con similarità s collidano in almeno una banda è
+    1 - (1 - s^rows)^bands. I falsi negativi pesano di più perché i candidati vengono
+    comunque verificati confrontando le firme: un falso positivo costa solo un confronto.
+    """
+    best, best_error = None, float('inf')
+    grid = np.linspace(0, 1, 1001)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        prob = 1 - (1 - grid ** rows) ** bands
+        error = np.where(grid < threshold, (1 - false_negative_weight) * prob,
+                         false_negative_weight * (1 - prob)).mean()
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+def document_text(df, columns):
+    """
+    Testo su cui calcolare la similarità: concatenazione delle colonne indicate.
+    I valori mancanti non contribuiscono; una riga senza testo non viene indicizzata.
+    """
+    text = pd.Series('', index=df.index, dtype=object)
+    for col in columns:
+        values = df[col].astype(object).where(df[col].notna(), '')
+        text = text + ' ' + values.astype(str)
+    return text
+
+
+class NearDuplicateIndex:
+    """
+    Indice MinHash/LSH per trovare i testi quasi duplicati (similarità di Jaccard tra gli
+    insiemi di shingle di parole) in tempo quasi lineare.
+
+    - Gli shingle sono sequenze di `shingle_size` parole minuscole; il loro hash e le
+      `num_perm` funzioni MinHash sono calcolati in numpy su tutto il blocco di testi.
+    - Le firme sono divise in bande (vedi `optimal_bands`); due documenti sono candidati se
+      coincidono in almeno una banda e vengono confermati se la similarità stimata dalle
+      firme è almeno `threshold`.
+    - Per ogni banda l'indice conserva array ordinati di chiavi (run), uniti con una
+      strategia logaritmica come in un LSM tree: inserimenti e ricerche costano
+      O(log n) per documento e la memoria è di circa `num_perm * 4 + bands * 12` byte
+      per documento indicizzato.
+
+    Args:
+        threshold (float): Similarità di Jaccard minima per considerare due testi duplicati.
+        num_perm (int): Numero di funzioni hash MinHash.
+        shingle_size (int): Numero di parole per shingle (i testi più corti usano tutte le parole).
+        seed (int): Seme delle funzioni hash.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=64, shingle_size=2, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        self._seeds = _mix(np.arange(1, num_perm + 1, dtype=np.uint64) + np.uint64(seed) * np.uint64(num_perm))
+        self._band_seeds = _mix(np.arange(self.bands, dtype=np.uint64) + np.uint64(seed << 32))
+        self._runs = []  # [(chiavi (bands, n) ordinate per banda, posizioni corrispondenti)]
+        # Firme e id esterni nell'ordine di inserimento (buffer a capacità raddoppiata)
+        self._signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def signatures(self, texts):
+        """
+        Firme MinHash di una sequenza di testi.
+
+        Returns:
+            tuple: (firme uint32 di forma (n, num_perm), maschera dei testi con almeno una parola).
+        """
+        words, lengths = [], np.zeros(len(texts), dtype=np.int64)
+        for i, text in enumerate(texts):
+            tokens = _WORD.findall(text.lower()) if isinstance(text, str) else []
+            words.extend(tokens)
+            lengths[i] = len(tokens)
+
+        signatures = np.full((len(texts), self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        valid = lengths > 0
+        if not words:
+            return signatures, valid
+
+        # Hash di ogni parola, poi degli shingle combinando parole consecutive dello stesso testo
+        hashes = pd.util.hash_array(np.array(words, dtype=object))
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        k = np.minimum(self.shingle_size, lengths)  # i testi corti diventano un unico shingle
+        counts = np.where(valid, lengths - k + 1, 0)
+        first = np.repeat(starts, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        width = np.repeat(k, counts)
+        shingles = np.zeros(len(first), dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            for offset in range(self.shingle_size):
+                inside = offset < width
+                shingles[inside] = _mix(shingles[inside] ^ hashes[first[inside] + offset])
+
+        # Minimo di ogni funzione hash sugli shingle di ciascun documento
+        boundaries = np.concatenate([[0], np.cumsum(counts[valid])[:-1]])
+        block = np.empty((int(valid.sum()), self.num_perm), dtype=np.uint32)
+        for j, seed in enumerate(self._seeds):
+            values = _mix(shingles ^ seed) >> np.uint64(32)
+            block[:, j] = np.minimum.reduceat(values, boundaries)
+        signatures[valid] = block
+        return signatures, valid
+
+    def _band_keys(self, signatures):
+        """Una chiave uint64 per banda e documento: matrice (bands, n)."""
+        keys = np.empty((self.bands, len(signatures)), dtype=np.uint64)
+        wide = signatures.astype(np.uint64)
+        for b in range(self.bands):
+            key = np.full(len(signatures), self._band_seeds[b], dtype=np.uint64)
+            for j in range(b * self.rows, (b + 1) * self.rows):
+                key = _mix(key ^ wide[:, j])
+            keys[b] = key
+        return keys
+
+    def add(self, signatures, ids):
+        """
+        Inserisce nell'indice documenti già firmati.
+
+        Args:
+            signatures (np.ndarray): Firme restituite da `signatures` (solo righe valide).
+            ids (array-like): Id esterni dei documenti (es. id di riga).
+        """
+        if not len(signatures):
+            return
+        start, end = self._size, self._size + len(signatures)
+        if end > len(self._ids):
+            capacity = max(end, 2 * len(self._ids))
+            self._signatures = np.concatenate([self._signatures[:start], np.empty((capacity - start, self.num_perm), dtype=np.uint32)])
+            self._ids = np.concatenate([self._ids[:start], np.empty(capacity - start, dtype=np.int64)])
+        self._signatures[start:end] = signatures
+        self._ids[start:end] = ids
+        self._size = end
+        keys = self._band_keys(signatures)
+        order = np.argsort(keys, axis=1, kind='stable')
+        positions = start + order
+        self._runs.append((np.take_along_axis(keys, order, axis=1), positions))
+        # Unisce le run finché ognuna è almeno il doppio della successiva
+        while len(self._runs) > 1 and self._runs[-2][0].shape[1] <= 2 * self._runs[-1][0].shape[1]:
+            (keys_a, pos_a), (keys_b, pos_b) = self._runs.pop(-2), self._runs.pop()
+            keys = np.concatenate([keys_a, keys_b], axis=1)
+            order = np.argsort(keys, axis=1, kind='stable')
+            self._runs.append((np.take_along_axis(keys, order, axis=1),
+                               np.take_along_axis(np.concatenate([pos_a, pos_b], axis=1), order, axis=1)))
+
+    def truncate(self, size):
+        """
+        Riporta l'indice ai primi `size` documenti inseriti, scartando quelli aggiunti dopo
+        (usato per annullare gli inserimenti di una fonte la cui elaborazione è fallita).
+        """
+        if size >= self._size:
+            return
+        self._size = size
+        runs = []
+        for keys, positions in self._runs:
+            keep = positions < size
+            n = int(keep[0].sum())  # ogni banda contiene le stesse posizioni
+            if n:
+                runs.append((keys[keep].reshape(self.bands, n), positions[keep].reshape(self.bands, n)))
+        self._runs = runs
+
+    def _verify(self, query, candidates, signatures, stored):
+        """Tiene le coppie (query, posizione) la cui similarità stimata supera la soglia."""
+        if not len(query):
+            return query, candidates, np.empty(0)
+        pairs = np.unique(np.stack([query, candidates], axis=1), axis=0)
+        query, candidates = pairs[:, 0], pairs[:, 1]
+        similarity = np.empty(len(pairs))
+        for start in range(0, len(pairs), 65536):  # limita la memoria del confronto tra firme
+            part = slice(start, start + 65536)
+            similarity[part] = (signatures[query[part]] == stored[candidates[part]]).mean(axis=1)
+        keep = similarity >= self.threshold
+        return query[keep], candidates[keep], similarity[keep]
+
+    def query(self, signatures):
+        """
+        Cerca nell'indice i quasi duplicati di documenti già firmati.
+
+        Returns:
+            tuple: (indici delle righe di `signatures`, id dei documenti indicizzati che
+            collidono, similarità stimata), una voce per coppia.
+        """
+        query, candidates = [], []
+        keys = self._band_keys(signatures)
+        for run_keys, run_positions in self._runs:
+            for b in range(self.bands):
+                left = np.searchsorted(run_keys[b], keys[b], side='left')
+                right = np.searchsorted(run_keys[b], keys[b], side='right')
+                counts = right - left
+                hit = np.repeat(np.arange(len(keys[b])), counts)
+                offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                query.append(hit)
+                candidates.append(run_positions[b][np.repeat(left, counts) + offsets])
+        if not query:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        query, positions, similarity = self._verify(np.concatenate(query), np.concatenate(candidates),
+                                                    signatures, self._signatures)
+        return query, self._ids[positions], similarity
+
+    def self_duplicates(self, signatures):
+        """
+        Quasi duplicati all'interno di un blocco di documenti firmati.
+        Per ogni gruppo di documenti con la stessa chiave in una banda ciascuno viene confrontato
+        con il primo del gruppo, quindi le coppie sono O(n) anche per gruppi grandi.
+
+        Returns:
+            tuple: (indice del documento successivo, indice del documento precedente, similarità).
+        """
+        later, earlier = [], []
+        keys = self._band_keys(signatures)
+        for b in range(self.bands):
+            order = np.argsort(keys[b], kind='stable')
+            sorted_keys = keys[b][order]
+            new_group = np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]])
+            leader = order[np.flatnonzero(new_group)[np.cumsum(new_group) - 1]]
+            member = ~new_group
+            later.append(order[member])
+            earlier.append(leader[member])
+        later, earlier, similarity = self._verify(np.concatenate(later), np.concatenate(earlier), signatures, signatures)
+        return later, earlier, similarity
+
+
+class NearDuplicateFilter:
+    """
+    Rimuove i quasi duplicati su uno stream di blocchi (anche tra fonti diverse):
+    una riga viene scartata se è simile a una riga già conservata o a una riga precedente
+    dello stesso blocco.
+
+    Args:
+        columns (list): Colonne testuali confrontate (es. `['short_desc']` o `['short_desc', 'comments']`).
+        **kwargs: Parametri di `NearDuplicateIndex`.
+    """
+
+    def __init__(self, columns=('short_desc',), **kwargs):
+        self.columns = list(columns)
+        self.index = NearDuplicateIndex(**kwargs)
+        self.removed = 0
+        self._next_id = 0
+
+    def checkpoint(self):
+        """Stato corrente del filtro, da passare a `rollback`."""
+        return self._next_id, self.removed
+
+    def rollback(self, state):
+        """Annulla le righe conservate e i conteggi successivi a `checkpoint`."""
+        self._next_id, self.removed = state
+        self.index.truncate(self._next_id)
+
+    def __call__(self, df, texts=None):
+        """
+        Args:
+            df (pd.DataFrame): Blocco di righe.
+            texts (pd.Series): Testi da confrontare, allineati all'indice di `df`
+                (default: `document_text(df, columns)`).
+        """
+        if texts is None:
+            texts = document_text(df, self.columns)
+        signatures, valid = self.index.signatures(texts.loc[df.index].tolist())
+        rows = np.flatnonzero(valid)
+        signatures = signatures[valid]
+
+        duplicate = np.zeros(len(rows), dtype=bool)
+        duplicate[self.index.query(signatures)[0]] = True
+        later, earlier, _ = self.index.self_duplicates(signatures)
+        duplicate[later[later > earlier]] = True
+
+        kept = ~duplicate
+        self.index.add(signatures[kept], self._next_id + np.arange(kept.sum()))
+        self._next_id += int(kept.sum())
+        self.removed += int(duplicate.sum())
+
+        drop = np.zeros(len(df), dtype=bool)
+        drop[rows[duplicate]] = True
+        return df[~drop]
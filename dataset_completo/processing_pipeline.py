@@ -1,37 +1,307 @@
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
 import os
-import subprocess
-
-def run_script(script_name, description):
-    """Esegue uno script Python e gestisce gli errori."""
-    print(f"\n[STEP] {description}...")
-    if not os.path.exists(script_name):
-        print(f"[ERRORE] Lo script {script_name} non esiste! Controlla il nome del file.")
-        return False
-    
-    show_output = (script_name == "verifica_bilanciamento.py")  # Stampa solo l'ultimo step
-    result = subprocess.run(["python3", script_name], capture_output=True, text=True)
-    if result.returncode == 0:
-        print(f"[OK] {description} completato con successo!\n")
-        return True
-    else:
-        print(f"[ERRORE] {description} fallito!\n")
-        print(result.stderr)
-        return False
+import sys
+import time
+
+from dataset_io import DEFAULT_FORMAT, FORMATS, MANIFEST_FILE
+
+# File in cui vengono registrate le impronte (hash) di input, parametri e output di ogni fase
+STATE_FILE = ".pipeline_state.json"
+
+
+def file_hash(path, cache):
+    """
+    Hash SHA-256 del contenuto di un file. Il risultato viene riutilizzato finché
+    dimensione e data di modifica del file non cambiano, per non rileggere i dump grandi.
+    """
+    stat = os.stat(path)
+    key = f"{stat.st_size}:{stat.st_mtime_ns}"
+    cached = cache.get(path)
+    if cached and cached['stat'] == key:
+        return cached['sha256']
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    cache[path] = {'stat': key, 'sha256': digest.hexdigest()}
+    return cache[path]['sha256']
+
+
+class Stage:
+    """
+    Fase della pipeline eseguita come funzione nello stesso processo.
+
+    Args:
+        name (str): Nome della fase.
+        description (str): Descrizione stampata durante l'esecuzione.
+        func (callable): Funzione che esegue la fase.
+        inputs (callable): Restituisce i file letti dalla fase (valutata al momento dell'esecuzione).
+        outputs (callable): Restituisce i file prodotti dalla fase.
+        params (dict): Parametri passati a `func`, inclusi nell'impronta.
+        code (list): File sorgente della fase: se cambiano la fase viene rieseguita.
+        deps (list): Fasi che devono essere eseguite prima.
+        enabled (bool): Se False la fase non viene eseguita e i suoi output vengono eliminati,
+            così non restano report di un'esecuzione precedente che sembrano aggiornati.
+    """
+
+    def __init__(self, name, description, func, inputs, outputs, params=None, code=(), deps=(), enabled=True):
+        self.name = name
+        self.description = description
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+        self.code = list(code)
+        self.deps = list(deps)
+        self.enabled = enabled
+
+    def fingerprint(self, hashes):
+        """Impronta di input, parametri e codice della fase."""
+        digest = hashlib.sha256()
+        for path in sorted(set(self.inputs()) | set(self.code)):
+            digest.update(f"{path}:{file_hash(path, hashes)}\n".encode())
+        digest.update(json.dumps(self.params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+
+class Pipeline:
+    """
+    Esecutore di un DAG di fasi con cache basata sul contenuto dei file.
+    Una fase viene saltata se impronta degli input e output registrati sono invariati.
+    """
+
+    def __init__(self, stages, state_file=STATE_FILE):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_file = state_file
+        self.state = {'hashes': {}, 'stages': {}}
+        if os.path.exists(state_file):
+            with open(state_file) as file:
+                self.state = json.load(file)
+
+    def _save_state(self):
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(self.state, file, indent=1)
+        os.replace(tmp_file, self.state_file)
+
+    def order(self):
+        """Ordine topologico delle fasi."""
+        ordered, visiting = [], set()
+
+        def visit(name):
+            if name in ordered:
+                return
+            if name in visiting:
+                raise ValueError(f"Dipendenza circolare sulla fase {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            ordered.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return [self.stages[name] for name in ordered]
+
+    def _is_valid(self, stage, fingerprint):
+        record = self.state['stages'].get(stage.name)
+        if not record or record['fingerprint'] != fingerprint:
+            return False
+        hashes = self.state['hashes']
+        return all(os.path.exists(path) and file_hash(path, hashes) == digest
+                   for path, digest in record['outputs'].items())
+
+    def _disable(self, stage):
+        """Elimina gli output di una fase disattivata e il suo record nello stato."""
+        record = self.state['stages'].pop(stage.name, None) or {}
+        removed = [path for path in sorted(set(record.get('outputs', {})) | set(stage.outputs()))
+                   if os.path.exists(path)]
+        for path in removed:
+            os.remove(path)
+        if record:
+            self._save_state()
+        return removed
+
+    def run(self, force=False):
+        """
+        Esegue le fasi in ordine, saltando quelle ancora valide.
+
+        Args:
+            force (bool): Se True riesegue tutte le fasi.
+
+        Returns:
+            bool: True se tutte le fasi sono state completate.
+        """
+        report = []
+        success = True
+        for stage in self.order():
+            print(f"\n[STEP] {stage.description}...")
+            start = time.perf_counter()
+            if not stage.enabled:
+                for path in self._disable(stage):
+                    print(f"[SKIP] Rimosso l'output non più aggiornato {path}")
+                print(f"[SKIP] {stage.description}: fase disattivata.")
+                report.append((stage.name, 'disattivata', time.perf_counter() - start))
+                continue
+            try:
+                hashes = self.state['hashes']
+                fingerprint = stage.fingerprint(hashes)
+                if not force and self._is_valid(stage, fingerprint):
+                    status = 'cache'
+                    cached_output = self.state['stages'][stage.name].get('stdout')
+                    if cached_output:
+                        print(cached_output, end='')
+                    print(f"[CACHE] {stage.description}: input invariati, fase saltata.")
+                else:
+                    status = 'eseguita'
+                    result = stage.func(**stage.params)
+                    self.state['stages'][stage.name] = {
+                        'fingerprint': fingerprint,
+                        'outputs': {path: file_hash(path, hashes) for path in sorted(stage.outputs())},
+                        # Le fasi di solo report restituiscono il testo da ristampare quando sono in cache
+                        'stdout': result if isinstance(result, str) else None,
+                    }
+                    self._save_state()
+                    print(f"[OK] {stage.description} completato con successo!")
+            except Exception as e:
+                status = 'errore'
+                success = False
+                print(f"[ERRORE] {stage.description} fallito: {e}")
+            report.append((stage.name, status, time.perf_counter() - start))
+            if not success:
+                break
+
+        print(f"\n{'Fase':<12}{'Stato':<12}{'Tempo (s)':>10}")
+        for name, status, seconds in report:
+            print(f"{name:<12}{status:<12}{seconds:>10.2f}")
+        return success
+
+
+def _tables(directory, pattern):
+    """File di tabelle (in qualsiasi formato) che corrispondono al pattern."""
+    return sorted(path for ext in FORMATS.values() for path in glob.glob(os.path.join(directory, pattern + ext)))
+
+
+def _module_file(name):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+def _verify(balanced_dir):
+    """Esegue la verifica del bilanciamento, restituendone il report per la cache."""
+    from verifica_bilanciamento import verifica_bilanciamento
+
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        verifica_bilanciamento(balanced_dir=balanced_dir)
+    sys.stdout.write(buffer.getvalue())
+    return buffer.getvalue()
+
+
+def _json_sources():
+    """Fonti di `extractData.files` di cui è presente il dump JSON in `Dataset/`."""
+    from extractData import files
+
+    return [f for f in files if os.path.exists(os.path.join('Dataset', f + '_original.json'))]
+
+
+def _extract(fmt, export_csv):
+    """Converte i dump JSON presenti; fallisce se la conversione di una fonte fallisce."""
+    from extractData import extract_all
+
+    extract_all(_json_sources(), fmt=fmt, export_csv=export_csv, raise_on_error=True)
+
+
+def build_pipeline(sizes=(1000, 2000, 5000, 10000), fmt=DEFAULT_FORMAT, export_csv=False, near_dedup=False,
+                   leakage=False, state_file=STATE_FILE):
+    """
+    Definisce le fasi della pipeline di processamento del dataset.
+
+    Args:
+        sizes (tuple): Dimensioni dei dataset di training bilanciati.
+        fmt (str): Formato dei file intermedi (`parquet` o `csv`).
+        export_csv (bool): Se True ogni fase salva anche una copia CSV.
+        near_dedup (bool): Se True la fase di unione rimuove anche i quasi duplicati.
+        leakage (bool): Se True salva il report dei quasi duplicati tra gli split; se False la fase
+            è disattivata e un report precedente viene eliminato.
+        state_file (str): File in cui registrare le impronte delle fasi.
+    """
+    from mergeCsv import process_and_merge_datasets
+    from split_into_balanced_datasets import create_balanced_datasets, leakage_report
+
+    common = [_module_file('dataset_io.py')]
+    stages = [
+        Stage(
+            'extract', "Estrazione dei dataset JSON",
+            func=_extract,
+            inputs=lambda: [os.path.join('Dataset', f + '_original.json') for f in _json_sources()],
+            outputs=lambda: _tables('csv_output_from_json', '*_data'),
+            params={'fmt': fmt, 'export_csv': export_csv},
+            code=common + [_module_file('extractData.py')],
+        ),
+        Stage(
+            'merge', "Unione e pulizia dei dataset, assegnazione delle labels",
+            func=process_and_merge_datasets,
+            inputs=lambda: _tables('csv_output_from_json', '*_data'),
+            outputs=lambda: _tables('processed_labeled_datasets', '*_processed_labeled'),
+            params={'fmt': fmt, 'export_csv': export_csv, 'near_dedup': near_dedup},
+            code=common + [_module_file('mergeCsv.py'), _module_file('quantile_sketch.py'),
+                           _module_file('near_duplicates.py')],
+            deps=['extract'],
+        ),
+        Stage(
+            'split', "Creazione di dataset bilanciati per training, valutazione e test",
+            func=create_balanced_datasets,
+            inputs=lambda: _tables('processed_labeled_datasets', 'merged_processed_labeled'),
+            outputs=lambda: [os.path.join('balanced_datasets', MANIFEST_FILE)] + _tables('balanced_datasets', 'balanced_*'),
+            params={'sizes': list(sizes), 'export_csv': export_csv},
+            code=common + [_module_file('split_into_balanced_datasets.py')],
+            deps=['merge'],
+        ),
+        Stage(
+            'leakage', "Ricerca di quasi duplicati tra gli split",
+            func=leakage_report,
+            inputs=lambda: [os.path.join('balanced_datasets', MANIFEST_FILE)]
+                           + _tables('processed_labeled_datasets', 'merged_processed_labeled'),
+            outputs=lambda: [os.path.join('balanced_datasets', 'leakage_report.csv')],
+            params={'balanced_dir': 'balanced_datasets'},
+            code=common + [_module_file('split_into_balanced_datasets.py'), _module_file('near_duplicates.py')],
+            deps=['split'],
+            enabled=leakage,
+        ),
+        Stage(
+            'verify', "Verifica del bilanciamento dei dataset",
+            func=_verify,
+            inputs=lambda: [os.path.join('balanced_datasets', MANIFEST_FILE)]
+                           + _tables('processed_labeled_datasets', 'merged_processed_labeled'),
+            outputs=lambda: [],
+            params={'balanced_dir': 'balanced_datasets'},
+            code=common + [_module_file('verifica_bilanciamento.py')],
+            deps=['split'],
+        ),
+    ]
+    return Pipeline(stages, state_file)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline di processamento del dataset")
+    parser.add_argument('--force', action='store_true', help="Riesegue tutte le fasi ignorando la cache")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 5000, 10000],
+                        help="Dimensioni dei dataset di training bilanciati")
+    parser.add_argument('--format', choices=list(FORMATS), default=DEFAULT_FORMAT, help="Formato dei file intermedi")
+    parser.add_argument('--export-csv', action='store_true', help="Salva anche una copia CSV di ogni output")
+    parser.add_argument('--near-dedup', action='store_true', help="Rimuove anche i bug report quasi duplicati")
+    parser.add_argument('--leakage-report', action='store_true',
+                        help="Salva il report dei quasi duplicati tra training, validazione e test")
+    args = parser.parse_args()
+
     print("\n=== PIPELINE DI PROCESSAMENTO DEL DATASET ===\n")
-    
-    # Step 1: Estrazione JSON → CSV
-    if not run_script("extractData.py", "Estrazione dei dataset JSON in CSV"):
-        exit(1)
-    
-    # Step 2: Fusione e pulizia CSV
-    if not run_script("mergeCsv.py", "Unione e pulizia dei file CSV, assegnazione delle labels"):
-        exit(1)
 
-    # Step 3: Creazione dataset bilanciati
-    if not run_script("split_into_balanced_datasets.py", "Creazione di dataset bilanciati per training, valutazione e test"):
+    pipeline = build_pipeline(args.sizes, args.format, args.export_csv, args.near_dedup, args.leakage_report)
+    if not pipeline.run(force=args.force):
         exit(1)
 
-
     print("\nPipeline completata con successo!")
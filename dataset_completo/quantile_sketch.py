@@ -0,0 +1,121 @@
+import math
+import numpy as np
+
+
+class ExactQuantile:
+    """
+    Quantile esatto su uno stream di valori numerici.
+    Conserva solo la colonna numerica (8 byte per valore), non le righe del dataset.
+    Il risultato coincide con `pd.Series.quantile` (interpolazione lineare).
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.count = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self._chunks.append(values)
+        self.count += len(values)
+
+    def merge(self, other):
+        """Aggiunge i valori di un altro `ExactQuantile` (es. quello di una singola fonte)."""
+        self._chunks.extend(other._chunks)
+        self.count += other.count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        # Compatta i blocchi per non ripetere la concatenazione a ogni chiamata
+        self._chunks = [np.concatenate(self._chunks)]
+        return float(np.quantile(self._chunks[0], q))
+
+
+class QuantileSketch:
+    """
+    Sketch dei quantili a errore relativo (DDSketch, Masson et al., VLDB 2019).
+
+    I valori vengono contati in bucket logaritmici di base gamma = (1 + alpha) / (1 - alpha).
+    Garanzia: per ogni q il valore restituito v soddisfa |v - x_q| <= alpha * |x_q|, dove x_q è
+    il valore esatto di rango floor(q * (n - 1)) nei dati ordinati. La memoria dipende solo
+    dall'intervallo dei valori (circa log(max / min) / alpha bucket), non dal numero di righe.
+
+    Nota: il valore restituito è un rappresentante del bucket e in generale non è un intero;
+    con dati interi (come `days_resolution`) il confronto `> soglia` può differire dal caso
+    esatto per i valori che cadono nello stesso bucket del quantile.
+    """
+
+    def __init__(self, relative_accuracy=0.005, min_value=1e-9):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy deve essere compreso tra 0 e 1.")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self._positive = {}  # indice del bucket -> conteggio
+        self._negative = {}
+        self._zero = 0
+        self.count = 0
+
+    def _add(self, store, values):
+        index = np.ceil(np.log(values) / self._log_gamma).astype(np.int64)
+        for i, c in zip(*np.unique(index, return_counts=True)):
+            store[int(i)] = store.get(int(i), 0) + int(c)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        small = np.abs(values) <= self.min_value
+        self._zero += int(small.sum())
+        values = values[~small]
+        self._add(self._positive, values[values > 0])
+        self._add(self._negative, -values[values < 0])
+
+    def merge(self, other):
+        """Aggiunge i conteggi di un altro sketch con la stessa accuratezza relativa."""
+        if other.gamma != self.gamma or other.min_value != self.min_value:
+            raise ValueError("Impossibile unire sketch con parametri diversi.")
+        for store, other_store in ((self._positive, other._positive), (self._negative, other._negative)):
+            for index, count in other_store.items():
+                store[index] = store.get(index, 0) + count
+        self._zero += other._zero
+        self.count += other.count
+
+    def _value(self, index):
+        # Rappresentante del bucket (gamma^(i-1), gamma^i] con errore relativo <= alpha
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = math.floor(q * (self.count - 1))
+        seen = 0
+        for index in sorted(self._negative, reverse=True):
+            seen += self._negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self._zero
+        if seen > rank:
+            return 0.0
+        for index in sorted(self._positive):
+            seen += self._positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self._positive))
+
+
+def make_estimator(mode='exact', relative_accuracy=0.005):
+    """
+    Crea uno stimatore di quantili.
+
+    Args:
+        mode (str): `exact` (due passate, risultato identico a pandas) o `sketch` (memoria costante).
+        relative_accuracy (float): Errore relativo massimo in modalità `sketch`.
+    """
+    if mode == 'exact':
+        return ExactQuantile()
+    if mode == 'sketch':
+        return QuantileSketch(relative_accuracy)
+    raise ValueError(f"Modalità di calcolo del quantile non supportata: {mode}")
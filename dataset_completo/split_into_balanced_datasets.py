@@ -1,98 +1,237 @@
 import os
-import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
+import pandas as pd
+from dataset_io import (load_rows, load_split, output_paths, read_manifest, read_table, resolve_table,
+                        write_manifest, write_table)
+from near_duplicates import NearDuplicateIndex, document_text
+
+# Righe firmate per blocco nel report sulle collisioni tra split
+LEAKAGE_CHUNK_SIZE = 100000
+
+# Minimo di campioni per coppia (source, label) usato per dimensionare gli split: anche con gruppi
+# più piccoli si producono validazione e test di dimensione fissa e il training da 500 * 2 * fonti
+MIN_SAMPLES_PER_SOURCE_LABEL = 500
+
+
+def nested_sample(pool, n, seed):
+    """
+    Campiona `n` id dal gruppo `pool` in modo riproducibile e annidato: il campione di
+    dimensione n è sempre un prefisso di quello di dimensione maggiore.
+    Gli id vengono estratti senza ripetizioni finché il gruppo non è esaurito, poi si
+    ricomincia con una nuova permutazione (come un campionamento con reinserimento,
+    ma senza duplicati quando non sono necessari).
+    """
+    rng = np.random.default_rng(seed)
+    draws, total = [], 0
+    while total < n:
+        draws.append(rng.permutation(pool))
+        total += len(pool)
+    return np.concatenate(draws)[:n] if draws else pool[:0]
+
 
-def create_balanced_datasets(input_dir="", merged_file="merged_processed_labeled.csv", sizes=[1000, 2000, 5000, 10000]):
+def create_balanced_datasets(input_dir="processed_labeled_datasets", merged_file="merged_processed_labeled",
+                             sizes=[1000, 2000, 5000, 10000], seed=42, export_csv=False, leakage=False):
     """
     Crea dataset bilanciati per il training in diverse dimensioni e genera set di validazione e test fissi.
-    
+
+    Gli split non vengono copiati: per ciascuno viene salvato l'elenco degli id di riga del
+    dataset unificato (manifest in `balanced_datasets/`), materializzabile con `dataset_io.load_split`.
+    Le coppie (source, label) vengono raggruppate una sola volta; i dataset di training sono
+    annidati (quello da 1000 è contenuto in quello da 2000, e così via).
+
+    Validazione e test prendono da ogni gruppo `max(500, minimo) // 2` righe distinte e sono
+    disgiunti tra loro e dal training, che campiona solo le righe restanti del gruppo. Se queste
+    non bastano per la dimensione richiesta vengono riutilizzate: dopo averle estratte tutte
+    si ricomincia con una nuova permutazione (vedi `nested_sample`), quindi il training può
+    contenere ripetizioni ma mai righe di validazione o test.
+
     Args:
         input_dir (str): Cartella in cui si trova il dataset unificato.
-        merged_file (str): Nome del file CSV contenente il dataset completo.
+        merged_file (str): Nome (senza estensione) del file contenente il dataset completo.
         sizes (list): Dimensioni desiderate per i dataset di training bilanciati.
+        seed (int): Seme per il campionamento riproducibile.
+        export_csv (bool): Se True salva anche una copia CSV di ogni split.
+        leakage (bool): Se True salva anche il report dei quasi duplicati tra gli split (`leakage_report`).
+
+    Returns:
+        dict: Nome dello split -> array di id di riga.
+
+    Raises:
+        ValueError: Se un gruppo non ha almeno una riga oltre a quelle di validazione e test.
     """
-    
+
     output_dir = "balanced_datasets"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)  # Crea la cartella se non esiste
-    
+
     print("📂 Lettura del dataset unificato...")
-    df = pd.read_csv(os.path.join(input_dir, merged_file))
-    
+    merged_path = resolve_table(input_dir, merged_file)
+    # Per il campionamento bastano fonte ed etichetta; l'indice è la posizione nel file
+    df = read_table(merged_path, columns=['source', 'label'])
+
     # Rimuove fonti con troppi pochi dati per garantire bilanciamento
     df = df[~df['source'].isin(['W3C', 'OpenXchange'])]
-    
+
+    # Raggruppa una sola volta gli id di riga per ogni coppia (source, label)
+    sources = sorted(df['source'].astype(str).unique())
+    groups = {key: df.index.to_numpy()[positions]
+              for key, positions in df.groupby([df['source'].astype(str), 'label']).indices.items()}
+
     # Trova il minimo numero di campioni per ogni coppia (source, label)
-    min_samples_per_source_label = float('inf')
-    sources = df['source'].unique()
-    
     print("\n🔍 Minimo numero di campioni per ogni source e label:")
+    min_samples_per_source_label = float('inf')
     for source in sources:
         for label in [0, 1]:
-            samples = len(df[(df['source'] == source) & (df['label'] == label)])
+            samples = len(groups.get((source, label), []))
             print(f"Source: {source}, Label: {label}, Samples: {samples}")
             min_samples_per_source_label = min(min_samples_per_source_label, samples)
-    
+
     # Imposta un minimo di sicurezza per evitare dataset troppo piccoli
-    min_samples_per_source_label = max(500, min_samples_per_source_label)
-    
+    min_samples_per_source_label = max(MIN_SAMPLES_PER_SOURCE_LABEL, min_samples_per_source_label)
+
     # Calcola la dimensione massima possibile di un dataset bilanciato
     max_balanced_size = min_samples_per_source_label * 2 * len(sources)
     valid_sizes = [size for size in sizes if size <= max_balanced_size]
     if max_balanced_size not in valid_sizes:
         valid_sizes.append(max_balanced_size)
-    
-    # Creazione dei set di validazione e test
+
+    # Ordine di estrazione di ogni gruppo: validazione e test ne prendono la testa (senza
+    # ripetizioni), il training la parte restante
     print("📊 Creazione dei set di validazione e test...")
     samples_per_source_label = min_samples_per_source_label // 2
-    validation_dfs, test_dfs = [], []
-    
-    for source in sources:
-        source_df = df[df['source'] == source]
-        source_val_test = []
-        
-        for label in [0, 1]:
-            label_df = source_df[source_df['label'] == label]
-            sampled_df = label_df.sample(n=samples_per_source_label, random_state=42, replace=True)
-            source_val_test.append(sampled_df)
-        
-        val_test_df = pd.concat(source_val_test)
-        
-        # Divide il dataset in validation e test, mantenendo la stratificazione per source e label
-        val_df, test_df = train_test_split(val_test_df, test_size=0.5, random_state=42, stratify=val_test_df[['source', 'label']])
-        
-        validation_dfs.append(val_df)
-        test_dfs.append(test_df)
-    
-    validation_df = pd.concat(validation_dfs, ignore_index=True).sample(frac=1, random_state=42).reset_index(drop=True)
-    test_df = pd.concat(test_dfs, ignore_index=True).sample(frac=1, random_state=42).reset_index(drop=True)
-    
-    validation_df.to_csv(os.path.join(output_dir, "balanced_validation.csv"), index=False)
-    test_df.to_csv(os.path.join(output_dir, "balanced_test.csv"), index=False)
-    
-    # Creazione dei dataset di training bilanciati
-    for target_size in valid_sizes:
+    val_per_group = samples_per_source_label // 2
+    too_small = {key: len(groups.get(key, [])) for key in ((source, label) for source in sources for label in [0, 1])
+                 if len(groups.get(key, [])) <= samples_per_source_label}
+    if too_small:
+        details = ', '.join(f"{source}/{label}: {samples}" for (source, label), samples in too_small.items())
+        raise ValueError(f"Servono più di {samples_per_source_label} campioni per ogni coppia (source, label) "
+                         f"({val_per_group} per la validazione, {samples_per_source_label - val_per_group} per il test "
+                         f"e almeno uno per il training); troppo piccole: {details}")
+    validation_ids, test_ids, train_pools = [], [], {}
+
+    for g, key in enumerate(sorted(groups)):
+        if key[0] not in sources or key[1] not in (0, 1):
+            continue
+        head = nested_sample(groups[key], samples_per_source_label, seed=[seed, g, 0])
+        validation_ids.append(head[:val_per_group])
+        test_ids.append(head[val_per_group:])
+        rest = np.setdiff1d(groups[key], head)
+        train_pools[key] = (rest, [seed, g, 1])
+
+    reused = {key: len(pool) for key, (pool, _) in train_pools.items()
+              if len(pool) < max(valid_sizes) // len(sources) // 2}
+    if reused:
+        print("⚠️ Righe di training riutilizzate (gruppi più piccoli del training più grande): "
+              + ', '.join(f"{source}/{label}: {rows} righe" for (source, label), rows in reused.items()))
+
+    rng = np.random.default_rng(seed)
+    splits = {
+        'validation': rng.permutation(np.concatenate(validation_ids)),
+        'test': rng.permutation(np.concatenate(test_ids)),
+    }
+
+    # Creazione dei dataset di training bilanciati (annidati)
+    for target_size in sorted(valid_sizes):
         print(f"⚖️ Creazione del dataset bilanciato di training di dimensione {target_size}...")
         samples_per_source = target_size // len(sources)
         samples_per_source_label = samples_per_source // 2
-        balanced_dfs = []
-        
-        for source in sources:
-            source_df = df[df['source'] == source]
-            source_balanced = []
-            
-            for label in [0, 1]:
-                label_df = source_df[source_df['label'] == label]
-                sampled_df = label_df.sample(n=samples_per_source_label, random_state=42, replace=True)
-                source_balanced.append(sampled_df)
-            
-            balanced_dfs.append(pd.concat(source_balanced))
-        
-        balanced_df = pd.concat(balanced_dfs, ignore_index=True).sample(frac=1, random_state=42).reset_index(drop=True)
-        balanced_df.to_csv(os.path.join(output_dir, f"balanced_train_{target_size}.csv"), index=False)
-    
+        train_ids = [nested_sample(pool, samples_per_source_label, group_seed)
+                     for pool, group_seed in train_pools.values()]
+        splits[f'train_{target_size}'] = np.random.default_rng([seed, target_size]).permutation(np.concatenate(train_ids))
+
+    manifest = write_manifest(output_dir, splits, merged_path, seed)
+    print(f"🗂️ Manifest degli split salvato in {manifest}")
+
+    if export_csv:
+        for split in splits:
+            for path in output_paths(output_dir, f"balanced_{split}", 'csv'):
+                write_table(load_split(split, output_dir), path)
+
+    if leakage:
+        leakage_report(output_dir)
+
     print("✅ Dataset bilanciati creati con successo!")
+    return splits
+
+
+def leakage_report(balanced_dir="balanced_datasets", columns=('short_desc',), threshold=0.8,
+                   output_file="leakage_report.csv"):
+    """
+    Cerca righe quasi duplicate (MinHash/LSH, vedi `near_duplicates`) tra split diversi:
+    test contro validazione e training contro validazione e test. Le righe di training
+    vengono analizzate una sola volta sull'unione dei dataset annidati. Le righe presenti in
+    due split (stesso id) vengono sempre segnalate, con similarità 1 e `exact=True`, anche senza testo.
+
+    Args:
+        balanced_dir (str): Cartella del manifest.
+        columns (tuple): Colonne testuali confrontate (es. `('short_desc', 'comments')`).
+        threshold (float): Similarità di Jaccard minima per segnalare una collisione.
+        output_file (str): File CSV (nella cartella del manifest) con una riga per collisione.
+
+    Returns:
+        pd.DataFrame: Collisioni con colonne split, row_id, match_split, match_row_id, similarity,
+        exact (stesso id di riga) e train_size (il più piccolo dataset di training che contiene la riga).
+    """
+    meta, archive = read_manifest(balanced_dir)
+    train_splits = sorted((s for s in meta['splits'] if s.startswith('train_')), key=lambda s: int(s[len('train_'):]))
+    columns = list(columns)
+    index = NearDuplicateIndex(threshold=threshold)
+
+    def signed(ids):
+        """Firme dei testi delle righe indicate, a blocchi; restituisce solo le righe con testo."""
+        for start in range(0, len(ids), LEAKAGE_CHUNK_SIZE):
+            chunk_ids = ids[start:start + LEAKAGE_CHUNK_SIZE]
+            signatures, valid = index.signatures(document_text(load_rows(chunk_ids, balanced_dir, columns), columns).tolist())
+            yield chunk_ids[valid], signatures[valid]
+
+    def collisions(split, ids, indexed):
+        # Stessa riga in entrambi gli split: collisione esatta, indipendentemente dal testo
+        shared = np.intersect1d(ids, indexed)
+        found = [pd.DataFrame({'split': split, 'row_id': shared, 'match_row_id': shared, 'similarity': 1.0})]
+        for chunk_ids, signatures in signed(ids):
+            query, matches, similarity = index.query(signatures)
+            found.append(pd.DataFrame({'split': split, 'row_id': chunk_ids[query],
+                                       'match_row_id': matches, 'similarity': similarity}))
+        return found
+
+    print("🔎 Ricerca di quasi duplicati tra gli split...")
+    validation_ids = np.unique(archive['validation'])
+    test_ids = np.unique(archive['test'])
+    for chunk_ids, signatures in signed(validation_ids):
+        index.add(signatures, chunk_ids)
+    found = collisions('test', test_ids, validation_ids)
+    for chunk_ids, signatures in signed(test_ids):
+        index.add(signatures, chunk_ids)
+
+    # Il dataset di training più piccolo che contiene ogni riga
+    train_size = {}
+    for split in reversed(train_splits):
+        train_size.update(dict.fromkeys(archive[split].tolist(), int(split[len('train_'):])))
+    train_ids = np.unique(np.concatenate([archive[split] for split in train_splits] + [np.empty(0, dtype=np.uint32)]))
+    found += collisions('train', train_ids, np.union1d(validation_ids, test_ids))
+
+    report = pd.concat(found, ignore_index=True).drop_duplicates(['split', 'row_id', 'match_row_id'])
+    report.insert(2, 'match_split', np.where(np.isin(report['match_row_id'], validation_ids), 'validation', 'test'))
+    report['exact'] = report['row_id'] == report['match_row_id']
+    report['train_size'] = report['row_id'].map(train_size).where(report['split'] == 'train').astype('Int64')
+    report = report.sort_values(['split', 'row_id', 'match_row_id'], ignore_index=True)
+    report.to_csv(os.path.join(balanced_dir, output_file), index=False)
+
+    test = report[report['split'] == 'test']
+    print(f"Test vs validazione: {test['row_id'].nunique()} righe in collisione "
+          f"({test.loc[test['exact'], 'row_id'].nunique()} presenti in entrambi gli split)")
+    train = report[report['split'] == 'train']
+    for split in train_splits:
+        size = int(split[len('train_'):])
+        rows = train[train['train_size'] <= size]
+        total = len(np.unique(archive[split]))
+        for match_split in ['validation', 'test']:
+            matched = rows[rows['match_split'] == match_split]
+            count = matched['row_id'].nunique()
+            exact = matched.loc[matched['exact'], 'row_id'].nunique()
+            print(f"{split} vs {match_split}: {count} righe in collisione su {total} ({count / max(total, 1):.2%}), "
+                  f"{exact} presenti in entrambi gli split")
+    return report
 
 if __name__ == "__main__":
     create_balanced_datasets(sizes=[1000, 2000, 5000, 10000])
@@ -0,0 +1,297 @@
+"""
+Profilazione delle risorse e dei tempi per batch durante la valutazione.
+
+Un thread in background campiona a intervallo fisso l'utilizzo della CPU, la RAM di sistema, la
+memoria residente (RSS) del processo e, se sono disponibili NVML e una GPU, utilizzo e memoria
+della GPU. `BatchProfiler` misura il tempo di ogni batch (sincronizzando CUDA solo se il modello
+è su GPU) e assegna a ogni batch la media dei campioni presi mentre era in esecuzione.
+
+`BatchProfiler.save` scrive nella cartella dei risultati:
+- avg_system_metrics.csv: le medie `cpu`, `ram`, `gpu` e `time` (tempo medio per batch) lette da
+  comparison.py, più latenza p50/p95/p99 per batch, esempi al secondo e picchi di memoria;
+- batch_trace.csv: una riga per batch (dimensione, inizio, durata, risorse medie).
+
+Senza CUDA o senza NVML (pynvml non installato, nessuna GPU) le colonne della GPU valgono 0.
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import psutil
+
+try:
+    import pynvml
+except ImportError:  # valutazione su CPU senza NVML
+    pynvml = None
+
+
+SAMPLE_COLUMNS = ["cpu", "ram", "rss_mb", "gpu", "gpu_mem_mb"]
+
+
+def nvml_handle(index=0):
+    """
+    Handle NVML di una GPU.
+
+    Args:
+        index (int): Indice della GPU.
+
+    Returns:
+        Handle NVML, o None se pynvml, il driver o la GPU non sono disponibili.
+    """
+    if pynvml is None:
+        return None
+    try:
+        pynvml.nvmlInit()
+        return pynvml.nvmlDeviceGetHandleByIndex(index)
+    except pynvml.NVMLError:
+        return None
+
+
+def _torch():
+    # torch non viene importato qui: se il chiamante non l'ha già importato non ci sono modelli su GPU
+    return sys.modules.get("torch")
+
+
+def is_cuda(device):
+    """True se `device` è un dispositivo CUDA (e CUDA è disponibile)."""
+    torch = _torch()
+    return torch is not None and device is not None and torch.device(device).type == "cuda" \
+        and torch.cuda.is_available()
+
+
+def synchronize(device):
+    """Attende la fine dei kernel CUDA, così i tempi misurati includono il calcolo sulla GPU; su CPU non fa nulla."""
+    if is_cuda(device):
+        _torch().cuda.synchronize(device)
+
+
+class SystemSampler:
+    """
+    Campionamento periodico delle risorse in un thread in background.
+
+    Args:
+        interval (float): Secondi tra due campioni.
+        gpu_index (int): GPU letta tramite NVML.
+        include_children (bool): Somma all'RSS del processo quello dei processi figli (es. i
+            worker della valutazione a shard).
+
+    Ogni campione (`samples`) contiene l'istante (`t`, `time.perf_counter`), l'utilizzo della CPU
+    dall'ultimo campione (%), la RAM di sistema (%), l'RSS del processo (MB) e utilizzo (%) e
+    memoria usata (MB) della GPU.
+    """
+
+    def __init__(self, interval=0.1, gpu_index=0, include_children=False):
+        self.interval = interval
+        self.include_children = include_children
+        self.process = psutil.Process(os.getpid())
+        self.gpu = nvml_handle(gpu_index)
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """Legge le risorse in questo istante."""
+        row = {"t": time.perf_counter(), "cpu": psutil.cpu_percent(), "ram": psutil.virtual_memory().percent,
+               "rss_mb": self.rss() / 2 ** 20, "gpu": 0, "gpu_mem_mb": 0.0}
+        if self.gpu is not None:
+            try:
+                row["gpu"] = pynvml.nvmlDeviceGetUtilizationRates(self.gpu).gpu
+                row["gpu_mem_mb"] = pynvml.nvmlDeviceGetMemoryInfo(self.gpu).used / 2 ** 20
+            except pynvml.NVMLError:
+                pass
+        return row
+
+    def rss(self):
+        """RSS del processo in byte (più quello dei figli con `include_children`)."""
+        rss = self.process.memory_info().rss
+        if self.include_children:
+            for child in self.process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.NoSuchProcess:  # figlio terminato tra l'elenco e la lettura
+                    pass
+        return rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.samples.append(self.sample())
+
+    def start(self):
+        """Avvia il campionamento (la prima lettura della CPU fa da riferimento e non viene salvata)."""
+        psutil.cpu_percent()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="system-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Ferma il campionamento; un ultimo campione copre anche le esecuzioni più brevi di `interval`."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.samples.append(self.sample())
+
+    def frame(self):
+        """Campioni come DataFrame."""
+        return pd.DataFrame(self.samples, columns=["t"] + SAMPLE_COLUMNS)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class BatchProfiler:
+    """
+    Tempi per batch e risorse campionate in background durante una valutazione.
+
+    Args:
+        device: Dispositivo del modello; i tempi sono sincronizzati solo se è CUDA.
+        interval (float): Secondi tra due campioni delle risorse.
+        include_children (bool): RSS comprensivo dei processi figli (vedi `SystemSampler`).
+
+    Esempio:
+        with BatchProfiler(model.device) as profiler:
+            for indices in batches:
+                with profiler.batch(len(indices)):
+                    ...
+        profiler.save(output_dir)
+    """
+
+    def __init__(self, device=None, interval=0.1, include_children=False):
+        self.device = device
+        self.sampler = SystemSampler(interval, include_children=include_children)
+        self.batches = []
+        self.start_time = None
+        self.end_time = None
+
+    def __enter__(self):
+        if is_cuda(self.device):
+            _torch().cuda.reset_peak_memory_stats(self.device)
+        self.sampler.start()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.end_time = time.perf_counter()
+        self.sampler.stop()
+
+    @contextmanager
+    def batch(self, size, index=None):
+        """
+        Misura un batch di `size` esempi; se il blocco solleva un'eccezione il batch non viene registrato.
+
+        Args:
+            size (int): Esempi nel batch.
+            index (int): Indice del batch (default: numero di batch già registrati).
+        """
+        synchronize(self.device)
+        start = time.perf_counter()
+        yield
+        synchronize(self.device)
+        end = time.perf_counter()
+        self.batches.append({"batch": len(self.batches) if index is None else index, "size": size,
+                             "start": start, "time": end - start})
+
+    def trace(self):
+        """
+        Una riga per batch: indice, esempi, inizio (secondi dall'avvio), durata e media delle risorse
+        campionate durante il batch (o del primo campione successivo, per i batch più brevi
+        dell'intervallo di campionamento).
+        """
+        trace = pd.DataFrame(self.batches, columns=["batch", "size", "start", "time"])
+        samples = self.sampler.frame()
+        if len(trace) and len(samples):
+            times = samples["t"].to_numpy()
+            values = samples[SAMPLE_COLUMNS].to_numpy(dtype=float)
+            first = np.searchsorted(times, trace["start"].to_numpy(), side="left")
+            last = np.searchsorted(times, (trace["start"] + trace["time"]).to_numpy(), side="right")
+            first = np.minimum(first, len(times) - 1)
+            last = np.minimum(np.maximum(last, first + 1), len(times))
+            cumulative = np.vstack([np.zeros(values.shape[1]), np.cumsum(values, axis=0)])
+            means = (cumulative[last] - cumulative[first]) / (last - first)[:, None]
+            trace[SAMPLE_COLUMNS] = means
+        else:
+            trace[SAMPLE_COLUMNS] = np.nan
+        if self.start_time is not None:
+            trace["start"] -= self.start_time
+        return trace
+
+    def summary(self):
+        """
+        Metriche aggregate della valutazione.
+
+        Returns:
+            dict: `cpu`, `ram`, `gpu` (medie sull'intera esecuzione) e `time` (tempo medio per batch),
+            come nella versione precedente di avg_system_metrics.csv, più latenza per batch
+            (p50/p95/p99), esempi al secondo, batch, esempi, durata complessiva e picchi di RSS e
+            memoria GPU (MB). Gli esempi al secondo sono calcolati sul tempo in cui almeno un batch
+            era in esecuzione: per batch in sequenza è la somma delle durate, per batch eseguiti in
+            parallelo da più processi (valutazione a shard) non conta due volte le sovrapposizioni.
+        """
+        times = np.array([b["time"] for b in self.batches])
+        samples = self.sampler.frame()
+        n_samples = int(sum(b["size"] for b in self.batches))
+        summary = {
+            "cpu": samples["cpu"].mean() if len(samples) else np.nan,
+            "ram": samples["ram"].mean() if len(samples) else np.nan,
+            "gpu": samples["gpu"].mean() if len(samples) else np.nan,
+            "time": times.mean() if len(times) else np.nan,
+        }
+        p50, p95, p99 = np.percentile(times, [50, 95, 99]) if len(times) else (np.nan,) * 3
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        summary.update({
+            "p50_time": p50,
+            "p95_time": p95,
+            "p99_time": p99,
+            "samples_per_s": n_samples / busy_time(self.batches) if times.sum() > 0 else np.nan,
+            "batches": len(times),
+            "samples": n_samples,
+            "wall_time": end_time - self.start_time if self.start_time is not None else np.nan,
+            "peak_rss_mb": samples["rss_mb"].max() if len(samples) else np.nan,
+            "peak_gpu_mem_mb": samples["gpu_mem_mb"].max() if len(samples) else 0.0,
+            "peak_cuda_allocated_mb": _torch().cuda.max_memory_allocated(self.device) / 2 ** 20
+            if is_cuda(self.device) else 0.0,
+        })
+        return summary
+
+    def save(self, output_dir, summary_file="avg_system_metrics.csv", trace_file="batch_trace.csv"):
+        """
+        Scrive il riepilogo e la traccia per batch in `output_dir`.
+
+        Returns:
+            dict: Il riepilogo (vedi `summary`).
+        """
+        summary = self.summary()
+        pd.DataFrame([summary]).to_csv(os.path.join(output_dir, summary_file), index=False)
+        self.trace().to_csv(os.path.join(output_dir, trace_file), index=False)
+        return summary
+
+
+def busy_time(batches):
+    """Secondi in cui almeno uno dei batch (`start`, `time`) era in esecuzione (unione degli intervalli)."""
+    if not batches:
+        return 0.0
+    intervals = sorted((b["start"], b["start"] + b["time"]) for b in batches)
+    total, (current_start, current_end) = 0.0, intervals[0]
+    for start, end in intervals[1:]:
+        if start > current_end:
+            total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    return total + current_end - current_start
+
+
+def format_summary(summary):
+    """Riepilogo su una riga per i log."""
+    return (f"{summary['samples']} esempi in {summary['batches']} batch, {summary['samples_per_s']:.1f} esempi/s | "
+            f"latenza per batch p50 {summary['p50_time']:.4f}s, p95 {summary['p95_time']:.4f}s, "
+            f"p99 {summary['p99_time']:.4f}s | CPU {summary['cpu']:.1f}%, GPU {summary['gpu']:.1f}%, "
+            f"RSS max {summary['peak_rss_mb']:.0f} MB, memoria GPU max {summary['peak_gpu_mem_mb']:.0f} MB")
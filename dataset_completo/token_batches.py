@@ -0,0 +1,51 @@
+"""
+Batch a budget di token, condivisi dalle due isole: gli esempi vengono ordinati (o raggruppati)
+per lunghezza e ogni batch è riempito finché il suo costo con padding (lunghezza massima x numero
+di esempi) resta entro il budget.
+"""
+import numpy as np
+
+
+def token_budget_batches(lengths, max_tokens, max_batch_size=None, shuffle=False, seed=42, bucket_size=100):
+    """
+    Divide gli esempi in batch il cui costo con padding (lunghezza massima x esempi) resta
+    entro `max_tokens`.
+
+    Args:
+        lengths (array-like): Numero di token di ogni esempio.
+        max_tokens (int): Budget di token per batch (un esempio più lungo forma un batch da solo).
+        max_batch_size (int): Numero massimo di esempi per batch (default: nessun limite).
+        shuffle (bool): Se False gli esempi sono ordinati per lunghezza (valutazione). Se True vengono
+            mescolati e ordinati solo all'interno di gruppi di `bucket_size` batch medi, così i batch
+            restano omogenei per lunghezza ma cambiano composizione a ogni seme (training).
+        seed (int): Seme del mescolamento.
+        bucket_size (int): Dimensione dei gruppi, in multipli della dimensione media di un batch.
+
+    Returns:
+        list: Liste di indici, una per batch.
+    """
+    lengths = np.asarray(lengths)
+    if shuffle:
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(len(lengths))
+        per_batch = max(1, max_tokens // max(1, int(np.mean(lengths)) if len(lengths) else 1))
+        if max_batch_size:
+            per_batch = min(per_batch, max_batch_size)
+        group = per_batch * bucket_size
+        order = np.concatenate([chunk[np.argsort(lengths[chunk], kind='stable')]
+                                for chunk in np.split(order, range(group, len(order), group))] or [order])
+    else:
+        order = np.argsort(lengths, kind='stable')
+
+    batches, current, longest = [], [], 0
+    for i in order:
+        longest_if_added = max(longest, lengths[i])
+        if current and (longest_if_added * (len(current) + 1) > max_tokens
+                        or (max_batch_size and len(current) >= max_batch_size)):
+            batches.append(current)
+            current, longest_if_added = [], lengths[i]
+        current.append(int(i))
+        longest = longest_if_added
+    if current:
+        batches.append(current)
+    return batches
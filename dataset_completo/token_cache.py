@@ -0,0 +1,240 @@
+import glob
+import hashlib
+import json
+import os
+import uuid
+import weakref
+import numpy as np
+import pandas as pd
+
+# Cartella condivisa dai notebook di entrambe le isole (indipendente dalla cartella di lavoro)
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'token_cache')
+
+# Voci tokenizzate tenute in memoria prima di essere scritte in un nuovo shard
+FLUSH_SIZE = 8192
+
+# Gli shard vengono uniti in uno solo quando quelli minori contengono almeno questa frazione
+# delle voci del maggiore: ogni voce viene così riscritta un numero limitato di volte
+COMPACT_RATIO = 0.5
+
+
+def tokenizer_fingerprint(tokenizer):
+    """
+    Impronta dell'identità di un tokenizer: classe, vocabolario e regole di pre/post-processing
+    (per i tokenizer "fast" l'intera definizione serializzata), token speciali e lato di troncamento.
+    Due tokenizer con la stessa impronta producono gli stessi id per lo stesso testo.
+    """
+    digest = hashlib.sha256()
+    digest.update(type(tokenizer).__name__.encode())
+    if getattr(tokenizer, 'is_fast', False):
+        # Troncamento e padding del backend cambiano a ogni chiamata: non fanno parte dell'identità
+        definition = json.loads(tokenizer.backend_tokenizer.to_str())
+        definition.pop('truncation', None)
+        definition.pop('padding', None)
+        digest.update(json.dumps(definition, sort_keys=True).encode())
+    else:
+        digest.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode())
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode())
+    digest.update(str(getattr(tokenizer, 'truncation_side', 'right')).encode())
+    return digest.hexdigest()
+
+
+def text_hashes(texts):
+    """Hash a 64 bit (deterministico tra processi) di una sequenza di testi."""
+    return pd.util.hash_array(np.asarray(list(texts), dtype=object))
+
+
+def _write_shard(directory, hashes, sequences):
+    """
+    Scrive un nuovo shard in modo atomico (più processi possono aggiungere voci insieme)
+    e ne restituisce il percorso.
+    """
+    name = f"shard_{uuid.uuid4().hex}"
+    folder = os.path.join(directory, name)
+    os.makedirs(folder)
+    lengths = np.array([len(ids) for ids in sequences], dtype=np.int64)
+    np.save(os.path.join(folder, 'offsets.npy'), np.concatenate([[0], np.cumsum(lengths)]))
+    flat = np.concatenate([np.asarray(ids, dtype=np.int32) for ids in sequences]) if sequences else np.empty(0, np.int32)
+    np.save(os.path.join(folder, 'ids.npy'), flat)
+    # Lo shard diventa visibile solo quando i suoi array sono completi
+    tmp_file = os.path.join(directory, f".{name}.tmp.npz")
+    np.savez(tmp_file, hashes=np.asarray(hashes, dtype=np.uint64))
+    os.replace(tmp_file, folder + '.npz')
+    return folder + '.npz'
+
+
+def _write_pending(directory, pending):
+    """Scrive le voci ancora in memoria (chiamata anche alla chiusura dell'interprete)."""
+    if pending:
+        hashes = np.fromiter(pending, dtype=np.uint64, count=len(pending))
+        sequences = list(pending.values())
+        pending.clear()
+        order = np.argsort(hashes)
+        return _write_shard(directory, hashes[order], [sequences[i] for i in order])
+
+
+class TokenCache:
+    """
+    Cache persistente della tokenizzazione, condivisa tra training e valutazione.
+
+    Le voci sono indicizzate da impronta del tokenizer, `max_length` e hash del testo: ogni
+    combinazione tokenizer/`max_length` ha una propria cartella. Gli id sono salvati senza
+    padding in formato "ragged": per ogni shard un array piatto `ids` (int32) e un array
+    `offsets` (n + 1 posizioni), letti in memory-map, più gli hash dei testi.
+    Il tokenizer viene chiamato solo per i testi mai visti; il padding è applicato al momento
+    della lettura (`__call__`), quindi la stessa cache serve sia il padding a `max_length`
+    sia il padding dinamico per batch.
+
+    L'indice degli hash resta in memoria: i testi nuovi vengono accumulati e scritti in uno
+    shard ogni `FLUSH_SIZE` voci (e alla chiusura, o con `flush()`), e solo il nuovo shard viene
+    aggiunto all'indice. Gli shard vengono uniti secondo `COMPACT_RATIO`.
+
+    Args:
+        tokenizer: Tokenizer di `transformers`.
+        max_length (int): Lunghezza massima (troncamento) degli id salvati.
+        cache_dir (str): Cartella radice della cache.
+    """
+
+    def __init__(self, tokenizer, max_length, cache_dir=DEFAULT_CACHE_DIR):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.key = f"{tokenizer_fingerprint(tokenizer)[:16]}_{max_length}"
+        self.directory = os.path.join(cache_dir, self.key)
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        # Voci non ancora scritte su disco (hash -> id): scritte comunque all'uscita del processo
+        self._pending = {}
+        weakref.finalize(self, _write_pending, self.directory, self._pending)
+        self._load()
+
+    def _shards(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'shard_*.npz')))
+
+    def _load(self):
+        """Ricostruisce l'indice dagli shard su disco; offsets e ids restano su disco (memory-map)."""
+        self._arrays, self._paths, self._sizes = [], [], []
+        self._hashes, self._owners = np.empty(0, dtype=np.uint64), np.empty((0, 2), dtype=np.int64)
+        for path in self._shards():
+            self._add_shard(path)
+
+    def _add_shard(self, path):
+        """Aggiunge all'indice le voci di uno shard non ancora indicizzate."""
+        folder = path[:-len('.npz')]
+        try:
+            with np.load(path) as meta:
+                hashes = meta['hashes']
+            arrays = (np.load(os.path.join(folder, 'offsets.npy'), mmap_mode='r'),
+                      np.load(os.path.join(folder, 'ids.npy'), mmap_mode='r'))
+        except FileNotFoundError:
+            return  # Shard rimosso nel frattempo dalla compattazione di un altro processo
+        shard = len(self._arrays)
+        self._arrays.append(arrays)
+        self._paths.append(path)
+        self._sizes.append(len(hashes))
+        rows = np.flatnonzero(self._lookup(hashes)[:, 0] < 0)
+        hashes, rows = hashes[rows], rows[np.argsort(hashes[rows], kind='stable')]
+        hashes = np.sort(hashes, kind='stable')
+        pos = np.searchsorted(self._hashes, hashes)
+        self._hashes = np.insert(self._hashes, pos, hashes)
+        self._owners = np.insert(self._owners, pos, np.stack([np.full(len(rows), shard), rows], axis=1), axis=0)
+
+    def _refresh(self):
+        """Indicizza gli shard scritti da altri processi dopo l'apertura della cache."""
+        known = set(self._paths)
+        for path in self._shards():
+            if path not in known:
+                self._add_shard(path)
+
+    def __len__(self):
+        return len(self._hashes) + len(self._pending)
+
+    def _lookup(self, hashes):
+        """Per ogni hash restituisce (shard, riga) o -1 se il testo non è negli shard su disco."""
+        pos = np.searchsorted(self._hashes, hashes)
+        found = np.zeros(len(hashes), dtype=bool)
+        inside = pos < len(self._hashes)
+        found[inside] = self._hashes[pos[inside]] == hashes[inside]
+        owners = np.full((len(hashes), 2), -1, dtype=np.int64)
+        owners[found] = self._owners[pos[found]]
+        return owners
+
+    def _read(self, shard, row):
+        offsets, ids = self._arrays[shard]
+        return np.asarray(ids[offsets[row]:offsets[row + 1]])
+
+    def encode(self, texts):
+        """
+        Id dei token (senza padding) di una lista di testi, tokenizzando solo quelli non in cache.
+
+        Returns:
+            list: Un array numpy di id per testo.
+        """
+        texts = list(texts)
+        hashes = text_hashes(texts)
+        owners = self._lookup(hashes)
+        missing = [i for i in np.flatnonzero(owners[:, 0] < 0) if int(hashes[i]) not in self._pending]
+        if missing:
+            # Altri processi possono aver già scritto questi testi
+            self._refresh()
+            owners = self._lookup(hashes)
+            missing = [i for i in missing if owners[i, 0] < 0]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            new = {int(hashes[i]): i for i in missing}
+            encoded = self.tokenizer([texts[i] for i in new.values()], truncation=True,
+                                     max_length=self.max_length)['input_ids']
+            for key, ids in zip(new, encoded):
+                self._pending[key] = np.asarray(ids, dtype=np.int32)
+        result = [self._read(shard, row) if shard >= 0 else self._pending[int(key)]
+                  for (shard, row), key in zip(owners, hashes)]
+        if len(self._pending) >= FLUSH_SIZE:
+            self.flush()
+        return result
+
+    def __call__(self, texts, padding=False, return_tensors=None, pad_to_multiple_of=None):
+        """
+        Sostituto di `tokenizer(texts, truncation=True, max_length=max_length, padding=...)`:
+        restituisce `input_ids` e `attention_mask` leggendo gli id dalla cache.
+
+        Args:
+            texts (list): Testi da tokenizzare.
+            padding: `False` (id senza padding), `True`/`'longest'` o `'max_length'`.
+            return_tensors (str): Come nel tokenizer (es. `'pt'`).
+            pad_to_multiple_of (int): Come nel tokenizer.
+        """
+        features = {'input_ids': [ids.tolist() for ids in self.encode(texts)]}
+        if not padding:
+            features['attention_mask'] = [[1] * len(ids) for ids in features['input_ids']]
+            return features if return_tensors is None else self.tokenizer.pad(features, return_tensors=return_tensors)
+        return self.tokenizer.pad(features, padding=padding, max_length=self.max_length,
+                                  pad_to_multiple_of=pad_to_multiple_of, return_tensors=return_tensors)
+
+    def flush(self):
+        """Scrive su disco le voci in memoria e, se gli shard minori sono cresciuti abbastanza, li compatta."""
+        path = _write_pending(self.directory, self._pending)
+        if path is None:
+            return
+        self._add_shard(path)
+        largest = max(self._sizes)
+        if len(self._sizes) > 1 and sum(self._sizes) - largest >= COMPACT_RATIO * largest:
+            self.compact()
+
+    def compact(self):
+        """Unisce tutti gli shard in uno solo (eliminando eventuali voci duplicate)."""
+        _write_pending(self.directory, self._pending)
+        self._load()
+        if len(self._paths) < 2:
+            return
+        sequences = [self._read(shard, row) for shard, row in self._owners]
+        path = _write_shard(self.directory, self._hashes, sequences)
+        for old in self._paths:
+            os.remove(old)
+            folder = old[:-len('.npz')]
+            for file in os.listdir(folder):
+                os.remove(os.path.join(folder, file))
+            os.rmdir(folder)
+        self._arrays, self._paths, self._sizes = [], [], []
+        self._hashes, self._owners = np.empty(0, dtype=np.uint64), np.empty((0, 2), dtype=np.int64)
+        self._add_shard(path)
@@ -0,0 +1,253 @@
+"""
+Valutazione leggera durante il fine-tuning (ft.ipynb, distilbert_sweep.py e SFTTrainer dell'isola LLM).
+
+Con `eval_steps=100` il Trainer valuta spesso: ogni valutazione su tutta la validazione, con le
+metriche di sklearn e la confusion matrix disegnata e salvata da matplotlib nel ciclo di
+training, ferma l'addestramento. Qui:
+- le valutazioni periodiche usano un sottoinsieme stratificato e fisso della validazione
+  (`eval_subsample`), sempre lo stesso così le curve restano confrontabili; la validazione
+  completa si fa una volta alla fine con `trainer.evaluate(dataset_completo)`;
+- le metriche sono calcolate in NumPy dalla confusion matrix (`ClassificationMetrics`), anche a
+  batch con `batch_eval_metrics=True`;
+- la confusion matrix viene disegnata e salvata in un thread separato (`ArtifactWorker`);
+- `EvalTimeCallback` misura quanto del tempo di training è andato in valutazione
+  (colonne `Eval Time (s)` e `Eval Share` di training_comparison.csv, vedi `training_results`).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from transformers import TrainerCallback
+
+# Esempi del sottoinsieme di validazione usato durante il training
+DEFAULT_EVAL_SUBSAMPLE = 512
+
+
+def stratified_subsample(labels, size, seed=42):
+    """
+    Indici di un sottoinsieme stratificato per etichetta (proporzioni delle classi conservate).
+
+    Args:
+        labels (array-like): Etichetta di ogni esempio.
+        size (int): Numero di esempi da tenere.
+        seed (int): Seme del campionamento (stesso seme = stesso sottoinsieme).
+
+    Returns:
+        np.ndarray: Indici ordinati, oppure tutti gli indici se `size` non è minore degli esempi.
+    """
+    labels = np.asarray(labels)
+    if size is None or size >= len(labels):
+        return np.arange(len(labels))
+    rng = np.random.default_rng(seed)
+    classes, counts = np.unique(labels, return_counts=True)
+    # Quote proporzionali, con i resti assegnati alle classi con la parte frazionaria maggiore
+    quotas = counts * size / len(labels)
+    taken = np.floor(quotas).astype(int)
+    taken[np.argsort(taken - quotas)[:size - taken.sum()]] += 1
+    indices = [rng.choice(np.flatnonzero(labels == label), n, replace=False) for label, n in zip(classes, taken)]
+    return np.sort(np.concatenate(indices))
+
+
+def eval_subsample(dataset, size=DEFAULT_EVAL_SUBSAMPLE, seed=42, label_column="label"):
+    """
+    Sottoinsieme stratificato di un `datasets.Dataset` di validazione.
+
+    Args:
+        dataset (Dataset): Validazione completa (tokenizzata o no).
+        size (int): Esempi da tenere (None = tutta la validazione).
+        seed (int): Seme del campionamento.
+        label_column (str): Colonna delle etichette.
+    """
+    if size is None or size >= len(dataset):
+        return dataset
+    labels = dataset.with_format(None)[label_column]
+    return dataset.select(stratified_subsample(labels, size, seed))
+
+
+def confusion_counts(labels, predictions, num_labels=2):
+    """Confusion matrix (righe = etichetta vera, colonne = predetta) con un solo `bincount`."""
+    labels = np.asarray(labels, dtype=np.int64).ravel()
+    predictions = np.asarray(predictions, dtype=np.int64).ravel()
+    return np.bincount(labels * num_labels + predictions, minlength=num_labels ** 2).reshape(num_labels, num_labels)
+
+
+def metrics_from_confusion(confusion):
+    """
+    Accuracy e precision/recall/F1 pesati sul supporto, come `average='weighted'` di sklearn
+    (con `zero_division=0`).
+    """
+    confusion = np.asarray(confusion, dtype=np.float64)
+    true_positives = np.diag(confusion)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    total = support.sum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        recall = np.where(support > 0, true_positives / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    weights = support / total if total else support
+    return {
+        "accuracy": float(true_positives.sum() / total) if total else 0.0,
+        "precision": float(precision @ weights),
+        "recall": float(recall @ weights),
+        "f1": float(f1 @ weights),
+    }
+
+
+def render_confusion_matrix(confusion, output_file, title="Confusion Matrix"):
+    """
+    Disegna e salva la confusion matrix come in ft.ipynb. Usa direttamente `Figure` invece di
+    pyplot, che non è thread-safe, così può girare nel thread di `ArtifactWorker`.
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    image = ax.imshow(confusion, interpolation='nearest', cmap='Blues')
+    ax.set_title(title)
+    fig.colorbar(image)
+    tick_marks = np.arange(len(confusion))
+    ax.set_xticks(tick_marks, tick_marks, rotation=45)
+    ax.set_yticks(tick_marks, tick_marks)
+    ax.set_xlabel('Predicted')
+    ax.set_ylabel('True')
+    thresh = confusion.max() / 2.
+    for i, j in np.ndindex(confusion.shape):
+        ax.text(j, i, format(confusion[i, j], 'd'), horizontalalignment="center",
+                color="white" if confusion[i, j] > thresh else "black")
+    fig.tight_layout()
+    fig.savefig(output_file)
+
+
+class ArtifactWorker:
+    """
+    Esegue il salvataggio degli artefatti (grafici) in un thread dedicato, fuori dal ciclo di training.
+
+    Un solo lavoro alla volta: se ne arriva uno nuovo mentre il precedente è in corso, resta in
+    attesa solo il più recente (i grafici intermedi superati vengono saltati).
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.RLock()
+        self._running = None
+        self._pending = None
+        self.submitted = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def submit(self, fn, *args):
+        """Accoda `fn(*args)` (es. `render_confusion_matrix`); `args` non devono essere modificati dopo."""
+        with self._lock:
+            self.submitted += 1
+            if self._running is not None and not self._running.done():
+                if self._pending is not None:
+                    self.skipped += 1
+                self._pending = (fn, args)
+                return
+            self._start(fn, args)
+
+    def _start(self, fn, args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifacts")
+        self._running = self._executor.submit(fn, *args)
+        self._running.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            if future.exception() is not None:
+                self.errors += 1
+                print(f"⚠️ Salvataggio dell'artefatto fallito: {future.exception()}")
+            if self._pending is not None and future is self._running:
+                fn, args = self._pending
+                self._pending = None
+                self._start(fn, args)
+
+    def close(self):
+        """Attende il lavoro in corso e quello in attesa, poi termina il thread."""
+        with self._lock:
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                self._start(*pending)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ClassificationMetrics:
+    """
+    `compute_metrics` per il Trainer: accuracy, precision, recall e F1 pesati calcolati dalla
+    confusion matrix in NumPy.
+
+    Con `batch_eval_metrics=True` nei TrainingArguments le confusion matrix dei batch vengono
+    sommate e le metriche restituite all'ultimo batch, senza accumulare tutti i logit.
+
+    Args:
+        num_labels (int): Numero di classi.
+        artifact_worker (ArtifactWorker): Se presente, la confusion matrix di ogni valutazione
+            viene salvata in `output_file` dal processo del worker.
+        output_file (str): File della confusion matrix.
+    """
+
+    def __init__(self, num_labels=2, artifact_worker=None, output_file="confusion_matrix.png"):
+        self.num_labels = num_labels
+        self.artifact_worker = artifact_worker
+        self.output_file = output_file
+        self.confusion = np.zeros((num_labels, num_labels), dtype=np.int64)
+
+    def __call__(self, eval_pred, compute_result=None):
+        predictions, labels = eval_pred.predictions, eval_pred.label_ids
+        if isinstance(predictions, tuple):
+            predictions = predictions[0]
+        if hasattr(predictions, "detach"):  # tensori con batch_eval_metrics
+            predictions = predictions.argmax(dim=-1).cpu().numpy()
+            labels = labels.cpu().numpy()
+        else:
+            predictions = np.argmax(predictions, axis=-1)
+        self.confusion += confusion_counts(labels, predictions, self.num_labels)
+        if compute_result is False:
+            return {}
+        confusion, self.confusion = self.confusion, np.zeros_like(self.confusion)
+        if self.artifact_worker is not None:
+            self.artifact_worker.submit(render_confusion_matrix, confusion, self.output_file)
+        return metrics_from_confusion(confusion)
+
+
+class EvalTimeCallback(TrainerCallback):
+    """
+    Somma la durata (`eval_runtime`) delle valutazioni fatte durante `trainer.train()`; le
+    valutazioni chiamate dopo il training (es. la validazione completa finale) non vengono contate.
+    """
+
+    def __init__(self):
+        self.eval_time = 0.0
+        self.evaluations = 0
+        self._training = False
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.eval_time = 0.0
+        self.evaluations = 0
+        self._training = True
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self._training = False
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        if not self._training or not metrics:
+            return
+        runtime = next((value for key, value in metrics.items() if key.endswith("_runtime")), None)
+        if runtime is not None:
+            self.eval_time += runtime
+            self.evaluations += 1
+
+    def summary(self, train_runtime):
+        """Riepilogo stampabile: valutazioni, tempo e quota sul tempo di training."""
+        share = self.eval_time / train_runtime if train_runtime else 0.0
+        return (f"{self.evaluations} valutazioni durante il training: {self.eval_time:.1f}s "
+                f"({share:.1%} di {train_runtime:.1f}s)")
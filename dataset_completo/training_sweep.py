@@ -0,0 +1,114 @@
+"""
+Sweep di fine-tuning sulle dimensioni del training set (train_1000, train_2000, ...), con ripresa.
+
+I driver delle isole (isola_classificazione_distilbert/distilbert_sweep.py e
+isola_esperimento_llm/lora_sweep.py) caricano modello base e dati una sola volta e passano a
+`run_sweep` una funzione che addestra, valuta e salva il modello per una dimensione. Dopo ogni
+dimensione completata lo stato viene scritto su un file JSON: se il processo si interrompe, la
+ripartenza salta le dimensioni già finite e riprende dai checkpoint solo la dimensione che lo
+sweep stesso aveva avviato; negli altri casi la cartella dei checkpoint viene svuotata.
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+
+import pandas as pd
+
+# Dimensioni usate per le curve di comparison.py
+DEFAULT_SIZES = (1000, 2000, 5000, 9000)
+
+
+def read_state(state_file):
+    """
+    Stato dello sweep (`{"completed": {dimensione: risultati}, "started": [dimensioni]}`), vuoto
+    se il file non esiste.
+    """
+    if not os.path.exists(state_file):
+        return {"completed": {}, "started": []}
+    with open(state_file) as f:
+        state = json.load(f)
+    state.setdefault("started", [])
+    return state
+
+
+def write_state(state_file, state):
+    """Scrive lo stato in modo atomico (un crash durante la scrittura non lo corrompe)."""
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp_file, state_file)
+
+
+def run_sweep(sizes, train_size, state_file, checkpoint_dir, force=False):
+    """
+    Esegue `train_size(size, resume)` per ogni dimensione non ancora completata.
+
+    Una dimensione riprende dai checkpoint (`resume=True`) solo se lo stato la registra come
+    avviata e non completata; altrimenti la sua cartella dei checkpoint viene eliminata prima del
+    training, così un checkpoint di un'altra esecuzione (notebook, sweep precedente, `force`)
+    non viene scambiato per un training interrotto.
+
+    Args:
+        sizes (list): Dimensioni del training set, nell'ordine di esecuzione.
+        train_size (callable): Addestra e salva il modello per una dimensione; restituisce la riga
+            di training_comparison.csv (vedi `training_results`).
+        state_file (str): File JSON con le dimensioni avviate e completate.
+        checkpoint_dir (callable): Dimensione -> `output_dir` del Trainer, riservata allo sweep.
+        force (bool): Se True ripete anche le dimensioni già completate.
+
+    Returns:
+        dict: Dimensione -> risultati, per tutte le dimensioni completate.
+    """
+    state = {"completed": {}, "started": []} if force else read_state(state_file)
+    completed, started = state["completed"], state["started"]
+    for size in sizes:
+        if str(size) in completed:
+            print(f"⏭️ train_{size} già completato ({state_file}), saltato")
+            continue
+        resume = str(size) in started
+        if not resume:
+            shutil.rmtree(checkpoint_dir(size), ignore_errors=True)
+            started.append(str(size))
+            write_state(state_file, state)
+        print(f"\n🚀 Fine-tuning su train_{size}" + (" (ripresa dall'ultimo checkpoint)" if resume else ""))
+        completed[str(size)] = train_size(size, resume)
+        started.remove(str(size))
+        write_state(state_file, state)
+    return {int(size): results for size, results in completed.items() if int(size) in set(sizes)}
+
+
+def training_results(num_val, trainer_stats, eval_results, validation_metrics=False, eval_time=None):
+    """
+    Riga di training_comparison.csv, con le stesse colonne scritte dai notebook.
+
+    Args:
+        num_val (int): Dimensione del training set.
+        trainer_stats: Output di `trainer.train()`.
+        eval_results (dict): Output di `trainer.evaluate()`.
+        validation_metrics (bool): Aggiunge accuracy e F1 di validazione (classificatore DistilBERT).
+        eval_time (float): Secondi spesi nelle valutazioni durante il training (`EvalTimeCallback`
+            di training_eval.py); aggiunge il tempo e la quota sul tempo di training.
+    """
+    results = {
+        "Dataset Size": num_val,  # Numero di dati usati per il fine-tuning
+        "Training Loss": trainer_stats.training_loss,  # Training Loss
+        "Train Time (s)": trainer_stats.metrics["train_runtime"],  # Tempo di addestramento
+        "Steps": trainer_stats.global_step,  # Numero di passi (steps)
+        "Samples/sec": trainer_stats.metrics["train_samples_per_second"],  # Campioni al secondo
+        "Steps/sec": trainer_stats.metrics["train_steps_per_second"],  # Passi al secondo
+        "Validation Loss": eval_results.get("eval_loss", None),  # Valutazione della loss
+    }
+    if validation_metrics:
+        results["Validation Accuracy"] = eval_results.get("eval_accuracy", None)
+        results["Validation F1"] = eval_results.get("eval_f1", None)
+    if eval_time is not None:
+        results["Eval Time (s)"] = eval_time  # Valutazioni periodiche durante il training
+        results["Eval Share"] = eval_time / results["Train Time (s)"]  # Quota del tempo di training
+    return results
+
+
+def save_training_results(results_file, results):
+    """Salva la riga di risultati in `results_file` (sovrascrivendolo), creando la cartella."""
+    Path(results_file).parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame([results]).to_csv(results_file, index=False)
@@ -0,0 +1,108 @@
+"""
+Caricamento, inferenza e metriche del classificatore DistilBERT (fast/slow), condivisi da eval.ipynb,
+distilbert_sweep.py, inference_server.py e quantization.py.
+"""
+import os
+
+import torch
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+ID2LABEL = {0: "fast", 1: "slow"}
+LABEL2ID = {"fast": 0, "slow": 1}
+
+# Campi del bug report concatenati nel testo di input del classificatore
+TEXT_FIELDS = ['source', 'product', 'short_desc', 'priority', 'bug_severity']
+
+
+def concatenate_fields(example):
+    """Aggiunge a `example` il campo `text`: source, product, short_desc, priority e severity concatenati."""
+    fields_to_concat = [example[field] for field in TEXT_FIELDS]
+    example['text'] = ' '.join([str(field) for field in fields_to_concat if field])
+    return example
+
+
+# Funzione per caricare il modello
+def load_model(model_name, fine_tuned=False, fine_tuned_path=None, device="cuda"):
+    """
+    Carica un modello pre-addestrato o fine-tunato per la classificazione.
+
+    :param model_name: Nome del modello pre-addestrato (es. 'distilbert-base-uncased')
+    :param fine_tuned: Booleano, se True carica il modello fine-tunato
+    :param fine_tuned_path: Percorso del modello fine-tunato
+    :param device: Dispositivo su cui caricare il modello ('cuda' o 'cpu')
+    :return: Modello e tokenizer
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    hf_token = os.getenv("HF_TOKEN")
+    if fine_tuned and fine_tuned_path and os.path.exists(fine_tuned_path):
+        print(f"Loading fine-tuned model from: {fine_tuned_path}")
+        model = AutoModelForSequenceClassification.from_pretrained(
+            fine_tuned_path, num_labels=2, id2label=ID2LABEL, label2id=LABEL2ID
+        )
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+    else:
+        print(f"Loading base model: {model_name}")
+        model = AutoModelForSequenceClassification.from_pretrained(
+            model_name, num_labels=2, id2label=ID2LABEL, label2id=LABEL2ID, token=hf_token
+        )
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    device = torch.device(device if torch.cuda.is_available() else "cpu")
+    model.to(device)
+    print(f"📌 Model loaded on: {device}")
+
+    return model, tokenizer
+
+
+def predict_texts(model, tokenizer, texts, max_length=512):
+    """
+    Classifica un batch di testi (padding al più lungo del batch).
+
+    :return: Classi predette (0 = fast, 1 = slow) e probabilità della classe `slow`.
+    """
+    inputs = tokenizer(texts, return_tensors="pt", truncation=True, padding=True,
+                       max_length=max_length).to(model.device)
+    with torch.no_grad():
+        probabilities = torch.softmax(model(**inputs).logits.float(), dim=-1)
+    return probabilities.argmax(dim=-1).tolist(), probabilities[:, 1].tolist()
+
+
+# Funzione per calcolare le metriche
+def calculate_metrics(true_labels, predictions):
+    """
+    Calcola accuracy, precision, recall e F1-score tramite la libreria sklearn.
+    """
+    return {
+        'accuracy': accuracy_score(true_labels, predictions),
+        'precision': precision_score(true_labels, predictions, average='binary', zero_division=0),
+        'recall': recall_score(true_labels, predictions, average='binary', zero_division=0),
+        'f1': f1_score(true_labels, predictions, average='binary', zero_division=0)
+    }
+
+
+def save_confusion_matrix(true_labels, predictions, path):
+    """Salva la matrice di confusione (heatmap 0/1) come in eval.ipynb."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from sklearn.metrics import confusion_matrix
+
+    cm = confusion_matrix(true_labels, predictions, labels=[0, 1])
+    plt.figure(figsize=(6, 4))
+    sns.heatmap(cm, annot=True, fmt="d", cmap="Blues", xticklabels=['0', '1'], yticklabels=['0', '1'])
+    plt.title('Confusion Matrix')
+    plt.xlabel('Predicted')
+    plt.ylabel('True')
+    plt.savefig(path, format="png")
+    plt.close()
+
+
+def texts_from_frame(df):
+    """
+    Testi `concatenate_fields` delle righe di un DataFrame letto dal manifest (es. `load_split`).
+    Come in `load_hf_splits`, le categorie mancanti diventano None e vengono saltate nel testo.
+    """
+    fields = {col: df[col].astype(object).where(df[col].notna(), None).tolist() for col in TEXT_FIELDS}
+    return [concatenate_fields(dict(zip(TEXT_FIELDS, values)))['text'] for values in zip(*fields.values())]
@@ -0,0 +1,170 @@
+"""
+Sweep di fine-tuning di DistilBERT su train_1000/2000/5000/9000: lo stesso training di ft.ipynb,
+senza rieseguire il notebook per ogni `num_val`.
+
+Tokenizer, modello pre-addestrato e dati vengono caricati una sola volta (la tokenizzazione passa
+dalla `TokenCache`, quindi i dataset annidati non vengono ritokenizzati). Per ogni dimensione il
+modello riparte da una copia in memoria dei pesi pre-addestrati, con la stessa testa di
+classificazione inizializzata a caso, senza rileggerli dal disco. Per ogni dimensione vengono
+scritti `<modello>_fine_tuned_on_<n>/training_comparison.csv` (formato letto da comparison.py) e
+`fine_tuned_model_<modello>_<n>`; lo sweep riprende dall'ultima dimensione completata
+(`distilbert_sweep_state.json`) e, dentro una dimensione avviata dallo sweep, dall'ultimo
+checkpoint del Trainer (in `<modello>_<n>_sweep`, separata da `<modello>_<n>_ft` di ft.ipynb).
+Le valutazioni ogni `eval_steps` usano un sottoinsieme stratificato della validazione, quella
+completa viene fatta alla fine (vedi training_eval.py); training_comparison.csv riporta anche il
+tempo speso nelle valutazioni.
+
+Uso (dalla cartella isola_classificazione_distilbert):
+    python distilbert_sweep.py --sizes 1000 2000 5000 9000
+"""
+import argparse
+import copy
+import gc
+import os
+import sys
+
+import torch
+from transformers import (
+    AutoModelForSequenceClassification,
+    AutoTokenizer,
+    DataCollatorWithPadding,
+    Trainer,
+    TrainingArguments,
+)
+from transformers.trainer_utils import get_last_checkpoint
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from dataset_io import load_hf_splits  # noqa: E402
+from token_cache import TokenCache  # noqa: E402
+from training_eval import DEFAULT_EVAL_SUBSAMPLE, ClassificationMetrics, EvalTimeCallback, eval_subsample  # noqa: E402
+from training_sweep import DEFAULT_SIZES, run_sweep, save_training_results, training_results  # noqa: E402
+from length_batching import LengthGroupedTrainer, add_lengths  # noqa: E402
+from classifier import ID2LABEL, LABEL2ID, concatenate_fields  # noqa: E402
+
+
+def load_sweep_data(tokenizer, sizes, balanced_dir, length_batching=True):
+    """Split `train_<n>` di tutte le dimensioni e `val`, già tokenizzati (una volta sola)."""
+    splits = {f"train_{size}": f"train_{size}" for size in sizes}
+    splits["val"] = "validation"
+    dataset = load_hf_splits(splits, balanced_dir=balanced_dir,
+                             columns=['source', 'product', 'short_desc', 'priority', 'bug_severity', 'label'])
+    dataset = dataset.map(concatenate_fields)
+    dataset = dataset.remove_columns(['product', 'short_desc', 'priority', 'bug_severity', 'source'])
+
+    token_cache = TokenCache(tokenizer, max_length=512)
+    padding = False if length_batching else "max_length"
+    dataset = dataset.map(lambda examples: token_cache(examples["text"], padding=padding), batched=True)
+    dataset = dataset.remove_columns(["text"])
+    if length_batching:
+        dataset = dataset.map(add_lengths, batched=True)
+    dataset.set_format("torch")
+    print(f"Token cache: {token_cache.hits} testi già in cache, {token_cache.misses} tokenizzati")
+    return dataset
+
+
+def run_distilbert_sweep(sizes=DEFAULT_SIZES, model_name='distilbert-base-uncased',
+                         balanced_dir="../dataset_completo/balanced_datasets", length_batching=True, max_tokens=4096,
+                         num_train_epochs=5, eval_subsample_size=DEFAULT_EVAL_SUBSAMPLE,
+                         state_file="distilbert_sweep_state.json", force=False):
+    """
+    Addestra un classificatore per ogni dimensione del training set.
+
+    :param sizes: Dimensioni del training set (split `train_<n>` del manifest).
+    :param model_name: Modello pre-addestrato (nome su Hugging Face o cartella locale).
+    :param balanced_dir: Cartella dei dataset bilanciati.
+    :param length_batching: Batch per lunghezza con padding dinamico (vedi length_batching.py).
+    :param max_tokens: Budget di token per batch con `length_batching`.
+    :param num_train_epochs: Epoche di training.
+    :param eval_subsample_size: Esempi di validazione per le valutazioni durante il training
+        (None = validazione completa).
+    :param state_file: File con le dimensioni completate (ripresa dopo un crash).
+    :param force: Ripete anche le dimensioni già completate.
+    :return: Dimensione -> riga di training_comparison.csv.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    pretrained = AutoModelForSequenceClassification.from_pretrained(
+        model_name, num_labels=2, id2label=ID2LABEL, label2id=LABEL2ID)
+    if tokenizer.pad_token is None:
+        tokenizer.add_special_tokens({'pad_token': '[PAD]'})
+        pretrained.resize_token_embeddings(len(tokenizer))
+    dataset = load_sweep_data(tokenizer, sizes, balanced_dir, length_batching)
+    name = os.path.basename(os.path.normpath(model_name))
+    val_subsample = eval_subsample(dataset["val"], eval_subsample_size)
+
+    def checkpoint_dir(size):
+        return f"{name}_{size}_sweep"
+
+    def train_size(size, resume):
+        model = copy.deepcopy(pretrained)
+        model.train()
+        training_args = TrainingArguments(
+            output_dir=checkpoint_dir(size),
+            learning_rate=2e-5,
+            per_device_train_batch_size=8,
+            per_device_eval_batch_size=8,
+            num_train_epochs=num_train_epochs,
+            weight_decay=0.01,
+            evaluation_strategy="steps",
+            eval_steps=100,
+            save_strategy="steps",
+            save_steps=1000,
+            save_total_limit=3,
+            lr_scheduler_type="cosine",
+            load_best_model_at_end=True,
+            logging_steps=50,
+            metric_for_best_model="eval_loss",
+            greater_is_better=False,
+        )
+        eval_timer = EvalTimeCallback()
+        trainer_kwargs = dict(model=model, args=training_args, train_dataset=dataset[f"train_{size}"],
+                              eval_dataset=val_subsample, tokenizer=tokenizer, compute_metrics=ClassificationMetrics(),
+                              callbacks=[eval_timer])
+        if length_batching:
+            trainer = LengthGroupedTrainer(**trainer_kwargs, data_collator=DataCollatorWithPadding(tokenizer),
+                                           max_tokens=max_tokens)
+        else:
+            trainer = Trainer(**trainer_kwargs)
+
+        last_checkpoint = get_last_checkpoint(training_args.output_dir) \
+            if resume and os.path.isdir(training_args.output_dir) else None
+        trainer_stats = trainer.train(resume_from_checkpoint=last_checkpoint)
+        print(eval_timer.summary(trainer_stats.metrics["train_runtime"]))
+        eval_results = trainer.evaluate(dataset["val"])  # validazione completa
+
+        results = training_results(size, trainer_stats, eval_results, validation_metrics=True,
+                                   eval_time=eval_timer.eval_time)
+        save_training_results(f"{name}_fine_tuned_on_{size}/training_comparison.csv", results)
+        model.save_pretrained(f"./fine_tuned_model_{name}_{size}")
+        tokenizer.save_pretrained(f"./fine_tuned_model_{name}_{size}")
+        print(results)
+
+        del trainer, model
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return results
+
+    return run_sweep(sizes, train_size, state_file, checkpoint_dir, force)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="Dimensioni del training set")
+    parser.add_argument('--model-name', default='distilbert-base-uncased', help="Modello pre-addestrato")
+    parser.add_argument('--balanced-dir', default="../dataset_completo/balanced_datasets", help="Dataset bilanciati")
+    parser.add_argument('--epochs', type=int, default=5, help="Epoche di training")
+    parser.add_argument('--max-tokens', type=int, default=4096, help="Budget di token per batch")
+    parser.add_argument('--eval-subsample', type=int, default=DEFAULT_EVAL_SUBSAMPLE,
+                        help="Esempi di validazione per le valutazioni durante il training (0 = tutti)")
+    parser.add_argument('--no-length-batching', action='store_true', help="Batch da 8 con padding a 512")
+    parser.add_argument('--state-file', default="distilbert_sweep_state.json", help="Stato per la ripresa")
+    parser.add_argument('--force', action='store_true', help="Ripete anche le dimensioni completate")
+    args = parser.parse_args()
+
+    run_distilbert_sweep(args.sizes, args.model_name, args.balanced_dir, not args.no_length_batching, args.max_tokens,
+                         args.epochs, args.eval_subsample or None, args.state_file, args.force)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+Modalità di training alternativa al fine-tuning: encoder DistilBERT congelato e teste leggere.
+
+1. Ogni riga del dataset unificato usata dagli split (o tutte, con `--all-rows`) viene codificata
+   una sola volta dall'encoder congelato; l'embedding aggregato (media sui token o `[CLS]`) viene
+   salvato in una matrice float16 in memory-map indicizzata dall'id di riga del manifest
+   (`<balanced_dir>/embeddings/<chiave>/embeddings.npy`, con la maschera `encoded.npy` delle righe
+   già codificate). La codifica riprende dalle righe mancanti se viene interrotta.
+2. Per ogni dimensione del training set (`train_<n>` del manifest o qualsiasi altra dimensione,
+   vedi `subset_ids`) viene addestrata in pochi secondi su CPU una testa: regressione logistica
+   (`logreg`) o un piccolo MLP (`mlp`), sugli embedding standardizzati.
+3. I risultati sono scritti come quelli del fine-tuning in
+   `<model_name>-frozen-<testa>_fine_tuned_on_<n>/`: metrics.csv (test, `calculate_metrics`),
+   avg_system_metrics.csv e training_comparison.csv, così comparison.py disegna le curve di
+   scaling anche per molte dimensioni. Sul test set le predizioni e le metriche di sistema
+   seguono il percorso completo di inferenza (tokenizzazione, encoder, aggregazione, testa),
+   confrontabile con i modelli fine-tuned; la matrice serve solo per training e validazione.
+
+Esempio:
+    python embedding_heads.py --heads logreg mlp --sizes 250 500 1000 2000 3000 5000 7000 9000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from classifier import TEXT_FIELDS, calculate_metrics, load_model, texts_from_frame  # noqa: E402
+from dataset_io import load_rows, read_manifest  # noqa: E402
+from long_text import model_fingerprint  # noqa: E402
+from system_profiler import BatchProfiler  # noqa: E402
+from token_batches import token_budget_batches  # noqa: E402
+from token_cache import TokenCache  # noqa: E402
+from training_sweep import DEFAULT_SIZES, save_training_results, training_results  # noqa: E402
+
+POOLINGS = ("mean", "cls")
+HEADS = ("logreg", "mlp")
+
+
+class EmbeddingStore:
+    """
+    Matrice float16 (righe del dataset unificato x dimensione dell'embedding) in memory-map.
+
+    La cartella è identificata da impronta del modello, aggregazione, `max_length` e dalla tabella
+    a cui si riferiscono gli id: se il dataset unificato viene rigenerato si usa una nuova cartella.
+
+    :param directory: Cartella della matrice.
+    :param rows: Righe del dataset unificato (`source_rows` del manifest).
+    :param dim: Dimensione dell'embedding.
+    :param meta: Descrizione salvata in meta.json alla creazione (modello, aggregazione, tabella).
+    """
+
+    def __init__(self, directory, rows, dim, meta=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        embeddings_file = os.path.join(directory, "embeddings.npy")
+        encoded_file = os.path.join(directory, "encoded.npy")
+        if os.path.exists(embeddings_file):
+            self.embeddings = np.load(embeddings_file, mmap_mode="r+")
+            self.encoded = np.load(encoded_file, mmap_mode="r+")
+        else:
+            self.embeddings = np.lib.format.open_memmap(embeddings_file + ".tmp", mode="w+", dtype=np.float16,
+                                                        shape=(rows, dim))
+            self.encoded = np.lib.format.open_memmap(encoded_file, mode="w+", dtype=bool, shape=(rows,))
+            self.encoded.flush()
+            # La matrice diventa visibile solo dopo la maschera (tutta a False)
+            os.replace(embeddings_file + ".tmp", embeddings_file)
+            self.embeddings = np.load(embeddings_file, mmap_mode="r+")
+            with open(os.path.join(directory, "meta.json"), "w") as f:
+                json.dump(meta or {}, f, indent=2)
+
+    def missing(self, ids):
+        """Id (senza duplicati) non ancora codificati."""
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        return ids[~self.encoded[ids]]
+
+    def write(self, ids, embeddings):
+        """Salva gli embedding di `ids`; la maschera viene aggiornata dopo i dati."""
+        self.embeddings[ids] = embeddings.astype(np.float16)
+        self.embeddings.flush()
+        self.encoded[ids] = True
+        self.encoded.flush()
+
+    def __getitem__(self, ids):
+        """Embedding (float32) delle righe `ids`."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not self.encoded[ids].all():
+            raise KeyError(f"{int((~self.encoded[ids]).sum())} righe non ancora codificate in {self.directory}")
+        return np.asarray(self.embeddings[ids], dtype=np.float32)
+
+
+def open_store(model, tokenizer, balanced_dir, pooling="mean", max_length=512):
+    """`EmbeddingStore` del modello per il dataset unificato del manifest in `balanced_dir`."""
+    meta, _ = read_manifest(balanced_dir)
+    key = f"{model_fingerprint(model, tokenizer)[:16]}_{pooling}_{max_length}_{meta['source_bytes']}"
+    store_meta = {"source_table": meta["source_table"], "source_bytes": meta["source_bytes"],
+                  "model": model.config.name_or_path, "pooling": pooling, "max_length": max_length}
+    return EmbeddingStore(os.path.join(balanced_dir, "embeddings", key), meta["source_rows"],
+                          model.config.dim if hasattr(model.config, "dim") else model.config.hidden_size, store_meta)
+
+
+def pool_hidden_states(hidden_states, attention_mask, pooling="mean"):
+    """Embedding di una sequenza: media sui token non di padding o stato del token `[CLS]`."""
+    if pooling == "cls":
+        return hidden_states[:, 0]
+    mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+    return (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+
+def embed_texts(model, tokenizer, texts, pooling="mean", max_length=512):
+    """
+    Embedding di testi grezzi come in inferenza: tokenizzazione, encoder congelato e aggregazione.
+    I valori passano per float16 come quelli della matrice, così le predizioni coincidono.
+    """
+    inputs = tokenizer(texts, truncation=True, max_length=max_length, padding=True, return_tensors="pt").to(model.device)
+    with torch.no_grad():
+        hidden_states = model.base_model(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"]).last_hidden_state
+        embeddings = pool_hidden_states(hidden_states, inputs["attention_mask"], pooling).float().cpu().numpy()
+    return embeddings.astype(np.float16).astype(np.float32)
+
+
+def encode_rows(model, tokenizer, store, ids, balanced_dir, pooling="mean", max_length=512, max_tokens=16384,
+                chunk_size=20000):
+    """
+    Codifica con l'encoder congelato le righe di `ids` non ancora nella matrice.
+
+    Le righe vengono lette dal dataset unificato a blocchi di `chunk_size`; ogni blocco è salvato
+    appena codificato, quindi un'interruzione perde al massimo un blocco.
+
+    :return: Numero di righe codificate.
+    """
+    missing = store.missing(ids)
+    if not len(missing):
+        return 0
+    encoder = model.base_model.eval()
+    token_cache = TokenCache(tokenizer, max_length=max_length)
+    print(f"Codifica di {len(missing)} righe con l'encoder congelato ({pooling})")
+    for start in range(0, len(missing), chunk_size):
+        chunk = missing[start:start + chunk_size]
+        encoded = token_cache.encode(texts_from_frame(load_rows(chunk, balanced_dir, columns=TEXT_FIELDS)))
+        embeddings = np.zeros((len(chunk), store.embeddings.shape[1]), dtype=np.float32)
+        for batch in token_budget_batches([len(ids) for ids in encoded], max_tokens):
+            inputs = tokenizer.pad({"input_ids": [encoded[i].tolist() for i in batch]},
+                                   return_tensors="pt").to(model.device)
+            with torch.no_grad():
+                hidden_states = encoder(**inputs).last_hidden_state
+                embeddings[batch] = pool_hidden_states(hidden_states, inputs["attention_mask"],
+                                                       pooling).float().cpu().numpy()
+        store.write(chunk, embeddings)
+        print(f"  {min(start + chunk_size, len(missing))}/{len(missing)}")
+    return len(missing)
+
+
+def subset_ids(size, balanced_dir, seed=42):
+    """
+    Id di un training set di `size` righe.
+
+    Se il manifest contiene `train_<size>` si usa quello; altrimenti si prende dal training set
+    più grande un sottoinsieme bilanciato per (source, label) e annidato come gli split del
+    manifest: prima le righe dei training set più piccoli, poi le altre in ordine casuale fisso.
+    """
+    meta, archive = read_manifest(balanced_dir)
+    if f"train_{size}" in meta["splits"]:
+        return np.asarray(archive[f"train_{size}"], dtype=np.int64)
+    train_splits = sorted((s for s in meta["splits"] if s.startswith("train_")), key=lambda s: int(s[len("train_"):]))
+    largest = np.asarray(archive[train_splits[-1]], dtype=np.int64)
+    if size > len(largest):
+        raise ValueError(f"{size} righe richieste, ma il training set più grande ({train_splits[-1]}) ne ha "
+                         f"{len(largest)}")
+
+    rank = np.full(len(largest), len(train_splits))
+    position = {row: i for i, row in enumerate(largest.tolist())}
+    for r, split in reversed(list(enumerate(train_splits))):
+        rank[[position[row] for row in archive[split].tolist()]] = r
+    order = np.lexsort((np.random.default_rng([seed, 0]).random(len(largest)), rank))
+
+    groups = load_rows(largest, balanced_dir, columns=["source", "label"])
+    keys = (groups["source"].astype(str) + "|" + groups["label"].astype(str)).to_numpy()[order]
+    names = np.unique(keys)
+    quotas = dict(zip(names, np.full(len(names), size // len(names)) + (np.arange(len(names)) < size % len(names))))
+    selected, rest = [], []
+    for i, key in zip(order, keys):
+        if quotas[key] > 0:
+            selected.append(i)
+            quotas[key] -= 1
+        else:
+            rest.append(i)
+    # Gruppi troppo piccoli per la loro quota: si completa con le righe successive nell'ordine
+    selected += rest[:size - len(selected)]
+    return np.random.default_rng([seed, size]).permutation(largest[selected])
+
+
+def make_head(head, seed=42):
+    """Testa di classificazione sugli embedding standardizzati."""
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.neural_network import MLPClassifier
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    if head == "logreg":
+        classifier = LogisticRegression(max_iter=2000)
+    elif head == "mlp":
+        classifier = MLPClassifier(hidden_layer_sizes=(256,), early_stopping=True, max_iter=200, random_state=seed)
+    else:
+        raise ValueError(f"Testa '{head}' non valida. Disponibili: {HEADS}")
+    return make_pipeline(StandardScaler(), classifier)
+
+
+def train_head(head, store, size, split_ids, labels, balanced_dir, model_name, embed, test_texts, seed=42,
+               batch_size=8):
+    """
+    Addestra una testa su `size` righe e salva metrics.csv, avg_system_metrics.csv e
+    training_comparison.csv come il fine-tuning.
+
+    :param split_ids: Id di `validation` e `test`.
+    :param labels: Etichette indicizzate per id di riga.
+    :param embed: Funzione `testi -> embedding` (vedi `embed_texts`), misurata sul test set insieme alla testa.
+    :param test_texts: Testi del test set, nell'ordine di `split_ids["test"]`.
+    :param batch_size: Dimensione dei batch di predizione sul test set (come eval.ipynb).
+    :return: Riga di training_comparison.csv.
+    """
+    from sklearn.metrics import accuracy_score, f1_score, log_loss
+
+    train_ids = subset_ids(size, balanced_dir, seed)
+    x_train, y_train = store[train_ids], labels[train_ids]
+    pipeline = make_head(head, seed)
+    start = time.perf_counter()
+    pipeline.fit(x_train, y_train)
+    train_time = time.perf_counter() - start
+    classifier = pipeline[-1]
+    steps = int(np.max(classifier.n_iter_))
+
+    x_val, y_val = store[split_ids["validation"]], labels[split_ids["validation"]]
+    val_probabilities = pipeline.predict_proba(x_val)
+    val_predictions = val_probabilities.argmax(axis=1)
+    trainer_stats = SimpleNamespace(
+        training_loss=log_loss(y_train, pipeline.predict_proba(x_train), labels=[0, 1]),
+        global_step=steps,
+        metrics={"train_runtime": train_time, "train_samples_per_second": len(train_ids) * steps / train_time,
+                 "train_steps_per_second": steps / train_time},
+    )
+    eval_results = {"eval_loss": log_loss(y_val, val_probabilities, labels=[0, 1]),
+                    "eval_accuracy": accuracy_score(y_val, val_predictions),
+                    "eval_f1": f1_score(y_val, val_predictions, average="weighted")}
+    results = training_results(size, trainer_stats, eval_results, validation_metrics=True)
+
+    # Inferenza come in produzione: testo grezzo -> encoder congelato -> testa, non gli embedding in cache
+    test_ids = split_ids["test"]
+    predictions = []
+    with BatchProfiler() as profiler:
+        for batch_idx, start in enumerate(range(0, len(test_ids), batch_size)):
+            batch = test_texts[start:start + batch_size]
+            with profiler.batch(len(batch), batch_idx):
+                predictions.extend(pipeline.predict(embed(batch)).tolist())
+    metrics = calculate_metrics(labels[test_ids], predictions)
+
+    output_dir = f"{model_name}-frozen-{head}_fine_tuned_on_{size}"
+    os.makedirs(output_dir, exist_ok=True)
+    pd.DataFrame([metrics]).to_csv(os.path.join(output_dir, "metrics.csv"), index=False)
+    profiler.save(output_dir)
+    save_training_results(os.path.join(output_dir, "training_comparison.csv"), results)
+    print(f"{head} su {size} righe: {train_time:.2f}s di training | accuracy {metrics['accuracy']:.4f}, "
+          f"f1 {metrics['f1']:.4f} (validazione {eval_results['eval_accuracy']:.4f})")
+    return results
+
+
+def run_heads(model_name, sizes, heads=("logreg",), balanced_dir="../dataset_completo/balanced_datasets",
+              fine_tuned_path=None, pooling="mean", max_length=512, max_tokens=16384, all_rows=False, seed=42):
+    """
+    Codifica le righe necessarie (una volta sola) e addestra ogni testa per ogni dimensione.
+
+    :param fine_tuned_path: Checkpoint da cui prendere l'encoder (default: il modello pre-addestrato).
+    :param all_rows: Codifica tutto il dataset unificato invece delle sole righe degli split.
+    """
+    model, tokenizer = load_model(model_name, fine_tuned=fine_tuned_path is not None,
+                                  fine_tuned_path=fine_tuned_path, device="cuda")
+    store = open_store(model, tokenizer, balanced_dir, pooling, max_length)
+    meta, archive = read_manifest(balanced_dir)
+    needed = np.arange(meta["source_rows"]) if all_rows else \
+        np.unique(np.concatenate([archive[split] for split in meta["splits"]]))
+    start = time.perf_counter()
+    encoded = encode_rows(model, tokenizer, store, needed, balanced_dir, pooling, max_length, max_tokens)
+    if encoded:
+        print(f"{encoded} righe codificate in {time.perf_counter() - start:.1f}s -> {store.directory}")
+
+    labels = np.zeros(meta["source_rows"], dtype=np.int64)
+    labels[needed] = load_rows(needed, balanced_dir, columns=["label"])["label"].to_numpy()
+    split_ids = {split: np.asarray(archive[split], dtype=np.int64) for split in ("validation", "test")}
+    test_texts = texts_from_frame(load_rows(split_ids["test"], balanced_dir, columns=TEXT_FIELDS))
+    model.eval()
+
+    def embed(texts):
+        return embed_texts(model, tokenizer, texts, pooling, max_length)
+
+    results = {(head, size): train_head(head, store, size, split_ids, labels, balanced_dir, model_name, embed,
+                                        test_texts, seed)
+               for head in heads for size in sizes}
+    del model
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste leggere su embedding congelati di DistilBERT per molte "
+                                                 "dimensioni del training set.")
+    parser.add_argument("--model-name", default="distilbert-base-uncased")
+    parser.add_argument("--fine-tuned-path", default=None, help="Checkpoint da cui prendere l'encoder.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--heads", nargs="+", choices=HEADS, default=["logreg"])
+    parser.add_argument("--pooling", choices=POOLINGS, default="mean")
+    parser.add_argument("--balanced-dir", default="../dataset_completo/balanced_datasets")
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--max-tokens", type=int, default=16384, help="Budget di token per batch di codifica.")
+    parser.add_argument("--all-rows", action="store_true", help="Codifica tutto il dataset unificato.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    run_heads(args.model_name, args.sizes, args.heads, args.balanced_dir, args.fine_tuned_path, args.pooling,
+              args.max_length, args.max_tokens, args.all_rows, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Baseline classica addestrata su tutto il dataset unificato: TF-IDF su n-grammi con hashing e
+classificatore lineare addestrato in modo incrementale (`SGDClassifier.partial_fit`).
+
+Gli split bilanciati usano al più qualche migliaio di righe, mentre mergeCsv.py produce tutte le
+segnalazioni etichettate. Qui il dataset unificato a cui si riferisce il manifest
+(`merged_processed_labeled`) viene letto a blocchi, escludendo le righe di `validation` e `test`:
+
+1. ogni blocco viene diviso tra `--workers` processi (default: tutti i core) che calcolano le
+   feature con `HashingVectorizer` (n-grammi di parole sul testo `concatenate_fields`, più i
+   commenti con `--comments`), senza vocabolario da tenere in memoria; i blocchi di feature sono
+   salvati su disco insieme alle frequenze di documento per l'IDF;
+2. il classificatore lineare viene addestrato per `--epochs` passate sui blocchi salvati, con pesi
+   di classe bilanciati (le etichette del dataset unificato seguono il 75° percentile, quindi
+   circa un quarto dei bug è `slow`);
+3. sul test del manifest, a batch come eval.ipynb, testo -> feature -> predizione.
+
+I risultati sono scritti come quelli del fine-tuning in `<model_name>_fine_tuned_on_<n>/`
+(metrics.csv, avg_system_metrics.csv, training_comparison.csv), con `n` righe di training, così
+comparison.py li mostra accanto ai transformer come riferimento di throughput e accuratezza.
+
+Esempio:
+    python hashed_baseline.py --balanced-dir ../dataset_completo/balanced_datasets --epochs 3
+    python hashed_baseline.py --comments --model-name hashed-tfidf-sgd-comments
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from classifier import TEXT_FIELDS, calculate_metrics, texts_from_frame  # noqa: E402
+from dataset_io import iter_table_chunks, load_split, read_manifest  # noqa: E402
+from system_profiler import BatchProfiler  # noqa: E402
+from training_sweep import save_training_results, training_results  # noqa: E402
+
+_vectorizer = None
+
+
+def make_vectorizer(n_features=2 ** 20, ngram_max=2):
+    """`HashingVectorizer` senza normalizzazione: conteggi grezzi, TF-IDF applicato dopo."""
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    return HashingVectorizer(n_features=n_features, ngram_range=(1, ngram_max), alternate_sign=False, norm=None,
+                             dtype=np.float32)
+
+
+def _init_worker(n_features, ngram_max):
+    global _vectorizer
+    _vectorizer = make_vectorizer(n_features, ngram_max)
+
+
+def _hash_texts(texts):
+    return _vectorizer.transform(texts)
+
+
+def row_texts(df, comments=False):
+    """Testi `concatenate_fields` delle righe, seguiti dai commenti se `comments`."""
+    texts = texts_from_frame(df)
+    if not comments:
+        return texts
+    extra = df["comments"].astype(object).where(df["comments"].notna(), "").astype(str).tolist()
+    return [f"{text} {comment}" for text, comment in zip(texts, extra)]
+
+
+class FeatureHasher:
+    """
+    Calcola le feature con hashing di liste di testi, in parallelo su `workers` processi.
+
+    Con `workers=1` lavora nel processo corrente (niente serializzazione dei testi).
+    """
+
+    def __init__(self, n_features=2 ** 20, ngram_max=2, workers=None):
+        self.n_features = n_features
+        self.workers = workers or os.cpu_count() or 1
+        self.vectorizer = make_vectorizer(n_features, ngram_max)
+        self.executor = None
+        if self.workers > 1:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                initargs=(n_features, ngram_max))
+
+    def submit(self, texts):
+        """Avvia il calcolo; restituisce una funzione che attende la matrice CSR delle righe di `texts`."""
+        if self.executor is None:
+            matrix = self.vectorizer.transform(texts)
+            return lambda: matrix
+        piece = -(-len(texts) // self.workers)
+        futures = [self.executor.submit(_hash_texts, texts[i:i + piece]) for i in range(0, len(texts), piece)]
+        return lambda: sp.vstack([future.result() for future in futures], format="csr")
+
+    def transform(self, texts):
+        return self.submit(texts)()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def hash_table(hasher, source_table, exclude_ids, spill_dir, comments=False, chunk_size=50000, max_rows=None,
+               prefetch=2):
+    """
+    Legge il dataset unificato a blocchi e salva in `spill_dir` le feature (conteggi) e le etichette
+    di ogni blocco, saltando le righe di `exclude_ids`.
+
+    Mentre un blocco viene calcolato dai processi, il successivo viene già letto (fino a `prefetch`
+    blocchi in volo).
+
+    :return: Dizionario con i file dei blocchi, frequenze di documento, righe e conteggi per classe.
+    """
+    columns = TEXT_FIELDS + ["label"] + (["comments"] if comments else [])
+    document_frequency = np.zeros(hasher.n_features, dtype=np.int64)
+    class_counts = np.zeros(2, dtype=np.int64)
+    shards = []
+    pending = deque()
+
+    def finish():
+        labels, result = pending.popleft()
+        features = result()
+        document_frequency[:] += np.bincount(features.indices, minlength=hasher.n_features)
+        class_counts[:] += np.bincount(labels, minlength=2)
+        path = os.path.join(spill_dir, f"shard_{len(shards):05d}")
+        sp.save_npz(path + ".npz", features, compressed=False)
+        np.save(path + ".labels.npy", labels)
+        shards.append(path)
+
+    offset = rows = 0
+    for chunk in iter_table_chunks(source_table, chunk_size, columns=columns):
+        ids = np.arange(offset, offset + len(chunk))
+        offset += len(chunk)
+        chunk = chunk[~np.isin(ids, exclude_ids)]
+        if max_rows is not None:
+            chunk = chunk.iloc[:max_rows - rows]
+        if chunk.empty:
+            continue
+        rows += len(chunk)
+        pending.append((chunk["label"].to_numpy(dtype=np.int64), hasher.submit(row_texts(chunk, comments))))
+        while len(pending) > prefetch:
+            finish()
+        if max_rows is not None and rows >= max_rows:
+            break
+    while pending:
+        finish()
+    return {"shards": shards, "document_frequency": document_frequency, "rows": rows, "class_counts": class_counts}
+
+
+def idf_weights(document_frequency, documents):
+    """IDF con smoothing, come `TfidfTransformer(smooth_idf=True)`."""
+    return (np.log((1 + documents) / (1 + document_frequency)) + 1).astype(np.float32)
+
+
+def tfidf(features, idf):
+    """TF sublineare (1 + log tf) per IDF, righe normalizzate L2."""
+    from sklearn.preprocessing import normalize
+
+    features = features.astype(np.float32, copy=True)
+    features.data = (1 + np.log(features.data)) * idf[features.indices]
+    return normalize(features)
+
+
+def train_linear(shards, idf, class_counts, epochs=3, alpha=1e-5, seed=42):
+    """
+    Addestra `SGDClassifier` (regressione logistica) con `partial_fit` sui blocchi salvati.
+
+    Ogni blocco viene valutato prima di essere usato per l'aggiornamento (loss progressiva):
+    la media dell'ultima epoca è la loss di training riportata.
+
+    :return: Classificatore, loss progressiva dell'ultima epoca e numero di chiamate a `partial_fit`.
+    """
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.metrics import log_loss
+
+    classifier = SGDClassifier(loss="log_loss", alpha=alpha, random_state=seed)
+    # Pesi di classe bilanciati sul dataset completo (class_weight="balanced" non è ammesso con partial_fit)
+    class_weight = class_counts.sum() / (len(class_counts) * np.maximum(class_counts, 1))
+    rng = np.random.default_rng(seed)
+    steps = 0
+    for epoch in range(epochs):
+        losses, weights = [], []
+        for shard in rng.permutation(len(shards)):
+            features = tfidf(sp.load_npz(shards[shard] + ".npz"), idf)
+            labels = np.load(shards[shard] + ".labels.npy")
+            order = rng.permutation(len(labels))
+            features, labels = features[order], labels[order]
+            if steps:
+                losses.append(log_loss(labels, classifier.predict_proba(features), labels=[0, 1]))
+                weights.append(len(labels))
+            classifier.partial_fit(features, labels, classes=[0, 1], sample_weight=class_weight[labels])
+            steps += 1
+        print(f"  epoca {epoch + 1}/{epochs}: loss progressiva "
+              f"{np.average(losses, weights=weights) if losses else float('nan'):.4f}")
+    return classifier, float(np.average(losses, weights=weights)) if losses else float("nan"), steps
+
+
+def load_eval_split(split, balanced_dir, comments=False):
+    """Testi ed etichette di uno split del manifest."""
+    df = load_split(split, balanced_dir, columns=TEXT_FIELDS + ["label"] + (["comments"] if comments else []))
+    return row_texts(df, comments), df["label"].to_numpy()
+
+
+def run_baseline(balanced_dir="../dataset_completo/balanced_datasets", model_name="hashed-tfidf-sgd",
+                 comments=False, n_features=2 ** 20, ngram_max=2, epochs=3, alpha=1e-5, chunk_size=50000,
+                 max_rows=None, workers=None, spill_dir=None, batch_size=8, seed=42):
+    """
+    Addestra la baseline sul dataset unificato (meno validation e test) e la valuta sul test.
+
+    :param spill_dir: Cartella per i blocchi di feature temporanei (default: cartella temporanea di sistema).
+    :param batch_size: Dimensione dei batch di predizione sul test set (come eval.ipynb).
+    :return: Metriche sul test set.
+    """
+    from sklearn.metrics import accuracy_score, f1_score, log_loss
+
+    meta, archive = read_manifest(balanced_dir)
+    source_table = os.path.join(balanced_dir, meta["source_table"])
+    if os.path.getsize(source_table) != meta["source_bytes"]:
+        raise ValueError(f"{source_table} è cambiato dopo la creazione del manifest: rigenerare gli split.")
+    exclude_ids = np.concatenate([archive["validation"], archive["test"]]).astype(np.int64)
+
+    spill_dir = tempfile.mkdtemp(prefix="hashed_baseline_", dir=spill_dir)
+    try:
+        with FeatureHasher(n_features, ngram_max, workers) as hasher:
+            print(f"Feature con hashing da {source_table} su {hasher.workers} processi")
+            start = time.perf_counter()
+            hashed = hash_table(hasher, source_table, exclude_ids, spill_dir, comments, chunk_size, max_rows)
+            hash_time = time.perf_counter() - start
+            print(f"{hashed['rows']} righe in {hash_time:.1f}s ({hashed['rows'] / hash_time:.0f} righe/s), "
+                  f"slow: {hashed['class_counts'][1] / max(hashed['rows'], 1):.1%}")
+            idf = idf_weights(hashed["document_frequency"], hashed["rows"])
+
+            start = time.perf_counter()
+            classifier, training_loss, steps = train_linear(hashed["shards"], idf, hashed["class_counts"], epochs,
+                                                            alpha, seed)
+            fit_time = time.perf_counter() - start
+
+            val_texts, y_val = load_eval_split("validation", balanced_dir, comments)
+            val_probabilities = classifier.predict_proba(tfidf(hasher.transform(val_texts), idf))
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    train_time = hash_time + fit_time
+    rows = hashed["rows"]
+    trainer_stats = SimpleNamespace(
+        training_loss=training_loss,
+        global_step=steps,
+        metrics={"train_runtime": train_time, "train_samples_per_second": rows * epochs / train_time,
+                 "train_steps_per_second": steps / train_time},
+    )
+    val_predictions = val_probabilities.argmax(axis=1)
+    eval_results = {"eval_loss": log_loss(y_val, val_probabilities, labels=[0, 1]),
+                    "eval_accuracy": accuracy_score(y_val, val_predictions),
+                    "eval_f1": f1_score(y_val, val_predictions, average="weighted")}
+    results = training_results(rows, trainer_stats, eval_results, validation_metrics=True)
+
+    # Inferenza come in produzione: testo grezzo -> hashing -> TF-IDF -> predizione, nel processo corrente
+    vectorizer = make_vectorizer(n_features, ngram_max)
+    test_texts, y_test = load_eval_split("test", balanced_dir, comments)
+    predictions = []
+    with BatchProfiler() as profiler:
+        for batch_idx, start in enumerate(range(0, len(test_texts), batch_size)):
+            batch = test_texts[start:start + batch_size]
+            with profiler.batch(len(batch), batch_idx):
+                predictions.extend(classifier.predict(tfidf(vectorizer.transform(batch), idf)).tolist())
+    metrics = calculate_metrics(y_test, predictions)
+
+    output_dir = f"{model_name}_fine_tuned_on_{rows}"
+    os.makedirs(output_dir, exist_ok=True)
+    pd.DataFrame([metrics]).to_csv(os.path.join(output_dir, "metrics.csv"), index=False)
+    profiler.save(output_dir)
+    save_training_results(os.path.join(output_dir, "training_comparison.csv"), results)
+    print(f"{model_name} su {rows} righe: hashing {hash_time:.1f}s + training {fit_time:.1f}s | "
+          f"accuracy {metrics['accuracy']:.4f}, f1 {metrics['f1']:.4f} "
+          f"(validazione {eval_results['eval_accuracy']:.4f}) -> {output_dir}")
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Baseline TF-IDF con hashing e classificatore lineare "
+                                                 "addestrato a blocchi su tutto il dataset unificato.")
+    parser.add_argument("--balanced-dir", default="../dataset_completo/balanced_datasets",
+                        help="Cartella del manifest: definisce dataset unificato, validation e test.")
+    parser.add_argument("--model-name", default=None,
+                        help="Nome del modello nelle cartelle dei risultati (default: hashed-tfidf-sgd, "
+                             "con suffisso -comments se si usano i commenti).")
+    parser.add_argument("--comments", action="store_true", help="Aggiunge i commenti al testo.")
+    parser.add_argument("--n-features", type=int, default=2 ** 20, help="Dimensione dello spazio di hashing.")
+    parser.add_argument("--ngram-max", type=int, default=2, help="Lunghezza massima degli n-grammi di parole.")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--alpha", type=float, default=1e-5, help="Regolarizzazione L2 di SGDClassifier.")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Righe lette per blocco.")
+    parser.add_argument("--max-rows", type=int, default=None, help="Limita le righe di training.")
+    parser.add_argument("--workers", type=int, default=None, help="Processi per le feature (default: tutti i core).")
+    parser.add_argument("--spill-dir", default=None, help="Cartella per i blocchi di feature temporanei.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    model_name = args.model_name or ("hashed-tfidf-sgd-comments" if args.comments else "hashed-tfidf-sgd")
+    run_baseline(args.balanced_dir, model_name, args.comments, args.n_features, args.ngram_max, args.epochs,
+                 args.alpha, args.chunk_size, args.max_rows, args.workers, args.spill_dir, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Servizio HTTP locale per il classificatore DistilBERT fine-tunato (fast/slow).
+
+Le richieste concorrenti vengono accodate in una `asyncio.Queue` e raggruppate in micro-batch
+dinamici: un batch parte quando raggiunge `max_batch_size` bug o quando il bug più vecchio in coda
+ha atteso `max_wait_ms` millisecondi. Il forward del modello gira in un thread dedicato, così
+l'event loop continua ad accettare (e accodare) richieste mentre il batch precedente è in calcolo.
+
+Endpoint:
+- POST /predict: un bug (`{"source": ..., "product": ..., "short_desc": ..., "priority": ...,
+  "bug_severity": ...}`), una lista di bug o `{"bugs": [...]}`; risponde con etichetta, classe e
+  probabilità della classe `slow` per ogni bug;
+- GET /metrics: profondità della coda, dimensione dei batch, throughput e percentili di latenza
+  (p50/p95/p99) sulle ultime richieste;
+- GET /health.
+
+Esempio:
+    python inference_server.py --model-name distilbert-base-uncased \
+        --fine-tuned-path ./fine_tuned_model_distilbert-base-uncased_9000 --max-batch-size 32 --max-wait-ms 5
+    # modello int8 su ONNX Runtime (esportato e quantizzato al primo avvio, vedi quantization.py)
+    python inference_server.py --fine-tuned-path ./fine_tuned_model_distilbert-base-uncased_9000 --quantized onnx
+"""
+import argparse
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import torch
+from aiohttp import web
+
+from classifier import ID2LABEL, TEXT_FIELDS, concatenate_fields, load_model, predict_texts
+
+
+class MicroBatcher:
+    """
+    Coda asincrona che raggruppa i bug in arrivo in micro-batch per `predict_fn`.
+
+    :param predict_fn: Funzione `texts -> (classi, probabilità slow)` eseguita nel thread del modello.
+    :param max_batch_size: Numero massimo di bug per batch.
+    :param max_wait_ms: Attesa massima del primo bug in coda prima di avviare un batch incompleto.
+    :param window: Numero di richieste e batch recenti su cui si calcolano i percentili.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5.0, window=10000):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+        self._worker = None
+        self.latencies = deque(maxlen=window)
+        self.queue_waits = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.batch_times = deque(maxlen=window)
+        self.requests = 0
+        self.items = 0
+        self.batches = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.start_time = None
+
+    async def start(self):
+        """Avvia il worker che svuota la coda (va chiamato dentro l'event loop del server)."""
+        self.queue = asyncio.Queue()
+        self.start_time = time.perf_counter()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Ferma il worker e il thread del modello."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, texts):
+        """
+        Accoda i testi di una richiesta e ne attende le predizioni.
+
+        :return: Lista di coppie (classe, probabilità slow), nello stesso ordine di `texts`.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self.queue.put_nowait((text, future, start))
+            futures.append(future)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        self.requests += 1
+        results = await asyncio.gather(*futures)
+        self.latencies.append(time.perf_counter() - start)
+        return results
+
+    async def _collect(self):
+        # Il primo bug apre il batch; gli altri si aggiungono finché il batch è pieno o scade l'attesa
+        batch = [await self.queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            texts = [text for text, _, _ in batch]
+            start = time.perf_counter()
+            self.queue_waits.extend(start - enqueued for _, _, enqueued in batch)
+            self.in_flight = len(batch)
+            try:
+                predictions, probabilities = await loop.run_in_executor(self.executor, self.predict_fn, texts)
+            except Exception as e:
+                self.errors += len(batch)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.in_flight = 0
+            self.batch_times.append(time.perf_counter() - start)
+            self.batch_sizes.append(len(batch))
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future, _), prediction, probability in zip(batch, predictions, probabilities):
+                if not future.done():  # il client può essersi disconnesso
+                    future.set_result((prediction, probability))
+
+    def metrics(self):
+        """Stato della coda, throughput e percentili di latenza (in millisecondi) delle richieste recenti."""
+        def percentiles(values):
+            if not values:
+                return {"p50": None, "p95": None, "p99": None, "mean": None}
+            p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+            return {"p50": p50, "p95": p95, "p99": p99, "mean": float(np.mean(values)) * 1000}
+
+        uptime = time.perf_counter() - self.start_time if self.start_time is not None else 0.0
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "items": self.items,
+            "batches": self.batches,
+            "errors": self.errors,
+            "uptime_s": uptime,
+            "items_per_s": self.items / uptime if uptime > 0 else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "avg_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else None,
+            "latency_ms": percentiles(self.latencies),
+            "queue_wait_ms": percentiles(self.queue_waits),
+            "batch_time_ms": percentiles(self.batch_times),
+        }
+
+
+BATCHER = web.AppKey("batcher", MicroBatcher)
+
+
+def parse_bugs(payload):
+    """
+    Estrae i bug dal corpo di una richiesta /predict.
+
+    :return: Lista di bug e True se la richiesta conteneva un singolo bug (risposta non in lista).
+    """
+    single = isinstance(payload, dict) and "bugs" not in payload
+    bugs = [payload] if single else payload["bugs"] if isinstance(payload, dict) else payload
+    if not isinstance(bugs, list) or not bugs:
+        raise ValueError("atteso un bug, una lista di bug o {\"bugs\": [...]}")
+    for bug in bugs:
+        if not isinstance(bug, dict) or not any(bug.get(field) for field in TEXT_FIELDS):
+            raise ValueError(f"ogni bug deve essere un oggetto con almeno uno dei campi {TEXT_FIELDS}")
+    return bugs, single
+
+
+async def predict(request):
+    try:
+        bugs, single = parse_bugs(await request.json())
+    except ValueError as e:  # include il JSON non valido
+        raise web.HTTPBadRequest(text=str(e))
+    texts = [concatenate_fields({field: bug.get(field, '') for field in TEXT_FIELDS})['text'] for bug in bugs]
+    try:
+        results = await request.app[BATCHER].submit(texts)
+    except Exception as e:
+        raise web.HTTPInternalServerError(text=f"errore del modello: {e}")
+    predictions = [{"label": ID2LABEL[prediction], "prediction": prediction, "probability_slow": probability}
+                   for prediction, probability in results]
+    return web.json_response(predictions[0] if single else {"predictions": predictions})
+
+
+async def metrics(request):
+    return web.json_response(request.app[BATCHER].metrics())
+
+
+async def health(request):
+    return web.json_response({"status": "ok"})
+
+
+def create_app(predict_fn, max_batch_size=32, max_wait_ms=5.0):
+    """
+    Applicazione aiohttp con il micro-batcher per `predict_fn`.
+
+    :param predict_fn: Funzione `texts -> (classi, probabilità slow)`, es. `model_predictor(model, tokenizer)`
+        o il modello quantizzato di `quantization.load_quantized`.
+    """
+    batcher = MicroBatcher(predict_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    async def on_startup(app):
+        await batcher.start()
+
+    async def on_cleanup(app):
+        await batcher.stop()
+
+    app = web.Application()
+    app[BATCHER] = batcher
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.add_routes([web.post("/predict", predict), web.get("/metrics", metrics), web.get("/health", health)])
+    return app
+
+
+def model_predictor(model, tokenizer, max_length=512):
+    """
+    `predict_fn` per un modello PyTorch.
+
+    :param max_length: Lunghezza massima (in token) dei testi, come in eval.ipynb.
+    """
+    model.eval()
+    return partial(predict_texts, model, tokenizer, max_length=max_length)
+
+
+def serve(predict_fn, host="127.0.0.1", port=8080, **kwargs):
+    """Avvia il servizio (bloccante); `kwargs` sono passati a `create_app`."""
+    web.run_app(create_app(predict_fn, **kwargs), host=host, port=port, print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servizio HTTP con micro-batching per il classificatore DistilBERT.")
+    parser.add_argument("--model-name", default="distilbert-base-uncased",
+                        help="Modello pre-addestrato (e tokenizer) di partenza.")
+    parser.add_argument("--fine-tuned-path", default=None,
+                        help="Checkpoint fine-tunato (es. ./fine_tuned_model_distilbert-base-uncased_9000).")
+    parser.add_argument("--device", default="cuda", help="Dispositivo del modello (cpu se CUDA non è disponibile).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=32, help="Bug massimi per micro-batch.")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0,
+                        help="Attesa massima (ms) prima di avviare un batch incompleto.")
+    parser.add_argument("--max-length", type=int, default=512, help="Token massimi per testo.")
+    parser.add_argument("--threads", type=int, default=None, help="Thread di torch su CPU (default: tutti).")
+    parser.add_argument("--quantized", choices=["onnx", "torch"], default=None,
+                        help="Serve il modello int8 su CPU (ONNX Runtime o quantizzazione dinamica di PyTorch, "
+                             "vedi quantization.py) invece del modello fp32.")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.quantized:
+        from quantization import load_quantized
+
+        predict_fn = load_quantized(args.model_name, args.fine_tuned_path, backend=args.quantized,
+                                    max_length=args.max_length)
+    else:
+        model, tokenizer = load_model(args.model_name, fine_tuned=args.fine_tuned_path is not None,
+                                      fine_tuned_path=args.fine_tuned_path, device=args.device)
+        predict_fn = model_predictor(model, tokenizer, args.max_length)
+    print(f"In ascolto su http://{args.host}:{args.port} (max_batch_size={args.max_batch_size}, "
+          f"max_wait_ms={args.max_wait_ms})")
+    serve(predict_fn, args.host, args.port, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Batching per lunghezza con padding dinamico per il classificatore DistilBERT.
+
+I testi concatenati (source, product, short_desc, priority, severity) sono lunghi poche decine
+di token: invece di portarli tutti a 512, gli esempi vengono raggruppati per lunghezza, con il
+padding applicato batch per batch da `DataCollatorWithPadding`. In training ogni batch ha al più
+`per_device_train_batch_size` esempi (il budget di token serve solo a limitare il padding), così
+numero di step, learning rate, `eval_steps` e `save_steps` restano quelli del training originale;
+in valutazione i batch vengono riempiti fino al budget di token (lunghezza massima del batch x
+numero di esempi).
+"""
+import numpy as np
+from torch.utils.data import DataLoader
+from transformers import Trainer
+
+from token_batches import token_budget_batches  # dataset_completo (già nel sys.path dei notebook)
+
+
+class TokenBudgetBatchSampler:
+    """
+    Batch sampler per `DataLoader` basato su `token_budget_batches`.
+    In training i batch sono fissati una volta (la loro lunghezza non cambia tra le epoche,
+    così il numero di step calcolato dal Trainer resta esatto) e a ogni epoca ne viene
+    mescolato l'ordine.
+    """
+
+    def __init__(self, lengths, max_tokens, max_batch_size=None, shuffle=False, seed=42):
+        self.batches = token_budget_batches(lengths, max_tokens, max_batch_size, shuffle, seed)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        order = np.arange(len(self.batches))
+        if self.shuffle:
+            order = np.random.default_rng([self.seed, self.epoch]).permutation(order)
+        for i in order:
+            yield self.batches[i]
+
+
+class LengthGroupedTrainer(Trainer):
+    """
+    `Trainer` che costruisce i batch di training e valutazione con `TokenBudgetBatchSampler`.
+    Il dataset deve avere la colonna `length` (numero di token, vedi `add_lengths`) e gli
+    `input_ids` senza padding: il padding dinamico è fatto da `DataCollatorWithPadding`.
+
+    Args:
+        max_tokens (int): Budget di token per batch.
+        max_batch_size (int): Numero massimo di esempi per batch (default: in training
+            `per_device_train_batch_size`, in valutazione nessun limite oltre al budget).
+    """
+
+    def __init__(self, *args, max_tokens=4096, max_batch_size=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+
+    def _token_budget_dataloader(self, dataset, shuffle, max_batch_size):
+        sampler = TokenBudgetBatchSampler(dataset['length'], self.max_tokens, max_batch_size,
+                                          shuffle=shuffle, seed=self.args.seed)
+        dataset = dataset.remove_columns([c for c in dataset.column_names
+                                          if c not in ('input_ids', 'attention_mask', 'label', 'labels')])
+        dataloader = DataLoader(dataset, batch_sampler=sampler, collate_fn=self.data_collator,
+                                num_workers=self.args.dataloader_num_workers,
+                                pin_memory=self.args.dataloader_pin_memory)
+        return self.accelerator.prepare(dataloader)
+
+    def get_train_dataloader(self):
+        # Stessi esempi per step del Trainer standard: cambia solo il padding
+        return self._token_budget_dataloader(self.train_dataset, shuffle=True,
+                                             max_batch_size=self.max_batch_size or self.args.per_device_train_batch_size)
+
+    def get_eval_dataloader(self, eval_dataset=None):
+        if isinstance(eval_dataset, str):
+            eval_dataset = self.eval_dataset[eval_dataset]
+        return self._token_budget_dataloader(eval_dataset if eval_dataset is not None else self.eval_dataset,
+                                             shuffle=False, max_batch_size=self.max_batch_size)
+
+
+def add_lengths(examples):
+    """Da usare con `dataset.map(add_lengths, batched=True)`: aggiunge la colonna `length`."""
+    return {'length': [len(ids) for ids in examples['input_ids']]}
@@ -0,0 +1,390 @@
+"""
+Modalità "testo lungo" del classificatore DistilBERT: usa anche i commenti (`comments`, tutti i
+`long_desc` di un bug concatenati da extractData.py), esclusi finora perché troppo lunghi.
+
+I commenti di ogni bug vengono divisi in finestre di token; ogni finestra è preceduta dal testo
+breve di `concatenate_fields` (`[CLS] testo [SEP] commenti[i:j] [SEP]`), così il modello vede
+sempre source, product, short_desc, priority e severity. Strategie:
+- `none`: una sola finestra con il testo breve (come eval.ipynb, riferimento);
+- `head_tail`: solo le prime `head` e le ultime `tail` finestre dei commenti;
+- `all`: tutte le finestre (al massimo `max_windows`).
+
+Le finestre di tutti i bug vengono codificate insieme in batch a budget di token (ordinati per
+lunghezza, padding per batch) e i logit delle finestre di un bug vengono aggregati (media dei
+logit o massimo della probabilità di `slow`). I logit di ogni finestra sono salvati in una cache
+su disco indicizzata da impronta del modello e hash degli id della finestra: una finestra già
+vista (stesso bug in un'altra strategia o in un'esecuzione successiva) non viene ricodificata.
+Nel confronto tra strategie la cache su disco è facoltativa (`--cache`): di default ogni strategia
+parte da una cache vuota, così il costo riportato è quello completo.
+Gli id di testi e commenti vengono letti da `TokenCache`, come in ft.ipynb ed eval.ipynb.
+
+Il confronto tra strategie (`main`) scrive long_text_comparison.csv con costo (finestre, token
+con padding, tempo, esempi/s) e metriche (`calculate_metrics`) di ogni strategia, più il
+guadagno di accuracy/F1 e il costo relativo rispetto a `none`.
+
+Esempio:
+    python long_text.py --fine-tuned-path ./fine_tuned_model_distilbert-base-uncased_9000 \
+        --modes none head_tail:1:1 head_tail:2:2 all:16
+"""
+import argparse
+import glob
+import hashlib
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from classifier import TEXT_FIELDS, calculate_metrics, load_model, texts_from_frame  # noqa: E402
+from dataset_io import load_split  # noqa: E402
+from token_batches import token_budget_batches  # noqa: E402
+from token_cache import DEFAULT_CACHE_DIR, TokenCache, tokenizer_fingerprint  # noqa: E402
+
+STRATEGIES = ("none", "head_tail", "all")
+POOLINGS = ("mean", "max")
+
+# Accanto alla cache dei token, condivisa dalle esecuzioni e dai notebook
+DEFAULT_WINDOW_CACHE_DIR = os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'window_cache')
+
+
+class WindowMode:
+    """
+    Strategia di selezione delle finestre e di aggregazione.
+
+    :param strategy: `none`, `head_tail` o `all`.
+    :param window_tokens: Token per finestra, token speciali e testo breve compresi.
+    :param overlap: Token di commento in comune tra due finestre consecutive.
+    :param head: Finestre iniziali tenute da `head_tail`.
+    :param tail: Finestre finali tenute da `head_tail`.
+    :param max_windows: Finestre massime per bug con `all` (default: nessun limite).
+    :param pooling: `mean` (media dei logit) o `max` (massima probabilità di `slow`).
+    """
+
+    def __init__(self, strategy="head_tail", window_tokens=512, overlap=64, head=1, tail=1, max_windows=None,
+                 pooling="mean"):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Strategia '{strategy}' non valida. Disponibili: {STRATEGIES}")
+        if pooling not in POOLINGS:
+            raise ValueError(f"Aggregazione '{pooling}' non valida. Disponibili: {POOLINGS}")
+        self.strategy = strategy
+        self.window_tokens = window_tokens
+        self.overlap = overlap
+        self.head = head
+        self.tail = tail
+        self.max_windows = max_windows
+        self.pooling = pooling
+
+    @classmethod
+    def parse(cls, spec, **kwargs):
+        """Da stringa: `none`, `head_tail:<head>:<tail>` o `all[:<max_windows>]`."""
+        name, *values = spec.split(":")
+        if name == "head_tail":
+            head, tail = (int(v) for v in (values + ["1", "1"])[:2])
+            return cls(name, head=head, tail=tail, **kwargs)
+        if name == "all":
+            return cls(name, max_windows=int(values[0]) if values else None, **kwargs)
+        return cls(name, **kwargs)
+
+    def __str__(self):
+        if self.strategy == "head_tail":
+            return f"head_tail:{self.head}:{self.tail}"
+        if self.strategy == "all" and self.max_windows:
+            return f"all:{self.max_windows}"
+        return self.strategy
+
+
+def content_ids(token_cache, texts):
+    """Id dei token dei testi senza i token speciali aggiunti dal tokenizer (letti da `token_cache`)."""
+    special = np.array(token_cache.tokenizer.all_special_ids)
+    return [ids[~np.isin(ids, special)] for ids in token_cache.encode(texts)]
+
+
+def comment_windows(tokenizer, text_ids, comment_ids, mode):
+    """
+    Finestre di un bug: `[CLS] testo [SEP] commenti[i:j] [SEP]` secondo `mode` (formato BERT).
+
+    :return: Lista di liste di id (con token speciali, senza padding).
+    """
+    cls, sep = tokenizer.cls_token_id, tokenizer.sep_token_id
+    text_ids = [cls] + [int(i) for i in text_ids[:mode.window_tokens // 2]] + [sep]
+    if mode.strategy == "none" or len(comment_ids) == 0:
+        return [text_ids]
+    body = mode.window_tokens - len(text_ids) - 1
+    step = max(1, body - mode.overlap)
+    n = len(comment_ids)
+    starts = list(range(0, max(1, n - mode.overlap), step))
+    if mode.strategy == "head_tail" and len(starts) > mode.head + mode.tail:
+        # Le finestre finali terminano con l'ultimo commento
+        tail = [max(0, n - body - j * step) for j in reversed(range(mode.tail))]
+        starts = starts[:mode.head] + tail
+    elif mode.strategy == "all" and mode.max_windows:
+        starts = starts[:mode.max_windows]
+    return [text_ids + comment_ids[s:s + body].tolist() + [sep] for s in starts]
+
+
+def build_windows(tokenizer, text_ids, comment_ids, mode):
+    """
+    Finestre di tutti i bug.
+
+    :return: Lista delle finestre e array con l'indice del bug di ogni finestra.
+    """
+    windows, reports = [], []
+    for report, (text, comments) in enumerate(zip(text_ids, comment_ids)):
+        report_windows = comment_windows(tokenizer, text, comments, mode)
+        windows.extend(report_windows)
+        reports.extend([report] * len(report_windows))
+    return windows, np.array(reports, dtype=np.int64)
+
+
+def window_hashes(windows):
+    """Hash a 64 bit degli id di ogni finestra."""
+    return np.array([int.from_bytes(hashlib.blake2b(np.asarray(ids, dtype=np.int32).tobytes(), digest_size=8)
+                                    .digest(), 'little') for ids in windows], dtype=np.uint64)
+
+
+def model_fingerprint(model, tokenizer):
+    """Impronta di pesi e tokenizer: due modelli con la stessa impronta producono gli stessi logit."""
+    digest = hashlib.sha256(tokenizer_fingerprint(tokenizer).encode())
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode())
+        # Byte grezzi: funziona anche con dtype senza equivalente numpy (es. bfloat16)
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+class WindowCache:
+    """
+    Cache dei logit per finestra, una cartella per impronta del modello.
+
+    Ogni scrittura aggiunge uno shard `shard_<uuid>.npz` (hash e logit) in modo atomico, come in
+    `TokenCache`; all'apertura gli shard vengono letti e indicizzati per hash.
+    Con `cache_dir=None` la cache resta in memoria (per misurare il costo a freddo).
+
+    :param fingerprint: Impronta del modello (vedi `model_fingerprint`).
+    """
+
+    def __init__(self, fingerprint, cache_dir=DEFAULT_WINDOW_CACHE_DIR):
+        self.directory = os.path.join(cache_dir, fingerprint[:16]) if cache_dir else None
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._logits = np.empty((0, 0), dtype=np.float32)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            shards = [np.load(path) for path in sorted(glob.glob(os.path.join(self.directory, 'shard_*.npz')))]
+            if shards:
+                self._index(np.concatenate([s['hashes'] for s in shards]),
+                            np.concatenate([s['logits'] for s in shards]))
+
+    def _index(self, hashes, logits):
+        hashes, first = np.unique(hashes, return_index=True)
+        self._hashes, self._logits = hashes, logits[first]
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def lookup(self, hashes):
+        """
+        :return: Maschera delle finestre in cache e loro logit (righe a zero per quelle mancanti).
+        """
+        pos = np.searchsorted(self._hashes, hashes)
+        found = np.zeros(len(hashes), dtype=bool)
+        inside = pos < len(self._hashes)
+        found[inside] = self._hashes[pos[inside]] == hashes[inside]
+        logits = np.zeros((len(hashes), self._logits.shape[1] if len(self._hashes) else 0), dtype=np.float32)
+        logits[found] = self._logits[pos[found]]
+        return found, logits
+
+    def add(self, hashes, logits):
+        """Aggiunge i logit di nuove finestre."""
+        if not len(hashes):
+            return
+        logits = np.asarray(logits, dtype=np.float32)
+        if self.directory:
+            name = f"shard_{uuid.uuid4().hex}"
+            tmp_file = os.path.join(self.directory, f".{name}.tmp.npz")
+            np.savez(tmp_file, hashes=np.asarray(hashes, dtype=np.uint64), logits=logits)
+            os.replace(tmp_file, os.path.join(self.directory, name + '.npz'))
+        if len(self._hashes):
+            hashes, logits = np.concatenate([self._hashes, hashes]), np.concatenate([self._logits, logits])
+        self._index(np.asarray(hashes, dtype=np.uint64), logits)
+
+
+def encode_windows(model, tokenizer, windows, cache, max_tokens=8192):
+    """
+    Logit di ogni finestra: quelle non in cache (e non duplicate) vengono codificate in batch a
+    budget di token, ordinate per lunghezza e con padding per batch.
+
+    :return: Array (finestre, classi) dei logit e statistiche di costo (finestre codificate e in
+        cache, token con padding, batch, secondi).
+    """
+    hashes = window_hashes(windows)
+    unique, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    found, cached = cache.lookup(unique)
+    missing = np.flatnonzero(~found)
+    logits = np.zeros((len(unique), model.config.num_labels), dtype=np.float32)
+    if found.any():
+        logits[found] = cached[found]
+
+    lengths = [len(windows[first[i]]) for i in missing]
+    batches = token_budget_batches(lengths, max_tokens)
+    padded_tokens = 0
+    start = time.perf_counter()
+    for batch in batches:
+        rows = missing[batch]
+        inputs = tokenizer.pad({"input_ids": [windows[first[i]] for i in rows]}, return_tensors="pt").to(model.device)
+        with torch.no_grad():
+            logits[rows] = model(**inputs).logits.float().cpu().numpy()
+        padded_tokens += inputs["input_ids"].numel()
+    elapsed = time.perf_counter() - start
+    cache.add(unique[missing], logits[missing])
+
+    stats = {"windows": len(windows), "encoded_windows": len(missing), "cached_windows": int(found.sum()),
+             "encoded_tokens": int(sum(lengths)), "padded_tokens": padded_tokens, "batches": len(batches),
+             "encode_time": elapsed}
+    return logits[inverse.reshape(-1)], stats
+
+
+def pool_logits(window_logits, reports, n_reports, pooling="mean"):
+    """
+    Aggrega le finestre di ogni bug.
+
+    :return: Classi predette e probabilità della classe `slow` per bug.
+    """
+    shifted = window_logits - window_logits.max(axis=1, keepdims=True)
+    probabilities = np.exp(shifted) / np.exp(shifted).sum(axis=1, keepdims=True)
+    if pooling == "max":
+        slow = np.zeros(n_reports)
+        np.maximum.at(slow, reports, probabilities[:, 1])
+        return (slow > 0.5).astype(np.int64), slow
+    sums = np.zeros((n_reports, window_logits.shape[1]))
+    np.add.at(sums, reports, window_logits)
+    pooled = sums / np.bincount(reports, minlength=n_reports)[:, None]
+    pooled = np.exp(pooled - pooled.max(axis=1, keepdims=True))
+    pooled /= pooled.sum(axis=1, keepdims=True)
+    return pooled.argmax(axis=1), pooled[:, 1]
+
+
+def predict_long(model, tokenizer, text_ids, comment_ids, mode, cache, max_tokens=8192):
+    """
+    Predizioni in modalità testo lungo.
+
+    :param text_ids: Id (senza token speciali) del testo breve di ogni bug (vedi `content_ids`).
+    :param comment_ids: Id (senza token speciali) dei commenti di ogni bug.
+    :return: Classi predette, probabilità di `slow` e statistiche di costo di `encode_windows`.
+    """
+    windows, reports = build_windows(tokenizer, text_ids, comment_ids, mode)
+    window_logits, stats = encode_windows(model, tokenizer, windows, cache, max_tokens)
+    predictions, probabilities = pool_logits(window_logits, reports, len(text_ids), mode.pooling)
+    return predictions, probabilities, stats
+
+
+def window_dataset(tokenizer, text_ids, comment_ids, labels, mode):
+    """
+    Finestre come esempi di training (ogni finestra eredita l'etichetta del suo bug), nel formato
+    di `LengthGroupedTrainer`: `input_ids` senza padding, `attention_mask`, `label`, `length` e
+    `report` (indice del bug).
+    """
+    from datasets import Dataset
+
+    windows, reports = build_windows(tokenizer, text_ids, comment_ids, mode)
+    labels = np.asarray(labels)
+    return Dataset.from_dict({
+        "input_ids": windows,
+        "attention_mask": [[1] * len(ids) for ids in windows],
+        "label": labels[reports].tolist(),
+        "length": [len(ids) for ids in windows],
+        "report": reports.tolist(),
+    })
+
+
+def load_long_split(split, balanced_dir, limit=None):
+    """Testi brevi (`concatenate_fields`), commenti ed etichette di uno split bilanciato."""
+    df = load_split(split, balanced_dir, columns=TEXT_FIELDS + ["comments", "label"])
+    if limit:
+        df = df.iloc[:limit]
+    texts = texts_from_frame(df)
+    comments = df["comments"].astype(object).where(df["comments"].notna(), "").astype(str).tolist()
+    return texts, comments, df["label"].to_numpy()
+
+
+def compare_modes(model, tokenizer, texts, comments, labels, modes, max_tokens=8192, max_comment_tokens=4096,
+                  cache_dir=None):
+    """
+    Costo e metriche di ogni strategia sugli stessi bug.
+
+    :param max_comment_tokens: Token dei commenti letti per bug (troncamento di `TokenCache`).
+    :param cache_dir: Cache delle finestre su disco. Con None (default) ogni strategia parte da una
+        cache vuota in memoria, così tempi e token misurano il costo reale della strategia; con la
+        cache le finestre già codificate (da altre strategie o esecuzioni) non vengono ricalcolate.
+    :return: Una riga per strategia, con guadagno e costo relativo rispetto alla prima strategia.
+    """
+    model.eval()
+    text_ids = content_ids(TokenCache(tokenizer, max_length=512), texts)
+    comment_ids = content_ids(TokenCache(tokenizer, max_length=max_comment_tokens), comments)
+    fingerprint = model_fingerprint(model, tokenizer)
+    cache = WindowCache(fingerprint, cache_dir) if cache_dir else None
+
+    rows = []
+    for mode in modes:
+        mode_cache = cache if cache is not None else WindowCache(fingerprint, None)
+        predictions, _, stats = predict_long(model, tokenizer, text_ids, comment_ids, mode, mode_cache, max_tokens)
+        metrics = calculate_metrics(labels, predictions)
+        row = {"mode": str(mode), "pooling": mode.pooling, "window_tokens": mode.window_tokens, **stats,
+               "windows_per_report": stats["windows"] / len(texts),
+               "samples_per_s": len(texts) / stats["encode_time"] if stats["encoded_windows"] else np.nan,
+               **metrics}
+        if rows:
+            reference = rows[0]
+            row.update({
+                "accuracy_gain": row["accuracy"] - reference["accuracy"],
+                "f1_gain": row["f1"] - reference["f1"],
+                "token_ratio": row["padded_tokens"] / reference["padded_tokens"]
+                if reference["padded_tokens"] else np.nan,
+                "time_ratio": row["encode_time"] / reference["encode_time"] if reference["encode_time"] else np.nan,
+            })
+        print(f"{row['mode']}: {row['windows_per_report']:.2f} finestre/bug, {stats['padded_tokens']} token, "
+              f"{stats['encode_time']:.1f}s ({stats['cached_windows']} finestre in cache) | "
+              f"accuracy {metrics['accuracy']:.4f}, f1 {metrics['f1']:.4f}")
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronta costo e accuratezza delle strategie che usano i commenti.")
+    parser.add_argument("--model-name", default="distilbert-base-uncased")
+    parser.add_argument("--fine-tuned-path", default=None, help="Checkpoint fine-tunato da valutare.")
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--modes", nargs="+", default=["none", "head_tail:1:1", "head_tail:2:2", "all:16"],
+                        help="Strategie: none, head_tail:<head>:<tail>, all[:<max_windows>] (la prima è il riferimento).")
+    parser.add_argument("--window-tokens", type=int, default=512)
+    parser.add_argument("--overlap", type=int, default=64)
+    parser.add_argument("--pooling", choices=POOLINGS, default="mean")
+    parser.add_argument("--max-tokens", type=int, default=8192, help="Budget di token per batch.")
+    parser.add_argument("--max-comment-tokens", type=int, default=4096, help="Token dei commenti letti per bug.")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--balanced-dir", default="../dataset_completo/balanced_datasets")
+    parser.add_argument("--limit", type=int, default=None, help="Valuta solo i primi N bug dello split.")
+    parser.add_argument("--cache", action="store_true",
+                        help="Usa la cache delle finestre su disco (riesecuzioni veloci, ma i tempi non misurano "
+                             "più il costo completo di ogni strategia).")
+    parser.add_argument("--output", default="long_text_comparison.csv")
+    args = parser.parse_args()
+
+    model, tokenizer = load_model(args.model_name, fine_tuned=args.fine_tuned_path is not None,
+                                  fine_tuned_path=args.fine_tuned_path, device=args.device)
+    texts, comments, labels = load_long_split(args.split, args.balanced_dir, args.limit)
+    modes = [WindowMode.parse(spec, window_tokens=args.window_tokens, overlap=args.overlap, pooling=args.pooling)
+             for spec in args.modes]
+    rows = compare_modes(model, tokenizer, texts, comments, labels, modes, args.max_tokens, args.max_comment_tokens,
+                         DEFAULT_WINDOW_CACHE_DIR if args.cache else None)
+    comparison = pd.DataFrame(rows)
+    comparison.to_csv(args.output, index=False)
+    print(comparison.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+
+
+if __name__ == "__main__":
+    main()
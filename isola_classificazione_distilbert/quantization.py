@@ -0,0 +1,311 @@
+"""
+Inferenza quantizzata int8 su CPU per il classificatore DistilBERT.
+
+I checkpoint `fine_tuned_model_<model_name>_<n>` di ft.ipynb vengono esportati in ONNX
+(`<checkpoint>/onnx/model.onnx`) e quantizzati con la quantizzazione dinamica di ONNX Runtime
+(`<checkpoint>/onnx/model.int8.onnx`: pesi dei layer lineari in int8, attivazioni quantizzate a
+runtime). L'esportazione viene rifatta solo se il checkpoint è più recente dei file ONNX. Senza
+onnxruntime si ripiega sulla quantizzazione dinamica di PyTorch (`nn.Linear` in int8).
+
+Il benchmark valuta sul test set bilanciato il modello fp32 e le varianti quantizzate con le
+stesse metriche di eval.ipynb (`calculate_metrics`) e gli stessi batch (budget di token), e scrive:
+- quantization_comparison.csv: dimensione del modello, latenza per batch, esempi/s, metriche e
+  differenze rispetto al modello fp32 (calo di accuracy/F1, predizioni concordi, scarto medio della
+  probabilità di `slow`, speedup);
+- `<model_name>-<variante>_fine_tuned_on_<n>/`: metrics.csv, avg_system_metrics.csv e
+  batch_trace.csv di ogni variante quantizzata, letti da comparison.py come un modello a sé.
+
+Esempio:
+    python quantization.py --num-val 1000 9000 --variants fp32 onnx_int8 torch_int8
+"""
+import argparse
+import os
+import sys
+import warnings
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import torch
+from transformers import AutoTokenizer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from classifier import TEXT_FIELDS, calculate_metrics, load_model, predict_texts, texts_from_frame  # noqa: E402
+from dataset_io import load_split  # noqa: E402
+from system_profiler import BatchProfiler, format_summary  # noqa: E402
+from token_batches import token_budget_batches  # noqa: E402
+
+try:
+    import onnxruntime as ort
+except ImportError:  # si ripiega sulla quantizzazione dinamica di PyTorch
+    ort = None
+
+VARIANTS = ("fp32", "onnx_fp32", "onnx_int8", "torch_int8")
+ONNX_INPUTS = ["input_ids", "attention_mask"]
+
+
+def checkpoint_path(model_name, num_val):
+    """Cartella del checkpoint fine-tunato salvata da ft.ipynb."""
+    return f"./fine_tuned_model_{model_name}_{num_val}"
+
+
+def onnx_paths(fine_tuned_path):
+    """Percorsi del modello ONNX fp32 e int8 di un checkpoint."""
+    directory = os.path.join(fine_tuned_path, "onnx")
+    return os.path.join(directory, "model.onnx"), os.path.join(directory, "model.int8.onnx")
+
+
+def export_onnx(model, tokenizer, output_path, opset=17):
+    """
+    Esporta il classificatore in ONNX, con batch e lunghezza della sequenza dinamici.
+
+    :return: `output_path`
+    """
+    model = model.to("cpu").eval()
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    example = tokenizer(["crash on save", "ui"], return_tensors="pt", padding=True)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ONNX_INPUTS}
+    dynamic_axes["logits"] = {0: "batch"}
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(example[name] for name in ONNX_INPUTS), output_path,
+                          input_names=ONNX_INPUTS, output_names=["logits"], dynamic_axes=dynamic_axes,
+                          opset_version=opset, dynamo=False)
+    return output_path
+
+
+def quantize_onnx(onnx_path, output_path):
+    """Quantizzazione dinamica int8 (pesi in int8, attivazioni quantizzate a runtime) di un modello ONNX."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QInt8)
+    return output_path
+
+
+def quantize_torch(model):
+    """Copia del modello con i `nn.Linear` quantizzati dinamicamente in int8 (solo CPU)."""
+    return torch.ao.quantization.quantize_dynamic(model.to("cpu").eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _is_stale(path, fine_tuned_path):
+    if not os.path.exists(path):
+        return True
+    checkpoint_files = [os.path.join(fine_tuned_path, f) for f in os.listdir(fine_tuned_path)]
+    newest = max((os.path.getmtime(f) for f in checkpoint_files if os.path.isfile(f)), default=0)
+    return os.path.getmtime(path) < newest
+
+
+def export_checkpoint(model_name, fine_tuned_path, model=None, tokenizer=None, force=False):
+    """
+    Esporta e quantizza un checkpoint, se i file ONNX mancano o sono più vecchi del checkpoint.
+
+    :param model: Modello fp32 già caricato (default: caricato da `fine_tuned_path` solo se serve).
+    :param force: Rifà l'esportazione anche se i file ONNX sono aggiornati.
+    :return: Percorsi del modello ONNX fp32 e int8.
+    """
+    fp32_path, int8_path = onnx_paths(fine_tuned_path)
+    if force or _is_stale(fp32_path, fine_tuned_path):
+        if model is None:
+            model, tokenizer = load_model(model_name, fine_tuned=True, fine_tuned_path=fine_tuned_path, device="cpu")
+        print(f"Esportazione ONNX: {fp32_path}")
+        export_onnx(model, tokenizer, fp32_path)
+    if force or _is_stale(int8_path, fine_tuned_path) or os.path.getmtime(int8_path) < os.path.getmtime(fp32_path):
+        print(f"Quantizzazione int8: {int8_path}")
+        quantize_onnx(fp32_path, int8_path)
+    return fp32_path, int8_path
+
+
+class OnnxClassifier:
+    """
+    Classificatore su ONNX Runtime (CPU) con la stessa interfaccia di `predict_texts`:
+    `classifier(texts)` restituisce classi predette e probabilità della classe `slow`.
+
+    :param path: Modello ONNX (fp32 o int8).
+    :param threads: Thread di ONNX Runtime (default: quelli di torch).
+    """
+
+    def __init__(self, path, tokenizer, max_length=512, threads=None):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or torch.get_num_threads()
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+
+    def __call__(self, texts):
+        inputs = self.tokenizer(texts, return_tensors="np", truncation=True, padding=True,
+                                max_length=self.max_length)
+        logits = self.session.run(["logits"], {name: inputs[name].astype(np.int64) for name in ONNX_INPUTS})[0]
+        probabilities = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        probabilities /= probabilities.sum(axis=-1, keepdims=True)
+        return probabilities.argmax(axis=-1).tolist(), probabilities[:, 1].tolist()
+
+
+def load_quantized(model_name, fine_tuned_path, backend="onnx", max_length=512, threads=None):
+    """
+    Modello int8 pronto per l'inferenza su CPU, come funzione `texts -> (classi, probabilità slow)`.
+
+    :param backend: `onnx` (ONNX Runtime; se non è installato si usa `torch`) o `torch`
+        (quantizzazione dinamica di PyTorch).
+    """
+    if backend == "onnx" and ort is None:
+        warnings.warn("onnxruntime non è installato: uso la quantizzazione dinamica di PyTorch")
+        backend = "torch"
+    if backend == "onnx":
+        if not fine_tuned_path:
+            raise ValueError("L'esportazione ONNX richiede un checkpoint fine-tunato (fine_tuned_path)")
+        _, int8_path = export_checkpoint(model_name, fine_tuned_path)
+        return OnnxClassifier(int8_path, AutoTokenizer.from_pretrained(model_name), max_length, threads)
+    model, tokenizer = load_model(model_name, fine_tuned=fine_tuned_path is not None,
+                                  fine_tuned_path=fine_tuned_path, device="cpu")
+    return partial(predict_texts, quantize_torch(model), tokenizer, max_length=max_length)
+
+
+def _tensor_bytes(value):
+    # I Linear quantizzati salvano pesi (int8) e bias come tupla nello state_dict
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(v) for v in value)
+    return 0
+
+
+def model_size_mb(model_or_path):
+    """Dimensione di un file ONNX o dei tensori dello state_dict di un modello PyTorch."""
+    if isinstance(model_or_path, str):
+        return os.path.getsize(model_or_path) / 2 ** 20
+    return sum(_tensor_bytes(v) for v in model_or_path.state_dict().values()) / 2 ** 20
+
+
+def build_variants(model_name, fine_tuned_path, variants=VARIANTS, max_length=512, threads=None, force=False):
+    """
+    Carica il checkpoint fp32 e prepara le varianti richieste.
+
+    :return: Dizionario variante -> (funzione di predizione, dimensione in MB) e tokenizer.
+    """
+    model, tokenizer = load_model(model_name, fine_tuned=True, fine_tuned_path=fine_tuned_path, device="cpu")
+    model.eval()
+    if ort is None and any(v.startswith("onnx") for v in variants):
+        warnings.warn("onnxruntime non è installato: le varianti ONNX vengono saltate")
+        variants = [v for v in variants if not v.startswith("onnx")]
+    if any(v.startswith("onnx") for v in variants):
+        fp32_path, int8_path = export_checkpoint(model_name, fine_tuned_path, model, tokenizer, force)
+
+    built = {}
+    for variant in variants:
+        if variant == "fp32":
+            built[variant] = (partial(predict_texts, model, tokenizer, max_length=max_length), model_size_mb(model))
+        elif variant == "torch_int8":
+            quantized = quantize_torch(model)
+            built[variant] = (partial(predict_texts, quantized, tokenizer, max_length=max_length),
+                              model_size_mb(quantized))
+        else:
+            path = fp32_path if variant == "onnx_fp32" else int8_path
+            built[variant] = (OnnxClassifier(path, tokenizer, max_length, threads), model_size_mb(path))
+    return built, tokenizer
+
+
+def evaluate_predictor(predict_fn, texts, batches):
+    """
+    Predizioni su `texts` nei batch indicati, con tempi per batch e risorse campionate.
+
+    :return: Classi predette, probabilità della classe `slow` e `BatchProfiler` dell'esecuzione.
+    """
+    predictions = np.zeros(len(texts), dtype=np.int64)
+    probabilities = np.zeros(len(texts))
+    with BatchProfiler() as profiler:
+        for batch_idx, indices in enumerate(batches):
+            with profiler.batch(len(indices), batch_idx):
+                batch_predictions, batch_probabilities = predict_fn([texts[i] for i in indices])
+            predictions[indices] = batch_predictions
+            probabilities[indices] = batch_probabilities
+    return predictions, probabilities, profiler
+
+
+def compare_checkpoint(model_name, fine_tuned_path, num_val, texts, labels, variants=VARIANTS, max_tokens=4096,
+                       max_length=512, threads=None, force=False, save_results=True):
+    """
+    Valuta fp32 e varianti quantizzate di un checkpoint sugli stessi testi e batch.
+
+    :param save_results: Salva metrics.csv e le metriche di sistema delle varianti quantizzate in
+        `<model_name>-<variante>_fine_tuned_on_<num_val>`.
+    :return: Una riga per variante, con le differenze rispetto a `fp32` se è tra le varianti.
+    """
+    # fp32 per primo: fa da riferimento per le altre varianti
+    variants = sorted(variants, key=VARIANTS.index)
+    built, tokenizer = build_variants(model_name, fine_tuned_path, variants, max_length, threads, force)
+    lengths = [len(ids) for ids in tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]]
+    batches = token_budget_batches(lengths, max_tokens)
+
+    rows, reference = [], None
+    for variant, (predict_fn, size_mb) in built.items():
+        predictions, probabilities, profiler = evaluate_predictor(predict_fn, texts, batches)
+        metrics = calculate_metrics(labels, predictions)
+        summary = profiler.summary()
+        print(f"[{num_val}] {variant}: {size_mb:.1f} MB, accuracy {metrics['accuracy']:.4f}, "
+              f"f1 {metrics['f1']:.4f} | {format_summary(summary)}")
+        if save_results and variant != "fp32":
+            output_dir = f"{model_name}-{variant.replace('_', '-')}_fine_tuned_on_{num_val}"
+            os.makedirs(output_dir, exist_ok=True)
+            pd.DataFrame([metrics]).to_csv(os.path.join(output_dir, "metrics.csv"), index=False)
+            profiler.save(output_dir)
+
+        row = {"num_val": num_val, "variant": variant, "size_mb": size_mb, **metrics,
+               "p50_time": summary["p50_time"], "p95_time": summary["p95_time"],
+               "samples_per_s": summary["samples_per_s"]}
+        if variant == "fp32":
+            reference = (row, predictions, probabilities)
+        if reference is not None:
+            row.update({
+                "accuracy_drop": reference[0]["accuracy"] - row["accuracy"],
+                "f1_drop": reference[0]["f1"] - row["f1"],
+                "agreement": float(np.mean(predictions == reference[1])),
+                "mean_prob_diff": float(np.mean(np.abs(probabilities - reference[2]))),
+                "speedup": row["samples_per_s"] / reference[0]["samples_per_s"],
+                "size_ratio": row["size_mb"] / reference[0]["size_mb"],
+            })
+        rows.append(row)
+    return rows
+
+
+def load_test_texts(balanced_dir, limit=None):
+    """Testi (`concatenate_fields`) ed etichette del test set bilanciato."""
+    df = load_split("test", balanced_dir, columns=TEXT_FIELDS + ["label"])
+    if limit:
+        df = df.iloc[:limit]
+    return texts_from_frame(df), df["label"].to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Esporta in ONNX, quantizza in int8 e confronta con il modello fp32.")
+    parser.add_argument("--model-name", default="distilbert-base-uncased")
+    parser.add_argument("--num-val", nargs="+", default=["1000", "2000", "5000", "9000"],
+                        help="Checkpoint fine_tuned_model_<model_name>_<n> da confrontare.")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--balanced-dir", default="../dataset_completo/balanced_datasets")
+    parser.add_argument("--max-tokens", type=int, default=4096, help="Budget di token per batch.")
+    parser.add_argument("--max-length", type=int, default=512, help="Token massimi per testo.")
+    parser.add_argument("--threads", type=int, default=None, help="Thread di torch e ONNX Runtime.")
+    parser.add_argument("--limit", type=int, default=None, help="Valuta solo i primi N esempi del test set.")
+    parser.add_argument("--force-export", action="store_true", help="Rifà esportazione e quantizzazione.")
+    parser.add_argument("--output", default="quantization_comparison.csv")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    texts, labels = load_test_texts(args.balanced_dir, args.limit)
+    rows = []
+    for num_val in args.num_val:
+        fine_tuned_path = checkpoint_path(args.model_name, num_val)
+        if not os.path.isdir(fine_tuned_path):
+            print(f"Checkpoint {fine_tuned_path} non trovato, salto.")
+            continue
+        rows.extend(compare_checkpoint(args.model_name, fine_tuned_path, num_val, texts, labels, args.variants,
+                                       args.max_tokens, args.max_length, args.threads, args.force_export))
+    if rows:
+        comparison = pd.DataFrame(rows)
+        comparison.to_csv(args.output, index=False)
+        print(comparison.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+
+
+if __name__ == "__main__":
+    main()
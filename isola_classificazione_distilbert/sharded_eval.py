@@ -0,0 +1,273 @@
+"""
+Valutazione data-parallel del classificatore DistilBERT su CPU: il test set viene diviso in N shard e
+ogni shard è valutato da un processo separato.
+
+`evaluate_bert_model` (eval.ipynb) usa un solo processo: su CPU con molti core i thread di un
+solo forward da 8 esempi non li tengono tutti occupati. Qui:
+1. il processo principale calcola le lunghezze in token del test set (anche tramite `TokenCache`)
+   e lo divide in `workers` shard con la stessa distribuzione di lunghezze (esempi ordinati per
+   lunghezza e assegnati a turno); i worker ricevono i testi e li tokenizzano dentro la misura di
+   ogni batch, come `evaluate_bert_model`;
+2. ogni worker (`spawn`) imposta `torch.set_num_threads(cores // workers)`, carica il modello
+   una volta con `load_model` e segnala di essere pronto; la valutazione parte per tutti insieme,
+   così il caricamento non entra nei tempi;
+3. le predizioni degli shard vengono rimesse nell'ordine del dataset e i tempi dei batch di tutti
+   i worker confluiscono in un solo `BatchProfiler` (CPU/RAM campionate dal processo principale,
+   RSS sommato sui worker): un solo metrics.csv, avg_system_metrics.csv, batch_trace.csv e
+   confusion_matrix.png nella cartella dei risultati di eval.ipynb.
+
+Con `--scaling` la valutazione viene ripetuta con 1, 2, 4, ... worker fino al numero di core e
+sharded_scaling.csv riporta throughput, speedup ed efficienza (speedup / worker) rispetto a un
+solo processo con tutti i thread.
+
+Esempio:
+    python sharded_eval.py --fine-tuned-path ./fine_tuned_model_distilbert-base-uncased_9000 \\
+        --num-val 9000 --workers 8 --scaling
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from classifier import TEXT_FIELDS, calculate_metrics, load_model, save_confusion_matrix, texts_from_frame  # noqa: E402
+from dataset_io import load_split  # noqa: E402
+from system_profiler import BatchProfiler, format_summary  # noqa: E402
+from token_batches import token_budget_batches  # noqa: E402
+
+
+def available_cores():
+    """Core utilizzabili dal processo (affinità della CPU, se disponibile)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def shard_indices(lengths, num_shards):
+    """
+    Divide gli esempi in `num_shards` shard con lo stesso numero di esempi e di token: gli esempi
+    ordinati per lunghezza sono assegnati a turno agli shard.
+
+    :return: Un array di indici (ordinati) per shard.
+    """
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    return [np.sort(order[shard::num_shards]) for shard in range(num_shards)]
+
+
+def shard_batches(lengths, batch_size=8, max_tokens=None):
+    """Batch di uno shard come in `evaluate_bert_model`: budget di token o `batch_size` esempi in ordine."""
+    if max_tokens:
+        return token_budget_batches(lengths, max_tokens)
+    return [list(range(i, min(i + batch_size, len(lengths)))) for i in range(0, len(lengths), batch_size)]
+
+
+def _shard_worker(shard, threads, model_args, texts, lengths, batch_size, max_tokens, max_length, ready, start,
+                  results):
+    torch.set_num_threads(threads)
+    model, tokenizer = load_model(*model_args, device="cpu")
+    model.eval()
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = 'right'
+    ready.put(shard)
+    start.wait()
+
+    # Solo i tempi dei batch: le risorse le campiona il processo principale
+    profiler = BatchProfiler()
+    predictions = np.zeros(len(texts), dtype=np.int64)
+    for indices in shard_batches(lengths, batch_size, max_tokens):
+        with profiler.batch(len(indices)):
+            inputs = tokenizer([texts[i] for i in indices], return_tensors="pt", truncation=True, padding=True,
+                               max_length=max_length)
+            with torch.no_grad():
+                predictions[indices] = model(**inputs).logits.argmax(dim=-1).numpy()
+    results.put((shard, predictions, profiler.batches))
+
+
+def _wait(messages, processes, count, timeout=None):
+    """Legge `count` messaggi dalla coda; se un worker termina con errore solleva RuntimeError."""
+    items = []
+    deadline = time.perf_counter() + timeout if timeout else None
+    while len(items) < count:
+        try:
+            items.append(messages.get(timeout=1.0))
+        except queue.Empty:
+            failed = [p.exitcode for p in processes if p.exitcode not in (None, 0)]
+            if failed:
+                raise RuntimeError(f"un worker della valutazione è terminato con codice {failed[0]}")
+            if deadline is not None and time.perf_counter() > deadline:
+                raise RuntimeError("timeout in attesa dei worker della valutazione")
+    return items
+
+
+def run_sharded(model_args, texts, lengths, workers, threads=None, batch_size=8, max_tokens=None, max_length=512,
+                load_timeout=600):
+    """
+    Valuta `texts` con `workers` processi.
+
+    :param model_args: Argomenti di `load_model` (model_name, fine_tuned, fine_tuned_path).
+    :param texts: Testi da classificare.
+    :param lengths: Numero di token (troncati a `max_length`) di ogni testo, per shard e batch.
+    :param threads: Thread di torch per worker (default: core disponibili / worker).
+    :return: Predizioni nell'ordine di `texts` e `BatchProfiler` con i batch di tutti i worker.
+    """
+    threads = threads or max(1, available_cores() // workers)
+    lengths = np.asarray(lengths)
+    shards = shard_indices(lengths, workers)
+    context = multiprocessing.get_context("spawn")
+    ready, results, start = context.Queue(), context.Queue(), context.Event()
+    processes = [context.Process(target=_shard_worker, daemon=True,
+                                 args=(shard, threads, model_args, [texts[i] for i in indices], lengths[indices],
+                                       batch_size, max_tokens, max_length, ready, start, results))
+                 for shard, indices in enumerate(shards)]
+    for process in processes:
+        process.start()
+    try:
+        _wait(ready, processes, workers, load_timeout)
+        predictions = np.zeros(len(texts), dtype=np.int64)
+        with BatchProfiler(include_children=True) as profiler:
+            start.set()
+            for shard, shard_predictions, batches in _wait(results, processes, workers):
+                predictions[shards[shard]] = shard_predictions
+                profiler.batches.extend(batches)
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    # time.perf_counter è lo stesso orologio monotono in tutti i processi: i batch si ordinano per inizio
+    profiler.batches.sort(key=lambda b: b["start"])
+    for index, batch in enumerate(profiler.batches):
+        batch["batch"] = index
+    return predictions, profiler
+
+
+def text_lengths(tokenizer, texts, token_cache=None, max_length=512):
+    """Numero di token (troncati a `max_length`) dei testi, dalla `TokenCache` se indicata."""
+    encoded = token_cache.encode(texts) if token_cache is not None else \
+        tokenizer(list(texts), truncation=True, max_length=max_length)['input_ids']
+    return np.array([len(ids) for ids in encoded])
+
+
+def evaluate_sharded(model_name, fine_tuned, fine_tuned_path, eval_dataset, num_val, workers=None, threads=None,
+                     token_cache=None, batch_size=8, max_tokens=None, output_dir=None):
+    """
+    Valutazione a shard con gli stessi output di `evaluate_bert_model`.
+
+    :param eval_dataset: Dataset (o dizionario) con le colonne `text` e `label`.
+    :param workers: Numero di processi (default: core disponibili).
+    :param threads: Thread di torch per worker (default: core disponibili / worker).
+    :param token_cache: `TokenCache` del tokenizer da cui leggere le lunghezze (opzionale); dentro
+        la misura i worker tokenizzano sempre i testi.
+    :param output_dir: Cartella dei risultati (default: quella di eval.ipynb).
+    :return: Metriche e riepilogo delle metriche di sistema.
+    """
+    from transformers import AutoTokenizer
+
+    workers = workers or available_cores()
+    tokenizer = token_cache.tokenizer if token_cache is not None else AutoTokenizer.from_pretrained(model_name)
+    texts = list(eval_dataset['text'])
+    lengths = text_lengths(tokenizer, texts, token_cache)
+    true_labels = np.asarray(eval_dataset['label'])
+
+    predictions, profiler = run_sharded((model_name, fine_tuned, fine_tuned_path), texts, lengths, workers, threads,
+                                        batch_size, max_tokens)
+    metrics = calculate_metrics(true_labels, predictions)
+
+    output_dir = output_dir or (f"{model_name}_fine_tuned_on_{num_val}" if fine_tuned else f"{model_name}_not_fine_tuned")
+    os.makedirs(output_dir, exist_ok=True)
+    pd.DataFrame([metrics]).to_csv(os.path.join(output_dir, "metrics.csv"), index=False)
+    summary = profiler.save(output_dir)
+    save_confusion_matrix(true_labels, predictions, os.path.join(output_dir, "confusion_matrix.png"))
+    print(f"{workers} worker: {format_summary(summary)}")
+    print(" | ".join(f"{name} {value:.4f}" for name, value in metrics.items()))
+    return metrics, summary
+
+
+def worker_counts(max_workers):
+    """1, 2, 4, ... fino a `max_workers` (incluso)."""
+    counts = [1]
+    while counts[-1] * 2 < max_workers:
+        counts.append(counts[-1] * 2)
+    return counts + [max_workers] if max_workers > 1 else counts
+
+
+def scaling_report(model_name, fine_tuned, fine_tuned_path, eval_dataset, num_val, max_workers=None,
+                   token_cache=None, batch_size=8, max_tokens=None, output_dir=None):
+    """
+    Ripete la valutazione con 1, 2, 4, ... worker (thread per worker = core / worker) e salva
+    throughput, speedup ed efficienza in sharded_scaling.csv. Gli output standard restano quelli
+    dell'ultima esecuzione (`max_workers`).
+
+    :return: DataFrame con una riga per numero di worker.
+    """
+    max_workers = max_workers or available_cores()
+    rows = []
+    for workers in worker_counts(max_workers):
+        metrics, summary = evaluate_sharded(model_name, fine_tuned, fine_tuned_path, eval_dataset, num_val, workers,
+                                            None, token_cache, batch_size, max_tokens, output_dir)
+        rows.append({"workers": workers, "threads_per_worker": max(1, available_cores() // workers),
+                     "samples_per_s": summary["samples_per_s"], "wall_time": summary["wall_time"],
+                     "p50_time": summary["p50_time"], "cpu": summary["cpu"], "peak_rss_mb": summary["peak_rss_mb"],
+                     "accuracy": metrics["accuracy"]})
+    report = pd.DataFrame(rows)
+    report["speedup"] = report["samples_per_s"] / report["samples_per_s"].iloc[0]
+    report["efficiency"] = report["speedup"] / report["workers"]
+
+    output_dir = output_dir or (f"{model_name}_fine_tuned_on_{num_val}" if fine_tuned else f"{model_name}_not_fine_tuned")
+    report.to_csv(os.path.join(output_dir, "sharded_scaling.csv"), index=False)
+    print(report.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+    return report
+
+
+def load_test_dataset(balanced_dir, limit=None):
+    """Testi (`concatenate_fields`) ed etichette del test set del manifest."""
+    df = load_split("test", balanced_dir, columns=TEXT_FIELDS + ["label"])
+    if limit:
+        df = df.iloc[:limit]
+    return {"text": texts_from_frame(df), "label": df["label"].tolist()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Valutazione su CPU divisa tra più processi, con report di scaling.")
+    parser.add_argument("--model-name", default="distilbert-base-uncased")
+    parser.add_argument("--fine-tuned-path", default=None, help="Checkpoint fine-tunato (default: modello base).")
+    parser.add_argument("--num-val", default="9000", help="Dimensione del training set (cartella dei risultati).")
+    parser.add_argument("--balanced-dir", default="../dataset_completo/balanced_datasets")
+    parser.add_argument("--workers", type=int, default=None, help="Processi (default: core disponibili).")
+    parser.add_argument("--threads", type=int, default=None, help="Thread di torch per worker (default: core / worker).")
+    parser.add_argument("--max-tokens", type=int, default=4096,
+                        help="Budget di token per batch (0 = batch fissi da --batch-size esempi).")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=None, help="Valuta solo i primi N esempi del test set.")
+    parser.add_argument("--no-token-cache", action="store_true", help="Tokenizza senza la cache su disco.")
+    parser.add_argument("--scaling", action="store_true",
+                        help="Ripete la valutazione con 1, 2, 4, ... worker fino a --workers e salva sharded_scaling.csv.")
+    args = parser.parse_args()
+
+    fine_tuned = args.fine_tuned_path is not None
+    eval_dataset = load_test_dataset(args.balanced_dir, args.limit)
+    token_cache = None
+    if not args.no_token_cache:
+        from transformers import AutoTokenizer
+        from token_cache import TokenCache
+
+        token_cache = TokenCache(AutoTokenizer.from_pretrained(args.model_name), max_length=512)
+    if args.scaling:
+        scaling_report(args.model_name, fine_tuned, args.fine_tuned_path, eval_dataset, args.num_val, args.workers,
+                       token_cache, args.batch_size, args.max_tokens or None)
+    else:
+        evaluate_sharded(args.model_name, fine_tuned, args.fine_tuned_path, eval_dataset, args.num_val, args.workers,
+                         args.threads, token_cache, args.batch_size, args.max_tokens or None)
+
+
+if __name__ == "__main__":
+    main()
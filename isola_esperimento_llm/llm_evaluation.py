@@ -0,0 +1,462 @@
+"""
+Valutazione dei modelli causali (Llama, Mistral) sul task 0/1 con generazione realmente batch.
+
+I prompt vengono ordinati per lunghezza e raggruppati in batch (numero fisso di esempi o budget
+di token); ogni batch è paddato a sinistra, così l'ultimo token di ogni prompt è allineato e i
+token generati partono tutti dalla stessa colonna, con la maschera di attenzione che esclude il
+padding. Gli output (metrics.csv, avg_system_metrics.csv, confusion_matrix.png) sono gli stessi
+della versione precedente in eval_model.ipynb.
+
+Oltre alla generazione (`scoring="generate"`) è disponibile il punteggio con un solo forward
+(`scoring="logits"`): per ogni prompt si confrontano i logit del prossimo token per '0' e '1',
+senza campionamento e quindi senza risposte non valide. La differenza dei due logit diventa una
+probabilità (calibrabile con `fit_calibration` su un campione di validazione) da cui si ricavano
+predizioni, curva ROC e metriche al variare della soglia.
+
+Tutti i prompt iniziano con lo stesso blocco di istruzioni di `prompt_template`: con una
+`PrefixCache` le chiavi/valori di attenzione di quel prefisso sono calcolati una sola volta per
+modello e riusati in ogni batch, così il prefill elabora solo la parte specifica di ogni bug.
+"""
+import copy
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+import torch
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, confusion_matrix, f1_score, precision_score, recall_score, roc_auc_score, roc_curve
+from tqdm import tqdm
+
+from system_profiler import BatchProfiler, format_summary  # dataset_completo (già nel sys.path dei notebook)
+from token_batches import token_budget_batches
+
+# Generazione usata finora in eval_model.ipynb
+DEFAULT_GENERATION_KWARGS = {"max_new_tokens": 2, "do_sample": True, "temperature": 0.7}
+
+# Risposte attese dal prompt_template, nell'ordine delle etichette
+LABELS = ('0', '1')
+
+
+def calculate_metrics(true_labels, predictions):
+    """
+    Calcola le metriche di valutazione, tra cui precisione, recall, e F1-score
+    con il parametro zero_division per gestire i casi di divisione per zero.
+    """
+    metrics = {
+        'accuracy': accuracy_score(true_labels, predictions),
+        'precision': precision_score(true_labels, predictions, average='binary', zero_division=0),
+        'recall': recall_score(true_labels, predictions, average='binary', zero_division=0),
+        'f1': f1_score(true_labels, predictions, average='binary', zero_division=0)
+    }
+
+    return metrics
+
+
+def output_directory(model_name, fine_tuned, num_val):
+    """Cartella dei risultati: `<modello>_fine_tuned_on_<num_val>` o `<modello>_not_fine_tuned`."""
+    if fine_tuned:
+        return f"{model_name}_fine_tuned_on_{num_val}"
+    return f"{model_name}_not_fine_tuned"
+
+
+def prompt_batches(lengths, batch_size=8, max_tokens=None, max_new_tokens=2):
+    """
+    Batch di indici ordinati per lunghezza del prompt, per ridurre al minimo il padding.
+
+    :param lengths: Numero di token di ogni prompt.
+    :param batch_size: Numero massimo di prompt per batch.
+    :param max_tokens: Budget di token per batch (prompt più token generati, padding incluso);
+        None = solo `batch_size`.
+    :param max_new_tokens: Token generati per prompt, contati nel budget.
+    :return: Liste di indici, una per batch.
+    """
+    lengths = np.asarray(lengths) + max_new_tokens
+    budget = max_tokens if max_tokens else int(lengths.max(initial=1)) * batch_size
+    return token_budget_batches(lengths, budget, max_batch_size=batch_size)
+
+
+def left_pad(tokenizer, input_ids, device):
+    """Padding a sinistra di prompt già tokenizzati, con maschera di attenzione."""
+    return tokenizer.pad({"input_ids": [np.asarray(ids).tolist() for ids in input_ids]}, padding=True,
+                         padding_side="left", return_tensors="pt").to(device)
+
+
+def common_prefix_length(encoded):
+    """Numero di token iniziali comuni a tutti i prompt tokenizzati."""
+    length = min(len(ids) for ids in encoded)
+    reference = np.asarray(encoded[0][:length])
+    for ids in encoded[1:]:
+        mismatch = np.flatnonzero(np.asarray(ids[:length]) != reference[:length])
+        if len(mismatch):
+            length = int(mismatch[0])
+    return length
+
+
+class PrefixCache:
+    """
+    Cache chiavi/valori del prefisso statico dei prompt (il blocco di istruzioni di `prompt_template`),
+    calcolata con un solo forward e riusata per tutti i batch.
+
+    Il prefisso è la sequenza di token comune a tutti i prompt indicati (quindi coincide esattamente
+    con la tokenizzazione del prompt intero), lasciando almeno un token specifico per prompt. In ogni
+    batch il padding dei suffissi va tra prefisso e suffisso: la maschera lo esclude e le posizioni,
+    ricavate dalla maschera, proseguono da quelle del prefisso.
+
+    :param model: Modello causale.
+    :param tokenizer: Tokenizer del modello.
+    :param prompts: Prompt (testi, o id se `encoded=True`) da cui ricavare il prefisso comune.
+    :param token_cache: `TokenCache` da cui leggere gli id dei prompt (opzionale).
+    :param encoded: Se True `prompts` sono già liste di id.
+    """
+
+    def __init__(self, model, tokenizer, prompts, token_cache=None, encoded=False, max_length=2048):
+        encoded_prompts = prompts if encoded else encode_prompts(tokenizer, prompts, token_cache, max_length)
+        length = min(common_prefix_length(encoded_prompts), min(len(ids) for ids in encoded_prompts) - 1)
+        self.ids = np.asarray(encoded_prompts[0][:length], dtype=np.int64)
+        self.length = length
+        self.hits = 0  # prompt serviti dalla cache
+        self.misses = 0  # prompt che non iniziano con il prefisso (prefill completo)
+        with torch.no_grad():
+            self.past_key_values = model(input_ids=torch.tensor(self.ids[None, :], device=model.device),
+                                         use_cache=True).past_key_values
+
+    def covers(self, input_ids):
+        """True se tutti i prompt iniziano con il prefisso e hanno almeno un token in più."""
+        return all(len(ids) > self.length and np.array_equal(np.asarray(ids[:self.length]), self.ids)
+                   for ids in input_ids)
+
+    def expand(self, batch_size):
+        """Copia della cache ripetuta per `batch_size` prompt (`generate` e il forward la estendono)."""
+        cache = copy.deepcopy(self.past_key_values)
+        cache.batch_repeat_interleave(batch_size)
+        return cache
+
+    @property
+    def saved_tokens(self):
+        """Token di prefill risparmiati finora."""
+        return self.hits * self.length
+
+
+def batch_inputs(tokenizer, input_ids, device, prefix_cache=None):
+    """
+    Input di un batch di prompt: padding a sinistra oppure, se `prefix_cache` copre tutti i prompt,
+    prefisso + suffissi paddati a sinistra con la cache del prefisso in `past_key_values`.
+    """
+    if prefix_cache is None or not prefix_cache.covers(input_ids):
+        if prefix_cache is not None:
+            prefix_cache.misses += len(input_ids)
+        return dict(left_pad(tokenizer, input_ids, device))
+    prefix_cache.hits += len(input_ids)
+    suffixes = left_pad(tokenizer, [ids[prefix_cache.length:] for ids in input_ids], device)
+    prefix = torch.tensor(prefix_cache.ids, device=device).expand(len(input_ids), -1)
+    return {
+        "input_ids": torch.cat([prefix, suffixes["input_ids"]], dim=1),
+        "attention_mask": torch.cat([torch.ones_like(prefix), suffixes["attention_mask"]], dim=1),
+        "past_key_values": prefix_cache.expand(len(input_ids)),
+    }
+
+
+def generate_batch(model, tokenizer, input_ids, prefix_cache=None, **generation_kwargs):
+    """
+    Genera la risposta per un batch di prompt già tokenizzati (senza padding).
+
+    :param input_ids: Liste di id, una per prompt.
+    :param prefix_cache: `PrefixCache` del prefisso comune (opzionale).
+    :param generation_kwargs: Argomenti di `model.generate` (es. `max_new_tokens`, `do_sample`).
+    :return: Testi generati (solo i nuovi token), nello stesso ordine dei prompt.
+    """
+    inputs = batch_inputs(tokenizer, input_ids, model.device, prefix_cache)
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            num_return_sequences=1,
+            pad_token_id=tokenizer.pad_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            **generation_kwargs,
+        )
+    # Con il padding a sinistra i nuovi token iniziano per tutti dopo la colonna dell'ultimo token del prompt
+    return tokenizer.batch_decode(outputs[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+
+
+def label_token_ids(tokenizer, labels=LABELS):
+    """
+    Id del token con cui il modello risponde ciascuna etichetta: l'ultimo token della sua codifica
+    (i tokenizer SentencePiece, es. Mistral, possono anteporre un token di spazio alla cifra).
+    """
+    return [tokenizer.encode(label, add_special_tokens=False)[-1] for label in labels]
+
+
+def last_token_logits(model, inputs):
+    """Logit del prossimo token dopo l'ultimo token di ogni prompt (vedi `batch_inputs`)."""
+    # Con il padding a sinistra le posizioni vanno ricavate dalla maschera (come fa `generate`)
+    position_ids = (inputs["attention_mask"].cumsum(-1) - 1).clamp(min=0)
+    past_key_values = inputs.get("past_key_values")
+    # Con la cache del prefisso il forward elabora solo i token non ancora in cache
+    start = past_key_values.get_seq_length() if past_key_values is not None else 0
+    kwargs = {"input_ids": inputs["input_ids"][:, start:], "attention_mask": inputs["attention_mask"],
+              "position_ids": position_ids[:, start:], "past_key_values": past_key_values}
+    try:
+        outputs = model(**kwargs, logits_to_keep=1)
+    except TypeError:  # transformers senza `logits_to_keep`: logit di tutte le posizioni
+        outputs = model(**kwargs)
+    return outputs.logits[:, -1, :]
+
+
+def score_batch(model, tokenizer, input_ids, label_ids, prefix_cache=None):
+    """
+    Punteggio di un batch di prompt con un solo forward.
+
+    :param input_ids: Liste di id, una per prompt (senza padding).
+    :param label_ids: Id dei token di '0' e '1' (vedi `label_token_ids`).
+    :param prefix_cache: `PrefixCache` del prefisso comune (opzionale).
+    :return: Array con logit('1') - logit('0') per prompt: il log-odds di '1' tra le due risposte.
+    """
+    inputs = batch_inputs(tokenizer, input_ids, model.device, prefix_cache)
+    with torch.no_grad():
+        logits = last_token_logits(model, inputs)[:, label_ids].float()
+    return (logits[:, 1] - logits[:, 0]).cpu().numpy()
+
+
+def encode_prompts(tokenizer, texts, token_cache=None, max_length=2048):
+    """Id (senza padding) dei prompt, dalla `TokenCache` se indicata."""
+    if token_cache is not None:
+        return token_cache.encode(texts)
+    return tokenizer(list(texts), truncation=True, max_length=max_length)['input_ids']
+
+
+def run_batches(model, batches, step):
+    """
+    Esegue `step(indices)` per ogni batch misurando il tempo di ogni batch, mentre CPU, RAM e GPU
+    sono campionate in background (vedi system_profiler.py). Un batch che fallisce viene segnalato
+    e saltato.
+
+    :return: `BatchProfiler` con i batch completati.
+    """
+    with BatchProfiler(model.device) as profiler:
+        for batch_idx, indices in enumerate(tqdm(batches, desc="Evaluating", unit="batch")):
+            try:
+                with profiler.batch(len(indices), batch_idx):
+                    step(indices)
+            except Exception as e:
+                print(f"⚠️ Error processing batch: {e}")
+    return profiler
+
+
+def score_prompts(model, tokenizer, encoded, batches, prefix_cache=None):
+    """
+    Punteggi (log-odds di '1', vedi `score_batch`) di tutti i prompt, nell'ordine di `encoded`;
+    NaN per i prompt dei batch falliti.
+
+    :return: Punteggi e `BatchProfiler` della valutazione.
+    """
+    label_ids = label_token_ids(tokenizer)
+    scores = np.full(len(encoded), np.nan)
+
+    def step(indices):
+        scores[indices] = score_batch(model, tokenizer, [encoded[i] for i in indices], label_ids, prefix_cache)
+
+    return scores, run_batches(model, batches, step)
+
+
+def score_dataset(model, tokenizer, dataset, token_cache=None, batch_size=8, max_tokens=None, max_length=2048,
+                  prefix_cache=None):
+    """Punteggi dei prompt (`text`) di un dataset, ad esempio del campione di validazione per `fit_calibration`."""
+    tokenizer.padding_side = 'left'
+    encoded = encode_prompts(tokenizer, dataset['text'], token_cache, max_length)
+    batches = prompt_batches([len(ids) for ids in encoded], batch_size, max_tokens, max_new_tokens=0)
+    return score_prompts(model, tokenizer, encoded, batches, prefix_cache)[0]
+
+
+def fit_calibration(scores, labels):
+    """
+    Platt scaling: regressione logistica sul punteggio, p('1') = sigmoid(a * punteggio + b).
+    Senza calibrazione (a=1, b=0) la probabilità è il softmax dei logit di '0' e '1'.
+
+    :param scores: Punteggi di un campione di validazione (`score_dataset`).
+    :param labels: Etichette vere dello stesso campione.
+    :return: Coppia (a, b).
+    """
+    scores, labels = np.asarray(scores, dtype=float), np.asarray(labels)
+    valid = ~np.isnan(scores)
+    model = LogisticRegression(C=1e6).fit(scores[valid].reshape(-1, 1), labels[valid])
+    return float(model.coef_[0, 0]), float(model.intercept_[0])
+
+
+def probabilities(scores, calibration=None):
+    """Probabilità di '1' dai punteggi, con la calibrazione (a, b) di `fit_calibration` se indicata."""
+    a, b = calibration if calibration is not None else (1.0, 0.0)
+    return 1.0 / (1.0 + np.exp(-(a * np.asarray(scores, dtype=float) + b)))
+
+
+def threshold_sweep(true_labels, probs, thresholds=None):
+    """
+    Metriche al variare della soglia di decisione su p('1').
+
+    :param true_labels: Etichette vere.
+    :param probs: Probabilità di '1'.
+    :param thresholds: Soglie da valutare (default: 0, 0.01, ..., 1).
+    :return: DataFrame con threshold, accuracy, precision, recall, f1, tpr e fpr per soglia.
+    """
+    labels = np.asarray(true_labels).astype(bool)
+    thresholds = np.linspace(0, 1, 101) if thresholds is None else np.asarray(thresholds)
+    predicted = np.asarray(probs)[None, :] >= thresholds[:, None]
+    tp = (predicted & labels).sum(axis=1)
+    fp = (predicted & ~labels).sum(axis=1)
+    fn = (~predicted & labels).sum(axis=1)
+    tn = len(labels) - tp - fp - fn
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        fpr = np.where(fp + tn > 0, fp / (fp + tn), 0.0)
+    return pd.DataFrame({'threshold': thresholds, 'accuracy': (tp + tn) / len(labels), 'precision': precision,
+                         'recall': recall, 'f1': f1, 'tpr': recall, 'fpr': fpr})
+
+
+def save_roc_curve(true_labels, probs, path):
+    """Salva la curva ROC e restituisce l'AUC (NaN se il campione ha una sola classe)."""
+    if len(set(true_labels)) < 2:
+        return float('nan')
+    fpr, tpr, _ = roc_curve(true_labels, probs)
+    auc = roc_auc_score(true_labels, probs)
+    plt.figure(figsize=(5, 5))
+    plt.plot(fpr, tpr, label=f"AUC = {auc:.4f}")
+    plt.plot([0, 1], [0, 1], linestyle='--', color='grey')
+    plt.title('ROC Curve')
+    plt.xlabel('False Positive Rate')
+    plt.ylabel('True Positive Rate')
+    plt.legend(loc='lower right')
+    plt.savefig(path, format="png")
+    plt.close()
+    return auc
+
+
+def evaluate_model(model, tokenizer, eval_dataset, model_name, fine_tuned, num_val, token_cache=None,
+                   batch_size=8, max_tokens=None, max_length=2048, generation_kwargs=None,
+                   scoring="generate", calibration=None, threshold=0.5, prefix_cache=None):
+    """
+    Valuta il modello sui prompt di `eval_dataset`, generando la risposta ('0' o '1') oppure
+    confrontando i logit delle due risposte.
+
+    :param model: Modello causale.
+    :param tokenizer: Tokenizer del modello.
+    :param eval_dataset: Dataset con le colonne `text`, `label` e `source`.
+    :param model_name: Nome del modello (cartella dei risultati).
+    :param fine_tuned: Se True i risultati vanno in `<modello>_fine_tuned_on_<num_val>`.
+    :param num_val: Dimensione del training set del modello fine-tunato.
+    :param token_cache: `TokenCache` da cui leggere gli id dei prompt (opzionale).
+    :param batch_size: Numero massimo di prompt per batch.
+    :param max_tokens: Budget di token per batch (opzionale, vedi `prompt_batches`).
+    :param max_length: Lunghezza massima dei prompt (troncamento) se `token_cache` non è indicata.
+    :param generation_kwargs: Argomenti di `model.generate` (default: `DEFAULT_GENERATION_KWARGS`).
+    :param scoring: `"generate"` (generazione e parsing della risposta) o `"logits"` (un forward per
+        prompt; salva anche probabilities.csv, threshold_sweep.csv e roc_curve.png).
+    :param calibration: Coppia (a, b) di `fit_calibration` (solo `scoring="logits"`).
+    :param threshold: Soglia su p('1') per predire '1' (solo `scoring="logits"`).
+    :param prefix_cache: `PrefixCache` del blocco di istruzioni comune (opzionale); True = la calcola
+        dai prompt di `eval_dataset`.
+    :return: metrics, predictions, true_labels, generated_texts, prediction_sources (nell'ordine del dataset)
+    """
+    print("\nStarting evaluation phase...")
+    model.eval()
+    generation_kwargs = {**DEFAULT_GENERATION_KWARGS, **(generation_kwargs or {})}
+
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = 'left'
+
+    output_dir = output_directory(model_name, fine_tuned, num_val)
+    os.makedirs(output_dir, exist_ok=True)
+
+    texts, labels, sources = eval_dataset['text'], eval_dataset['label'], eval_dataset['source']
+    encoded = encode_prompts(tokenizer, texts, token_cache, max_length)
+    max_new_tokens = generation_kwargs.get("max_new_tokens", 2) if scoring == "generate" else 0
+    batches = prompt_batches([len(ids) for ids in encoded], batch_size, max_tokens, max_new_tokens)
+    if prefix_cache is True:
+        prefix_cache = PrefixCache(model, tokenizer, encoded, encoded=True)
+    if prefix_cache is not None:
+        hits, misses = prefix_cache.hits, prefix_cache.misses
+
+    if scoring == "logits":
+        scores, profiler = score_prompts(model, tokenizer, encoded, batches, prefix_cache)
+        probs = probabilities(scores, calibration)
+        responses = [None if np.isnan(p) else LABELS[int(p >= threshold)] for p in probs]
+    elif scoring == "generate":
+        responses = [None] * len(encoded)
+
+        def step(indices):
+            generated = generate_batch(model, tokenizer, [encoded[i] for i in indices], prefix_cache, **generation_kwargs)
+            for i, text in zip(indices, generated):
+                responses[i] = text.strip()
+
+        profiler = run_batches(model, batches, step)
+    else:
+        raise ValueError(f"scoring deve essere 'generate' o 'logits', non {scoring!r}")
+
+    if prefix_cache is not None:
+        total = sum(len(ids) for ids in encoded)
+        saved = (prefix_cache.hits - hits) * prefix_cache.length
+        print(f"Prefix cache: {prefix_cache.length} token di prefisso, {prefix_cache.hits - hits} prompt dalla cache, "
+              f"{prefix_cache.misses - misses} con prefill completo; token di prefill {total - saved} invece di "
+              f"{total} (-{saved / total:.1%})")
+
+    predictions, true_labels, generated_texts, prediction_sources = [], [], [], []
+    invalid = 0
+    for response, label, source in zip(responses, labels, sources):
+        if response in LABELS:
+            predictions.append(int(response))
+            true_labels.append(int(label))
+            generated_texts.append(response)
+            prediction_sources.append(source)
+        elif response is not None:
+            print(f"⚠️ Invalid response format: '{response}'")
+            invalid += 1
+
+    # No valid predictions? Return empty results
+    if not predictions:
+        print("No valid predictions were generated!")
+        return None, [], [], [], []
+
+    metrics = calculate_metrics(true_labels, predictions)
+    pd.DataFrame([metrics]).to_csv(os.path.join(output_dir, "metrics.csv"), index=False)
+
+    # Metriche di sistema (medie, percentili di latenza, picchi di memoria) e traccia per batch
+    if profiler.batches:
+        summary = profiler.save(output_dir)
+        print(f"✅ Metriche di sistema salvate in: {os.path.join(output_dir, 'avg_system_metrics.csv')} "
+              f"(per batch: batch_trace.csv)")
+        print(format_summary(summary))
+
+    if scoring == "logits":
+        scored = ~np.isnan(probs)
+        pd.DataFrame({"source": np.asarray(sources)[scored], "label": np.asarray(labels)[scored],
+                      "score": scores[scored], "probability": probs[scored]}).to_csv(
+            os.path.join(output_dir, "probabilities.csv"), index=False)
+        sweep = threshold_sweep(true_labels, probs[scored])
+        sweep.to_csv(os.path.join(output_dir, "threshold_sweep.csv"), index=False)
+        auc = save_roc_curve(true_labels, probs[scored], os.path.join(output_dir, "roc_curve.png"))
+        best = sweep.loc[sweep['f1'].idxmax()]
+        print(f"✅ ROC AUC: {auc:.4f} | best F1 {best['f1']:.4f} at threshold {best['threshold']:.2f}")
+
+    cm = confusion_matrix(true_labels, predictions, labels=[0, 1])
+    plt.figure(figsize=(6, 4))
+    sns.heatmap(cm, annot=True, fmt="d", cmap="Blues", xticklabels=['0', '1'], yticklabels=['0', '1'])
+    plt.title('Confusion Matrix')
+    plt.xlabel('Predicted')
+    plt.ylabel('True')
+    cm_path = os.path.join(output_dir, "confusion_matrix.png")
+    plt.savefig(cm_path, format="png")
+    plt.close()
+    print(f"✅ Confusion matrix saved at: {cm_path}")
+
+    print("\nEvaluation Results:")
+    print(f"Model: {model_name}")
+    print(f"Samples evaluated: {len(true_labels)}")
+    print(f"Invalid predictions: {invalid}")
+    print("\nMetrics:")
+    for metric_name, value in metrics.items():
+        print(f"{metric_name}: {value:.4f}")
+
+    return metrics, predictions, true_labels, generated_texts, prediction_sources
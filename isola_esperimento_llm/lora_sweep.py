@@ -0,0 +1,183 @@
+"""
+Sweep di fine-tuning LoRA su train_1000/2000/5000/9000 con un solo caricamento del modello base.
+
+Il modello quantizzato a 4 bit viene caricato una volta (fine_tuning.ipynb). Per ogni dimensione
+si applica un adattatore LoRA nuovo (`get_peft_model`), lo si addestra con le stesse impostazioni
+di SFTTrainer del notebook e lo si salva in `fine_tuned_model_<modello>_<n>` (la cartella letta
+da eval_model.ipynb). Poi `unload()` rimuove i layer LoRA e restituisce il modello base intatto,
+pronto per l'adattatore successivo: i pesi base non vengono né ricaricati né riquantizzati.
+
+Ogni dimensione scrive `<model_name>_fine_tuned_on_<n>/training_comparison.csv` (formato letto da
+comparison.py); lo sweep riprende dall'ultima dimensione completata (`lora_sweep_state.json`) e,
+dentro una dimensione avviata dallo sweep, dall'ultimo checkpoint del trainer (in `<modello>_<n>_sweep`,
+separata da `<modello>_<n>_ft` di fine_tuning.ipynb). Le valutazioni ogni `eval_steps` usano
+un sottoinsieme stratificato della validazione, quella completa viene fatta alla fine (vedi
+training_eval.py); training_comparison.csv riporta anche il tempo speso nelle valutazioni.
+"""
+import gc
+import os
+import sys
+
+import torch
+from peft import PeftModel, get_peft_model
+from transformers.trainer_utils import get_last_checkpoint
+from trl import SFTConfig, SFTTrainer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset_completo'))
+
+from dataset_io import load_hf_splits  # noqa: E402
+from token_cache import TokenCache  # noqa: E402
+from training_eval import DEFAULT_EVAL_SUBSAMPLE, EvalTimeCallback, eval_subsample  # noqa: E402
+from training_sweep import DEFAULT_SIZES, run_sweep, save_training_results, training_results  # noqa: E402
+from sft_packing import PackedCollator, auto_max_seq_length, pack_dataset  # noqa: E402
+
+PROMPT_COLUMNS = ['source', 'product', 'short_desc', 'priority', 'bug_severity', 'label']
+
+
+def formatting_prompts(examples, prompt_template, eos_token, include_label=True):
+    """Prompt di fine_tuning.ipynb, con la label solo se `include_label`."""
+    texts = []
+    for source, product, short_desc, priority, bug_severity, label in zip(
+        examples["source"], examples["product"], examples["short_desc"], examples["priority"],
+        examples["bug_severity"], examples["label"]
+    ):
+        texts.append(prompt_template.format(
+            source=source,
+            product=product,
+            short_desc=short_desc,
+            priority=priority,
+            bug_severity=bug_severity,
+            label=label if include_label else "",
+        ) + eos_token)
+    return {"text": texts}
+
+
+def load_sweep_data(tokenizer, prompt_template, sizes, balanced_dir, max_seq_length=2048):
+    """Split `train_<n>` di tutte le dimensioni e `val`, formattati e tokenizzati una volta sola."""
+    splits = {f"train_{size}": f"train_{size}" for size in sizes}
+    splits["val"] = "validation"
+    dataset = load_hf_splits(splits, balanced_dir=balanced_dir, columns=PROMPT_COLUMNS)
+    for name in dataset:
+        include_label = name != "val"  # Label nascosta nella validazione, come nel notebook
+        dataset[name] = dataset[name].map(
+            lambda x: formatting_prompts(x, prompt_template, tokenizer.eos_token, include_label), batched=True)
+
+    # I train annidati condividono la maggior parte dei testi: la cache li tokenizza una volta
+    token_cache = TokenCache(tokenizer, max_length=max_seq_length)
+    dataset = dataset.map(lambda x: token_cache(x["text"]), batched=True)
+    print(f"Token cache: {token_cache.hits} testi già in cache, {token_cache.misses} tokenizzati")
+    return dataset
+
+
+def run_lora_sweep(model, tokenizer, peft_config, prompt_template, model_name, sizes=DEFAULT_SIZES,
+                   balanced_dir="../dataset_completo/balanced_datasets", max_seq_length=2048, packing=False,
+                   dtype=torch.float16, num_train_epochs=5, eval_subsample_size=DEFAULT_EVAL_SUBSAMPLE,
+                   state_file="lora_sweep_state.json", force=False):
+    """
+    Addestra e salva un adattatore LoRA per ogni dimensione del training set.
+
+    :param model: Modello base già caricato (anche già avvolto da `get_peft_model`: l'adattatore
+        esistente viene rimosso prima di iniziare).
+    :param tokenizer: Tokenizer del modello.
+    :param peft_config: `LoraConfig` usata per ogni adattatore.
+    :param prompt_template: Template del prompt (con il segnaposto `{label}`).
+    :param model_name: Nome del modello, usato per le cartelle dei risultati come nel notebook.
+    :param sizes: Dimensioni del training set (split `train_<n>` del manifest).
+    :param balanced_dir: Cartella dei dataset bilanciati.
+    :param max_seq_length: Troncamento in tokenizzazione.
+    :param packing: Usa i blocchi impacchettati di sft_packing.py.
+    :param dtype: Tipo di calcolo (maschera del packing).
+    :param num_train_epochs: Epoche di training.
+    :param eval_subsample_size: Esempi di validazione per le valutazioni durante il training
+        (None = validazione completa).
+    :param state_file: File con le dimensioni completate (ripresa dopo un crash).
+    :param force: Ripete anche le dimensioni già completate.
+    :return: Dimensione -> riga di training_comparison.csv.
+    """
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = "right"
+    base_model = model.unload() if isinstance(model, PeftModel) else model
+    dataset = load_sweep_data(tokenizer, prompt_template, sizes, balanced_dir, max_seq_length)
+    directory = f"{model_name}".split("/")[-1].strip()
+
+    def checkpoint_dir(size):
+        return f"{directory}_{size}_sweep"
+
+    def train_size(size, resume):
+        nonlocal base_model
+        model = get_peft_model(base_model, peft_config)
+        model.print_trainable_parameters()
+        model.gradient_checkpointing_enable()
+        model.enable_input_require_grads()
+        model.train()
+
+        train_dataset, eval_dataset, data_collator = dataset[f"train_{size}"], dataset["val"], None
+        val_subsample = eval_subsample(eval_dataset, eval_subsample_size)
+        train_seq_length = auto_max_seq_length([len(ids) for ids in train_dataset["input_ids"]])
+        batch_size = 4
+        if packing:
+            pack_length = batch_size * train_seq_length
+            train_dataset = pack_dataset(train_dataset, pack_length, ignore_token_id=tokenizer.pad_token_id)
+            eval_dataset = pack_dataset(eval_dataset, pack_length, ignore_token_id=tokenizer.pad_token_id)
+            val_subsample = pack_dataset(val_subsample, pack_length, ignore_token_id=tokenizer.pad_token_id)
+            data_collator = PackedCollator(tokenizer.pad_token_id, dtype=dtype)
+            batch_size = 1
+
+        sft_config = SFTConfig(
+            output_dir=checkpoint_dir(size),
+            max_seq_length=train_seq_length,
+            dataset_text_field="text",
+            per_device_train_batch_size=batch_size,
+            per_device_eval_batch_size=batch_size,
+            num_train_epochs=num_train_epochs,
+            gradient_accumulation_steps=4,
+            evaluation_strategy="steps",
+            eval_steps=100,
+            save_strategy="steps",
+            save_steps=1000,
+            save_total_limit=3,
+            learning_rate=5e-5,
+            lr_scheduler_type="cosine",
+            warmup_ratio=0.05,
+            fp16=True,
+            logging_steps=50,
+            metric_for_best_model="eval_loss",
+            greater_is_better=False,
+            dataset_kwargs={"skip_prepare_dataset": True},
+        )
+        # L'adattatore è già applicato: niente peft_config, altrimenti SFTTrainer ne crea un altro
+        eval_timer = EvalTimeCallback()
+        trainer = SFTTrainer(
+            model=model,
+            train_dataset=train_dataset,
+            eval_dataset=val_subsample,
+            data_collator=data_collator,
+            max_seq_length=train_seq_length,
+            dataset_text_field="text",
+            tokenizer=tokenizer,
+            args=sft_config,
+            packing=False,
+            callbacks=[eval_timer],
+        )
+        last_checkpoint = get_last_checkpoint(sft_config.output_dir) \
+            if resume and os.path.isdir(sft_config.output_dir) else None
+        trainer_stats = trainer.train(resume_from_checkpoint=last_checkpoint)
+        print(eval_timer.summary(trainer_stats.metrics["train_runtime"]))
+        eval_results = trainer.evaluate(eval_dataset)  # validazione completa
+
+        results = training_results(size, trainer_stats, eval_results, eval_time=eval_timer.eval_time)
+        save_training_results(f"{model_name}_fine_tuned_on_{size}/training_comparison.csv", results)
+        model.save_pretrained(f"./fine_tuned_model_{directory.lower()}_{size}")
+        tokenizer.save_pretrained(f"./fine_tuned_model_{directory.lower()}_{size}")
+        print(results)
+
+        # Rimuove i layer LoRA: il modello base torna quello caricato all'inizio
+        base_model = model.unload()
+        del trainer, model
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return results
+
+    return run_sweep(sizes, train_size, state_file, checkpoint_dir, force)
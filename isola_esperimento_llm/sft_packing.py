@@ -0,0 +1,150 @@
+"""
+Packing delle sequenze per il fine-tuning LoRA con SFTTrainer.
+
+I prompt formattati sono lunghi poche centinaia di token: invece di un esempio per riga (con il
+padding fino al più lungo del batch) più esempi vengono concatenati in blocchi di `pack_length`
+token. Ogni esempio riparte dalla posizione 0 e una maschera di attenzione 4D a blocchi diagonali
+impedisce ai token di vedere gli esempi vicini, quindi i logit (e la loss) di ogni esempio sono gli
+stessi del training senza packing.
+
+Con la maschera 4D l'attenzione di un blocco costa comunque pack_length² (SDPA/eager calcolano
+anche le coppie mascherate): il packing conviene quando il padding eliminato supera questo costo,
+cioè con lunghezze molto variabili, oppure con `attn_implementation="flash_attention_2"`, dove la
+maschera non serve (`flash_attention=True`) perché i confini sono ricavati dai `position_ids` e
+ogni esempio costa solo la propria lunghezza².
+"""
+import bisect
+
+import numpy as np
+import torch
+from datasets import Dataset
+
+
+def auto_max_seq_length(lengths, quantile=1.0, multiple_of=64):
+    """
+    `max_seq_length` ricavato dalla distribuzione reale delle lunghezze in token.
+
+    :param lengths: Numero di token di ogni esempio.
+    :param quantile: Quantile da coprire (1.0 = l'esempio più lungo, nessun troncamento).
+    :param multiple_of: Arrotondamento per eccesso.
+    :return: Lunghezza massima delle sequenze.
+    """
+    length = int(np.ceil(np.quantile(np.asarray(lengths), quantile)))
+    return max(multiple_of, -(-length // multiple_of) * multiple_of)
+
+
+def pack_examples(lengths, pack_length):
+    """
+    Assegna gli esempi ai blocchi con l'euristica best-fit decreasing: dal più lungo al più corto,
+    ogni esempio va nel blocco con meno spazio libero che lo può contenere.
+
+    :param lengths: Numero di token di ogni esempio (al massimo `pack_length`).
+    :param pack_length: Token per blocco.
+    :return: Liste di indici degli esempi, una per blocco.
+    """
+    lengths = np.asarray(lengths)
+    if len(lengths) and lengths.max() > pack_length:
+        raise ValueError(f"Esempio di {lengths.max()} token più lungo del blocco ({pack_length})")
+    blocks = []
+    free = []  # (spazio libero, blocco) ordinati per spazio libero
+    for i in np.argsort(-lengths, kind='stable'):
+        pos = bisect.bisect_left(free, (lengths[i], -1))
+        if pos < len(free):
+            space, block = free.pop(pos)
+        else:
+            space, block = pack_length, len(blocks)
+            blocks.append([])
+        blocks[block].append(int(i))
+        bisect.insort(free, (space - int(lengths[i]), block))
+    return blocks
+
+
+def pack_dataset(dataset, pack_length, ignore_token_id=None, seed=42):
+    """
+    Dataset di blocchi impacchettati a partire da un dataset tokenizzato (`input_ids` senza padding).
+
+    Le `labels` sono gli `input_ids`, tranne il primo token di ogni esempio (nel training senza
+    packing non è mai un target) e, se indicato, `ignore_token_id`: il collator di SFTTrainer esclude
+    dalla loss i token uguali al pad, che per Llama coincide con l'EOS.
+
+    :param dataset: Dataset con la colonna `input_ids`.
+    :param pack_length: Token per blocco.
+    :param ignore_token_id: Token da escludere dalla loss (di solito `tokenizer.pad_token_id`).
+    :param seed: Seme con cui vengono mescolati i blocchi.
+    :return: Dataset con `input_ids`, `labels`, `position_ids` e `num_examples` per blocco.
+    """
+    sequences = [np.asarray(ids, dtype=np.int64) for ids in dataset["input_ids"]]
+    blocks = pack_examples([len(ids) for ids in sequences], pack_length)
+    order = np.random.default_rng(seed).permutation(len(blocks))
+    rows = {"input_ids": [], "labels": [], "position_ids": [], "num_examples": []}
+    for block in (blocks[i] for i in order):
+        input_ids = np.concatenate([sequences[i] for i in block])
+        labels = input_ids.copy()
+        if ignore_token_id is not None:
+            labels[labels == ignore_token_id] = -100
+        starts = np.cumsum([0] + [len(sequences[i]) for i in block[:-1]])
+        labels[starts] = -100
+        rows["input_ids"].append(input_ids.tolist())
+        rows["labels"].append(labels.tolist())
+        rows["position_ids"].append(np.concatenate([np.arange(len(sequences[i])) for i in block]).tolist())
+        rows["num_examples"].append(len(block))
+    return Dataset.from_dict(rows)
+
+
+def block_attention_mask(position_ids, valid, dtype=torch.float32):
+    """
+    Maschera 4D (batch, 1, query, key) in forma "invertita" (0 = visibile, minimo di `dtype` =
+    nascosto), come la accettano i modelli di transformers: causale e confinata all'esempio, che
+    inizia dove `position_ids` torna a 0. Le posizioni di padding vedono solo se stesse (nessuna
+    riga interamente mascherata, quindi nessun NaN nel backward).
+    """
+    segments = torch.cumsum((position_ids == 0) & valid, dim=1)
+    segments = torch.where(valid, segments, -1)
+    length = position_ids.shape[1]
+    causal = torch.tril(torch.ones(length, length, dtype=torch.bool, device=position_ids.device))
+    allowed = (segments[:, :, None] == segments[:, None, :]) & causal & valid[:, :, None]
+    allowed |= torch.eye(length, dtype=torch.bool, device=position_ids.device)
+    return torch.zeros(allowed.shape, dtype=dtype).masked_fill(~allowed, torch.finfo(dtype).min)[:, None]
+
+
+class PackedCollator:
+    """
+    Collator per i blocchi di `pack_dataset`: padding a destra fino al blocco più lungo del batch e
+    maschera di attenzione a blocchi diagonali (`block_attention_mask`).
+
+    :param pad_token_id: Id del token di padding.
+    :param dtype: Tipo della maschera (quello di calcolo del modello, es. `torch.float16`).
+    :param flash_attention: Se True (modello con flash_attention_2) non costruisce la maschera: i
+        confini degli esempi sono ricavati dai `position_ids`.
+    """
+
+    def __init__(self, pad_token_id, dtype=torch.float32, flash_attention=False):
+        self.pad_token_id = pad_token_id
+        self.dtype = dtype
+        self.flash_attention = flash_attention
+
+    def __call__(self, features):
+        length = max(len(f["input_ids"]) for f in features)
+
+        def padded(key, value):
+            return torch.tensor([list(f[key]) + [value] * (length - len(f[key])) for f in features])
+
+        input_ids = padded("input_ids", self.pad_token_id)
+        position_ids = padded("position_ids", 0)
+        if self.flash_attention:
+            return {"input_ids": input_ids, "labels": padded("labels", -100), "position_ids": position_ids}
+        valid = torch.tensor([[True] * len(f["input_ids"]) + [False] * (length - len(f["input_ids"])) for f in features])
+        return {
+            "input_ids": input_ids,
+            "labels": padded("labels", -100),
+            "position_ids": position_ids,
+            "attention_mask": block_attention_mask(position_ids, valid, self.dtype),
+        }
+
+
+def packing_summary(dataset, packed, pack_length):
+    """Esempi, blocchi e frazione di token utili nei blocchi (il resto è padding)."""
+    tokens = sum(len(ids) for ids in dataset["input_ids"])
+    return {"examples": len(dataset), "blocks": len(packed), "pack_length": pack_length,
+            "examples_per_block": len(dataset) / max(1, len(packed)),
+            "fill": tokens / max(1, len(packed) * pack_length)}